@@ -1,405 +1,489 @@
-from flask import Flask, render_template, jsonify, request, session, redirect, url_for, send_from_directory
+from flask import Blueprint, Flask, Response, current_app, g, render_template, jsonify, request, session, redirect, url_for, send_from_directory, stream_with_context
+from werkzeug.middleware.proxy_fix import ProxyFix
+import logging
 import os
 import sqlite3
-import bcrypt
-from datetime import datetime, timedelta
+import click
+import time
+import uuid
+import zlib
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from datetime import datetime, timezone
 from functools import wraps
+from urllib.parse import quote
 
-app = Flask(__name__)
+import config
+from config import load_config
+import db
+from db import data_version, get_db, get_db_path, release_db, transaction
+import archive
+import auth
+import backup
+import catalog
+import datagen
+import events
+import exports
+import inventory
+import logs
+import metrics
+import migrations
+import products
+import reorder
+import responses
+import rollups
+import sales
+import stats
+import writer
 
-# 基本設定
-app.secret_key = os.environ.get('SECRET_KEY', 'dev-secret-key')
-app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=2)
+logger = logging.getLogger(__name__)
 
-print("=== Flaskアプリケーション初期化完了 ===")
+# ルート・フック・CLIコマンドはすべてこのBlueprintに登録し、create_app でアプリに組み込む
+bp = Blueprint('main', __name__, cli_group=None)
+
+def create_app(config=None):
+    """アプリケーションを作成する
+
+    設定は起動時に1回だけ読み込む（config で上書きできる）。各モジュールは app.config の値を
+    config.get() で読むので、上書きした値はこのアプリの中でだけ有効になる。INIT_DATABASE が有効なら
+    スキーマの作成もここで行う（ensure_database を参照）。gunicorn --preload（wsgi.py）では
+    マスタープロセスで1回だけ実行され、ワーカーはfork後すぐにリクエストを受け付ける。
+    定期処理のスレッドはここでは起動しない（start_schedulers を参照）。
+    """
+    settings = load_config()
+    settings.update(config or {})
+    logs.setup(settings)
+    
+    app = Flask(__name__)
+    app.json = responses.JSONProvider(app)
+    app.config.update(settings)
+    if app.config['TRUSTED_PROXIES']:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'])
+    
+    # リクエスト終了時に接続を返却
+    app.teardown_appcontext(release_db)
+    app.register_blueprint(bp)
+    
+    with app.app_context():
+        if app.config['RESTORE_ON_START'] or app.config['INIT_DATABASE']:
+            ensure_database(app.config['DEFAULT_PASSWORD'], restore=app.config['RESTORE_ON_START'],
+                            migrate=app.config['INIT_DATABASE'])
+    logger.info("Flaskアプリケーション初期化完了", extra={'db_path': app.config['DATABASE_PATH']})
+    return app
+
+# 定期処理（スナップショット・発注点）と中断したアーカイブの移動のスレッドは各ワーカーの最初のリクエストで起動する。
+# create_app で起動すると gunicorn --preload ではマスタープロセスで動き、ワーカーの処理と並ばない。
+# 複数のワーカーで動いても、各スケジューラがファイルロックと最終実行時刻で1回に調整する
+_schedulers_pid = None
+
+@bp.before_app_request
+def start_schedulers():
+    global _schedulers_pid
+    if _schedulers_pid == os.getpid():
+        return
+    _schedulers_pid = os.getpid()
+    app = current_app._get_current_object()
+    if app.config['BACKUP_INTERVAL']:
+        backup.start_scheduler(app, app.config['BACKUP_INTERVAL'])
+    if app.config['REORDER_INTERVAL']:
+        reorder.start_scheduler(app, app.config['REORDER_INTERVAL'])
+    archive.start_resume(app, get_db())
+
+# 相関IDとアクセスログ
+@bp.before_app_request
+def start_request_logging():
+    g.request_started = time.perf_counter()
+    # 上流（プロキシ）から渡された相関IDがあれば引き継ぐ
+    g.request_id = request.headers.get('X-Request-ID', '')[:64] or uuid.uuid4().hex
+    logs.request_id_var.set(g.request_id)
+
+@bp.after_app_request
+def log_request(response):
+    request_id = g.get('request_id')
+    if request_id is None:
+        return response
+    response.headers['X-Request-ID'] = request_id
+    elapsed_ms = (time.perf_counter() - g.request_started) * 1000
+    # エラーと遅いリクエストは必ず、それ以外はサンプリングして出力する
+    important = response.status_code >= 500 or elapsed_ms >= current_app.config['LOG_SLOW_REQUEST_MS']
+    logger.log(logging.WARNING if important else logging.INFO, 'request', extra={
+        'method': request.method,
+        'path': request.path,
+        'status': response.status_code,
+        'duration_ms': round(elapsed_ms, 2),
+        'sampled': not important,
+    })
+    return response
+
+# レスポンスの圧縮（gzip / brotli）
+@bp.after_app_request
+def compress_response(response):
+    if not current_app.config['COMPRESS_RESPONSES']:
+        return response
+    return responses.compress(response, request.accept_encodings, current_app.config['COMPRESS_MIN_BYTES'])
+
+@bp.teardown_app_request
+def clear_request_id(exception=None):
+    logs.request_id_var.set(None)
+
+# リクエストごとの処理時間の計測（/metrics で出力。METRICS=0 で無効）
+metrics.Gauge('sse_subscribers', '/api/events の接続数', events.broadcaster.subscriber_count)
+
+@bp.before_app_request
+def start_request_metrics():
+    if current_app.config['METRICS']:
+        metrics.start_request()
+
+@bp.after_app_request
+def record_request_metrics(response):
+    if not current_app.config['METRICS']:
+        return response
+    # 未定義のURLはまとめて数える（ラベルの種類を増やさない）
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    method, status = request.method, response.status_code
+    sql_timing = current_app.config['METRICS_SQL']
+    if not response.is_streamed:
+        metrics.finish_request(method, endpoint, status, sql_timing)
+    elif response.mimetype != 'text/event-stream':
+        # ストリーミング（CSVエクスポート）は送信し終えた時点までを計測する
+        response.call_on_close(lambda: metrics.finish_request(method, endpoint, status, sql_timing))
+    return response
 
 # データベース初期化
-def init_database():
+def ensure_database(default_password=None, restore=False, migrate=True):
+    """未適用のマイグレーションがあれば init_database を実行する
+
+    restore=True ならその前に、データベースが空であれば最新のスナップショットから復元する。
+    ワーカーが同時に起動しても、ファイルロックで全プロセスを通して1回だけ実行される。
+    init_database を実行した場合は True を返す。
+    """
+    db_path = get_db_path()
+    os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+    with db.file_lock(db_path + '-lock'):
+        if restore:
+            backup.restore_on_start(db_path)
+        if not migrate or not migrations.pending(get_db()):
+            return False
+        init_database(default_password)
+        return True
+
+def init_database(default_password=None):
     try:
-        print("=== データベース初期化開始 ===")
-        # Render環境では必ず/tmp/inventory.dbを使用
-        if os.environ.get('RENDER'):
-            db_path = '/tmp/inventory.db'
-        else:
-            db_path = os.environ.get('DATABASE_PATH', 'inventory.db')
-        print(f"データベースパス: {db_path}")
+        db_path = get_db_path()
+        logger.info("データベース初期化開始", extra={'db_path': db_path})
         
         # データベースディレクトリの作成
         db_dir = os.path.dirname(db_path)
         if db_dir and not os.path.exists(db_dir):
             os.makedirs(db_dir, exist_ok=True)
-            print(f"データベースディレクトリを作成: {db_dir}")
+            logger.info("データベースディレクトリを作成", extra={'db_dir': db_dir})
         
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
+        conn = get_db()
+        # スキーマの作成・変更（migrations.py）
+        migrations.migrate(conn)
+        
+        with transaction(conn, immediate=True):
+            cursor = conn.cursor()
         
-        # ユーザーテーブル
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username VARCHAR UNIQUE NOT NULL,
-                password_hash VARCHAR NOT NULL,
-                role VARCHAR DEFAULT 'staff',
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # 商品テーブル
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS products (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                sku VARCHAR UNIQUE NOT NULL,
-                name VARCHAR NOT NULL,
-                price INTEGER NOT NULL,
-                quantity INTEGER DEFAULT 0,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # 売上履歴テーブル
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS sales_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                product_id INTEGER NOT NULL,
-                product_name VARCHAR NOT NULL,
-                quantity INTEGER NOT NULL,
-                unit_price INTEGER NOT NULL,
-                total_amount INTEGER NOT NULL,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (product_id) REFERENCES products (id)
-            )
-        ''')
-        
-        # 初期データの挿入
-        cursor.execute("SELECT COUNT(*) FROM users")
-        user_count = cursor.fetchone()[0]
-        print(f"既存のユーザー数: {user_count}")
-        
-        if user_count == 0:
-            print("初期ユーザーを作成中...")
-            # デフォルトパスワードは環境変数から取得、なければ自動生成
-            default_password = os.environ.get('DEFAULT_PASSWORD', 'Admin@2024!')
-            password_hash = bcrypt.hashpw(default_password.encode('utf-8'), bcrypt.gensalt())
-            print("初期ユーザーを作成しました")
+            # 初期データの挿入
+            cursor.execute("SELECT COUNT(*) FROM users")
+            user_count = cursor.fetchone()[0]
+            logger.debug("既存のユーザー数", extra={'user_count': user_count})
+        
+            if user_count == 0:
+                # デフォルトパスワードは設定（環境変数 DEFAULT_PASSWORD）から取得
+                default_password = default_password or config.get('DEFAULT_PASSWORD')
+                password_hash = auth.hash_password(default_password)
             
-            cursor.execute("INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?)", 
-                          ("admin", password_hash, "admin"))
-            print("adminユーザーを作成しました")
+                cursor.execute("INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?)", 
+                              ("admin", password_hash, "admin"))
+                logger.info("adminユーザーを作成しました")
             
-            # サンプル商品データ（レポートの要件に合わせて）
-            sample_products = [
-                ("TSH001", "ベーシックTシャツ", 2500, 50),
-                ("JKT002", "デニムジャケット", 8500, 20),
-                ("PTS003", "スキニーパンツ", 4500, 30),
-                ("SWT004", "カジュアルスウェット", 3500, 25),
-                ("SHO005", "スニーカー", 12000, 15)
-            ]
-            cursor.executemany("INSERT INTO products (sku, name, price, quantity) VALUES (?, ?, ?, ?)", 
-                              sample_products)
-            print(f"{len(sample_products)}個のサンプル商品を追加しました")
-        
-        conn.commit()
-        conn.close()
-        print("=== データベース初期化完了 ===")
+                # サンプル商品データ（レポートの要件に合わせて）
+                sample_products = [
+                    ("TSH001", "ベーシックTシャツ", 2500, 50),
+                    ("JKT002", "デニムジャケット", 8500, 20),
+                    ("PTS003", "スキニーパンツ", 4500, 30),
+                    ("SWT004", "カジュアルスウェット", 3500, 25),
+                    ("SHO005", "スニーカー", 12000, 15)
+                ]
+                cursor.executemany("INSERT INTO products (sku, name, price, quantity) VALUES (?, ?, ?, ?)", 
+                                  sample_products)
+                logger.info("サンプル商品を追加しました", extra={'count': len(sample_products)})
+        
+        logger.info("データベース初期化完了", extra={'db_path': db_path})
         
         # 初期化後の確認
-        if os.path.exists(db_path):
-            print(f"データベースファイルが正常に作成されました: {db_path}")
-        else:
-            print(f"警告: データベースファイルが作成されませんでした: {db_path}")
+        if not os.path.exists(db_path):
+            logger.warning("データベースファイルが作成されませんでした", extra={'db_path': db_path})
         
-    except Exception as e:
-        print(f"=== データベース初期化エラー: {e} ===")
-        import traceback
-        print(f"エラー詳細: {traceback.format_exc()}")
-        raise e  # エラーを再発生させる
+    except Exception:
+        logger.exception("データベース初期化エラー")
+        raise  # エラーを再発生させる
+
+# ログインの拒否（試行回数の制限・検証待ちの混雑）
+def login_rejected(message, status, retry_after):
+    response = jsonify({'success': False, 'message': message})
+    response.status_code = status
+    response.headers['Retry-After'] = str(retry_after)
+    return response
 
-# パスワード検証
-def verify_password(password, hashed):
+# 正の整数チェック（不正ならNone）
+def positive_int(value):
     try:
-        if not isinstance(hashed, bytes):
-            hashed = hashed.encode('utf-8')
-        return bcrypt.checkpw(password.encode('utf-8'), hashed)
-    except Exception as e:
-        print(f"パスワード検証エラー: {e}")
-        return False
+        value = int(value)
+    except (ValueError, TypeError):
+        return None
+    return value if value > 0 else None
 
 # ログイン必須デコレータ
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
-            return redirect(url_for('login'))
+            return redirect(url_for('main.login'))
         return f(*args, **kwargs)
     return decorated_function
 
+# 条件付きGET（ETag / If-None-Match）
+def conditional_get(f):
+    """データバージョンからETagを作り、変更がなければDBを読まずに304を返す"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        # バージョンはDBを読む前に取得する（読んでいる間に書き込みがあっても古いETagになるだけ）
+        epoch, version, modified = data_version()
+        etag = f"{epoch:x}-{version}-{zlib.crc32(request.full_path.encode('utf-8')):x}"
+        if request.if_none_match.contains_weak(etag):
+            response = current_app.response_class(status=304)
+        else:
+            response = current_app.make_response(f(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag, weak=True)
+        response.last_modified = datetime.fromtimestamp(int(modified), timezone.utc)
+        response.cache_control.no_cache = True
+        return response
+    return decorated_function
+
 # ルート
-@app.route('/')
+@bp.route('/')
 def index():
     # ログインしていなくてもアクセス可能
     return render_template('index.html')
 
-@app.route('/login')
+@bp.route('/login')
 def login():
     if 'user_id' in session:
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     return render_template('login.html')
 
-@app.route('/api/login', methods=['POST'])
+@bp.route('/api/login', methods=['POST'])
 def login_api():
     try:
         data = request.get_json()
         username = data.get('username')
         password = data.get('password')
         
-        print(f"=== ログイン試行 ===")
-        print(f"ユーザー名: {username}")
-        print(f"パスワード: {password}")
-        
         if not username or not password:
             return jsonify({'success': False, 'message': 'ユーザー名とパスワードを入力してください'})
         
-        # Render環境では必ず/tmp/inventory.dbを使用
-        if os.environ.get('RENDER'):
-            db_path = '/tmp/inventory.db'
-        else:
-            db_path = os.environ.get('DATABASE_PATH', 'inventory.db')
-        print(f"データベースパス: {db_path}")
-        
-        # データベースファイルの存在確認
-        if not os.path.exists(db_path):
-            print(f"データベースファイルが存在しません: {db_path}")
-            return jsonify({'success': False, 'message': 'データベースが初期化されていません。データベース初期化ボタンをクリックしてください。'})
-        
         try:
-            conn = sqlite3.connect(db_path)
+            conn = get_db()
         except Exception as db_error:
-            print(f"データベース接続エラー: {db_error}")
+            logger.exception("データベース接続エラー")
             return jsonify({'success': False, 'message': f'データベース接続エラー: {str(db_error)}'})
         
+        # 失敗が続いているユーザー名・接続元は検証せずに断る
+        locked = auth.locked_for(username, request.remote_addr)
+        if locked:
+            logger.warning("ログイン制限中", extra={'username': username, 'remote_addr': request.remote_addr})
+            return login_rejected('ログインの失敗が続いたため、しばらくしてから再度お試しください', 429, locked)
+        
         cursor = conn.cursor()
         
         cursor.execute("SELECT id, role, password_hash FROM users WHERE username = ?", (username,))
         user = cursor.fetchone()
         
         if user:
-            print(f"ユーザーが見つかりました: {user[1]}")
-            print(f"DBパスワードハッシュ: {user[2]}")
-            
-            password_valid = verify_password(password, user[2])
-            print(f"パスワード検証結果: {password_valid}")
+            try:
+                password_valid = auth.verify_password(password, user[2])
+            except (auth.PasswordPoolBusy, FutureTimeoutError):
+                logger.warning("パスワード検証待ちが混雑しています", extra={'username': username})
+                return login_rejected('ログインが混み合っています。しばらくしてから再度お試しください', 503, 1)
             
             if password_valid:
+                auth.record_success(username)
+                if auth.needs_rehash(user[2]):
+                    auth.rehash_in_background(user[0], password, user[2])
+                
                 session.permanent = True
                 session['user_id'] = user[0]
                 session['username'] = username
                 session['role'] = user[1]
                 
-                conn.close()
-                print("ログイン成功")
+                logger.info("ログイン成功", extra={'username': username})
                 return jsonify({'success': True, 'user': {'username': username, 'role': user[1]}})
             else:
-                conn.close()
-                print("パスワードが間違っています")
+                logger.warning("ログイン失敗: パスワードが間違っています", extra={'username': username})
+                auth.record_failure(username, request.remote_addr)
                 return jsonify({'success': False, 'message': 'パスワードが間違っています'})
         else:
-            conn.close()
-            print("ユーザーが見つかりません")
+            logger.warning("ログイン失敗: ユーザーが見つかりません", extra={'username': username})
+            auth.record_failure(username, request.remote_addr)
             return jsonify({'success': False, 'message': 'ユーザーが見つかりません'})
             
     except Exception as e:
-        print(f"ログインエラー: {e}")
-        import traceback
-        print(f"エラー詳細: {traceback.format_exc()}")
+        logger.exception("ログインエラー")
         return jsonify({'success': False, 'message': f'ログイン処理エラー: {str(e)}'})
 
-@app.route('/api/logout', methods=['POST'])
+@bp.route('/api/logout', methods=['POST'])
 def logout():
     session.clear()
     return jsonify({'success': True})
 
-@app.route('/api/init-db', methods=['POST'])
+@bp.route('/api/init-db', methods=['POST'])
 def init_database_api():
     try:
-        print("=== データベース初期化API呼び出し ===")
+        logger.info("データベース初期化API呼び出し")
         init_database()
         
         # 初期化後の確認
-        if os.environ.get('RENDER'):
-            db_path = '/tmp/inventory.db'
-        else:
-            db_path = os.environ.get('DATABASE_PATH', 'inventory.db')
-        
-        print(f"初期化後のデータベースパス確認: {db_path}")
+        db_path = get_db_path()
         
         if not os.path.exists(db_path):
-            print(f"初期化後もデータベースファイルが存在しません: {db_path}")
+            logger.error("初期化後もデータベースファイルが存在しません", extra={'db_path': db_path})
             return jsonify({'success': False, 'message': 'データベース初期化に失敗しました。ファイルが作成されませんでした。'})
         
         try:
-            conn = sqlite3.connect(db_path)
+            conn = get_db()
         except Exception as db_error:
-            print(f"初期化後のデータベース接続エラー: {db_error}")
+            logger.exception("初期化後のデータベース接続エラー")
             return jsonify({'success': False, 'message': f'初期化後のデータベース接続エラー: {str(db_error)}'})
         cursor = conn.cursor()
         cursor.execute("SELECT username, role FROM users")
         users = cursor.fetchall()
-        conn.close()
         
-        print(f"初期化後のユーザー: {users}")
         return jsonify({'success': True, 'message': f'データベースが初期化されました。ユーザー: {users}'})
     except Exception as e:
-        print(f"データベース初期化APIエラー: {e}")
-        import traceback
-        print(f"エラー詳細: {traceback.format_exc()}")
+        logger.exception("データベース初期化APIエラー")
         return jsonify({'success': False, 'message': f'エラー: {str(e)}'})
 
-@app.route('/api/dashboard')
+@bp.route('/api/dashboard')
+@conditional_get
 def dashboard():
     # ゲストユーザーでもダッシュボードを見られるように
     try:
-        if os.environ.get('RENDER'):
-            db_path = '/tmp/inventory.db'
-        else:
-            db_path = os.environ.get('DATABASE_PATH', 'inventory.db')
+        conn = get_db()
         
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
+        # 商品統計（書き込み時にトリガーで更新済みの値を読むだけ）
+        dashboard_stats = stats.read_stats(conn.cursor())
+        if dashboard_stats is None:
+            # 集計行がない（削除された）場合は元テーブルから作り直す
+            with transaction(conn, immediate=True):
+                dashboard_stats = stats.rebuild_stats(conn.cursor())
         
-        # 商品統計
-        cursor.execute("SELECT COUNT(*) FROM products")
-        total_products = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT SUM(quantity) FROM products")
-        total_stock = cursor.fetchone()[0] or 0
-        
-        cursor.execute("SELECT COUNT(*) FROM products WHERE quantity < 10")
-        low_stock_count = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT SUM(total_amount) FROM sales_history")
-        total_sales = cursor.fetchone()[0] or 0
-        
-        conn.close()
-        
-        return jsonify({
-            'total_products': total_products,
-            'total_stock': total_stock,
-            'low_stock_count': low_stock_count,
-            'total_sales': total_sales
-        })
+        return jsonify(dashboard_stats)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/products', methods=['GET'])
+@bp.route('/api/products', methods=['GET'])
+@conditional_get
 def get_products():
     # ゲストユーザーでも商品一覧を見られるように
     try:
-        if os.environ.get('RENDER'):
-            db_path = '/tmp/inventory.db'
-        else:
-            db_path = os.environ.get('DATABASE_PATH', 'inventory.db')
-        
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT id, sku, name, price, quantity FROM products ORDER BY name")
-        products = []
-        for row in cursor.fetchall():
-            products.append({
-                'id': row[0],
-                'sku': row[1],
-                'name': row[2],
-                'price': row[3],
-                'quantity': row[4]
-            })
-        
-        conn.close()
-        return jsonify(products)
+        query = request.args.get('q', '').strip()
+        field = request.args.get('field', 'all')
+        sort = request.args.get('sort', 'name')
+        order = request.args.get('order', 'asc')
+        limit = request.args.get('limit', type=int)
+        after = request.args.get('cursor')
+        response_format = request.args.get('format', 'objects')
+        if (field not in products.SEARCH_FIELDS or sort not in products.SORT_COLUMNS or order not in ('asc', 'desc')
+                or response_format not in responses.FORMATS):
+            return jsonify({'error': '検索条件が不正です'}), 400
+        if after and limit is None:
+            limit = products.DEFAULT_SEARCH_LIMIT
+        try:
+            product_list, next_cursor = catalog.search(get_db().cursor(), query, field, sort, order, limit, after,
+                                                       columnar=response_format == 'columns')
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        response = jsonify(product_list)
+        # 続きがある場合は次ページのカーソルをヘッダーで返す（本文は従来どおり配列）
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/products', methods=['POST'])
+@bp.route('/api/products', methods=['POST'])
 @login_required
 def add_product():
     try:
-        print("=== 商品登録開始 ===")
         data = request.get_json()
-        print(f"受信データ: {data}")
         
         if not data:
             return jsonify({'success': False, 'message': 'データが送信されていません'})
         
-        sku = data.get('sku', '').strip()
-        name = data.get('name', '').strip()
-        price = data.get('price')
-        quantity = data.get('quantity')
-        
-        print(f"SKU: {sku}")
-        print(f"商品名: {name}")
-        print(f"価格: {price}")
-        print(f"数量: {quantity}")
-        
-        # 必須項目チェック
-        if not sku:
-            return jsonify({'success': False, 'message': 'SKUを入力してください'})
-        if not name:
-            return jsonify({'success': False, 'message': '商品名を入力してください'})
-        if price is None or price == '':
-            return jsonify({'success': False, 'message': '価格を入力してください'})
-        if quantity is None or quantity == '':
-            return jsonify({'success': False, 'message': '数量を入力してください'})
-        
-        # 価格と数量の妥当性チェック
-        try:
-            price = int(price)
-            quantity = int(quantity)
-            if price <= 0:
-                return jsonify({'success': False, 'message': '価格は0より大きい値を入力してください'})
-            if quantity < 0:
-                return jsonify({'success': False, 'message': '数量は0以上の値を入力してください'})
-        except (ValueError, TypeError):
-            return jsonify({'success': False, 'message': '価格と数量は数値で入力してください'})
-        
-        if os.environ.get('RENDER'):
-            db_path = '/tmp/inventory.db'
-        else:
-            db_path = os.environ.get('DATABASE_PATH', 'inventory.db')
+        # 入力値チェック（一括取り込みと共通）
+        values, error = products.validate_product(data)
+        if error:
+            return jsonify({'success': False, 'message': error})
+        sku, name, price, quantity = values
         
-        print(f"データベースパス: {db_path}")
-        
-        # データベースファイルの存在確認
-        if not os.path.exists(db_path):
-            print(f"データベースファイルが存在しません: {db_path}")
-            return jsonify({'success': False, 'message': 'データベースが初期化されていません。データベース初期化ボタンをクリックしてください。'})
+        conn = get_db()
         
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
-        print("データベース接続成功")
-        
-        # SKUの重複チェック
-        cursor.execute("SELECT COUNT(*) FROM products WHERE sku = ?", (sku,))
-        if cursor.fetchone()[0] > 0:
-            conn.close()
+        # SKUの重複はUNIQUE制約で検出する
+        try:
+            with transaction(conn):
+                conn.execute("INSERT INTO products (sku, name, price, quantity) VALUES (?, ?, ?, ?)", 
+                             (sku, name, price, quantity))
+        except sqlite3.IntegrityError:
+            logger.info("商品登録: SKU重複", extra={'sku': sku})
             return jsonify({'success': False, 'message': f'SKU "{sku}" は既に存在します'})
         
-        cursor.execute("INSERT INTO products (sku, name, price, quantity) VALUES (?, ?, ?, ?)", 
-                      (sku, name, price, quantity))
-        conn.commit()
-        conn.close()
-        
-        print("商品登録成功")
+        logger.debug("商品登録", extra={'sku': sku, 'price': price, 'quantity': quantity, 'sampled': True})
+        events.publish_kpis()
         return jsonify({'success': True, 'message': '商品が追加されました'})
-    except sqlite3.IntegrityError as e:
-        print(f"IntegrityError: {e}")
-        return jsonify({'success': False, 'message': 'SKUが既に存在します'})
     except Exception as e:
-        print(f"商品登録エラー: {e}")
-        import traceback
-        print(f"エラー詳細: {traceback.format_exc()}")
+        logger.exception("商品登録エラー")
+        return jsonify({'success': False, 'message': f'エラー: {str(e)}'})
+
+def detect_import_format(filename, content_type):
+    """ファイル名・Content-Typeから取り込み形式を判定する"""
+    fmt = request.args.get('format')
+    if fmt:
+        return fmt
+    if filename and filename.lower().endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    if 'json' in (content_type or ''):
+        return 'jsonl'
+    return 'csv'
+
+@bp.route('/api/products/import', methods=['POST'])
+@login_required
+def import_products():
+    """CSV / JSONL の商品一括取り込み（multipartの file またはリクエスト本文）"""
+    try:
+        upload = request.files.get('file')
+        if upload:
+            stream, fmt = upload.stream, detect_import_format(upload.filename, upload.mimetype)
+        else:
+            stream, fmt = request.stream, detect_import_format(None, request.mimetype)
+        if fmt not in products.IMPORT_FORMATS:
+            return jsonify({'success': False, 'message': f'形式は {", ".join(products.IMPORT_FORMATS)} のいずれかを指定してください'})
+        
+        report = products.import_products(get_db(), products.iter_rows(stream, fmt))
+        events.publish_kpis()
+        return jsonify({
+            'success': True,
+            'message': f"{report['imported']}件を取り込みました（不合格 {report['rejected_count']}件）",
+            'report': report
+        })
+    except Exception as e:
         return jsonify({'success': False, 'message': f'エラー: {str(e)}'})
 
-@app.route('/api/inventory/inbound', methods=['POST'])
+@bp.route('/api/inventory/inbound', methods=['POST'])
 @login_required
 def inbound_inventory():
     try:
@@ -409,24 +493,20 @@ def inbound_inventory():
         
         if not all([product_id, quantity]):
             return jsonify({'success': False, 'message': '商品と数量を選択してください'})
+        quantity = positive_int(quantity)
+        if quantity is None:
+            return jsonify({'success': False, 'message': '数量は1以上の整数で入力してください'})
         
-        if os.environ.get('RENDER'):
-            db_path = '/tmp/inventory.db'
-        else:
-            db_path = os.environ.get('DATABASE_PATH', 'inventory.db')
-        
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
+        writer.execute(inventory.receive_stock, product_id, quantity)
         
-        cursor.execute("UPDATE products SET quantity = quantity + ? WHERE id = ?", (quantity, product_id))
-        conn.commit()
-        conn.close()
+        events.publish_stock_change(get_db().cursor(), product_id, quantity)
+        events.publish_kpis()
         
         return jsonify({'success': True, 'message': '入庫処理が完了しました'})
     except Exception as e:
         return jsonify({'success': False, 'message': f'エラー: {str(e)}'})
 
-@app.route('/api/inventory/outbound', methods=['POST'])
+@bp.route('/api/inventory/outbound', methods=['POST'])
 @login_required
 def outbound_inventory():
     try:
@@ -436,31 +516,103 @@ def outbound_inventory():
         
         if not all([product_id, quantity]):
             return jsonify({'success': False, 'message': '商品と数量を選択してください'})
+        quantity = positive_int(quantity)
+        if quantity is None:
+            return jsonify({'success': False, 'message': '数量は1以上の整数で入力してください'})
         
-        if os.environ.get('RENDER'):
-            db_path = '/tmp/inventory.db'
-        else:
-            db_path = os.environ.get('DATABASE_PATH', 'inventory.db')
+        # 在庫確認と減算を1文で行う
+        error = writer.execute(inventory.reserve_stock, product_id, quantity)
+        if error:
+            return jsonify({'success': False, 'message': error})
         
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
-        # 在庫確認
-        cursor.execute("SELECT quantity FROM products WHERE id = ?", (product_id,))
-        current_quantity = cursor.fetchone()[0]
-        
-        if current_quantity < quantity:
-            return jsonify({'success': False, 'message': '在庫が不足しています'})
-        
-        cursor.execute("UPDATE products SET quantity = quantity - ? WHERE id = ?", (quantity, product_id))
-        conn.commit()
-        conn.close()
+        events.publish_stock_change(get_db().cursor(), product_id, -quantity)
+        events.publish_kpis()
         
         return jsonify({'success': True, 'message': '出庫処理が完了しました'})
     except Exception as e:
         return jsonify({'success': False, 'message': f'エラー: {str(e)}'})
 
-@app.route('/api/sales', methods=['POST'])
+@bp.route('/api/inventory/at-risk')
+@conditional_get
+def inventory_at_risk():
+    # 在庫僅少（在庫 < 発注点）の商品だけを在庫日数の短い順に返す（部分インデックスで読む）
+    try:
+        limit = request.args.get('limit', reorder.AT_RISK_LIMIT, type=int)
+        response_format = request.args.get('format', 'objects')
+        if not 1 <= limit <= reorder.MAX_AT_RISK_LIMIT or response_format not in responses.FORMATS:
+            return jsonify({'error': '検索条件が不正です'}), 400
+        rows = reorder.at_risk(get_db().cursor(), limit)
+        if response_format == 'columns':
+            return jsonify(responses.columns(reorder.AT_RISK_COLUMNS, rows))
+        return jsonify([dict(zip(reorder.AT_RISK_COLUMNS, row)) for row in rows])
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/products/<int:product_id>/reorder-point', methods=['PUT'])
+@login_required
+def set_reorder_point(product_id):
+    try:
+        data = request.get_json() or {}
+        point = data.get('reorder_point')
+        # null で販売速度からの自動計算に戻す
+        if point is not None and (isinstance(point, bool) or not isinstance(point, int) or point < 0):
+            return jsonify({'success': False, 'message': '発注点は0以上の整数で指定してください'})
+        conn = get_db()
+        with transaction(conn, immediate=True):
+            found = reorder.set_manual_point(conn.cursor(), product_id, point)
+        if not found:
+            return jsonify({'success': False, 'message': '商品が見つかりません'})
+        events.publish_kpis()
+        return jsonify({'success': True, 'message': '発注点を更新しました'})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'エラー: {str(e)}'})
+
+@bp.route('/api/inventory/batch', methods=['POST'])
+@login_required
+def batch_inventory():
+    try:
+        data = request.get_json()
+        lines = (data or {}).get('lines')
+        
+        if not isinstance(lines, list) or not lines:
+            return jsonify({'success': False, 'message': '更新する行を指定してください'})
+        if len(lines) > inventory.MAX_BATCH_LINES:
+            return jsonify({'success': False, 'message': f'一度に更新できるのは{inventory.MAX_BATCH_LINES}行までです'})
+        
+        success, results = inventory.apply_batch(get_db(), lines)
+        if not success:
+            return jsonify({'success': False, 'message': 'エラーのある行があるため在庫は更新されませんでした', 'results': results})
+        
+        net = {}
+        for result in results:
+            net[result['product_id']] = net.get(result['product_id'], 0) + result['delta']
+        cursor = get_db().cursor()
+        for product_id, delta in net.items():
+            events.publish_stock_change(cursor, product_id, delta)
+        events.publish_kpis()
+        return jsonify({'success': True, 'message': f'{len(results)}行の在庫を更新しました', 'results': results})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'エラー: {str(e)}'})
+
+@bp.route('/api/inventory/set-all', methods=['POST'])
+@login_required
+def set_all_inventory():
+    try:
+        data = request.get_json() or {}
+        quantity = data.get('quantity')
+        if isinstance(quantity, bool) or not isinstance(quantity, int) or quantity < 0:
+            return jsonify({'success': False, 'message': '在庫数は0以上の整数で指定してください'})
+
+        # 商品数によらず1文で更新する（MAX_BATCH_LINES の制限を受けない）
+        changed = inventory.set_all(get_db(), quantity)
+        # 商品ごとの通知の代わりに、画面に全体を取り直させる
+        events.broadcaster.publish('resync', {})
+        events.publish_kpis()
+        return jsonify({'success': True, 'message': f'{changed}件の商品の在庫数を{quantity}に設定しました', 'changed': changed})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'エラー: {str(e)}'})
+
+@bp.route('/api/sales', methods=['POST'])
 @login_required
 def add_sale():
     try:
@@ -472,105 +624,149 @@ def add_sale():
         if not all([product_id, quantity, price]):
             return jsonify({'success': False, 'message': 'すべての項目を入力してください'})
         
-        if os.environ.get('RENDER'):
-            db_path = '/tmp/inventory.db'
-        else:
-            db_path = os.environ.get('DATABASE_PATH', 'inventory.db')
-        
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
-        # 商品名取得
-        cursor.execute("SELECT name, quantity FROM products WHERE id = ?", (product_id,))
-        product_info = cursor.fetchone()
-        if not product_info:
-            return jsonify({'success': False, 'message': '商品が見つかりません'})
-        
-        product_name, current_quantity = product_info
-        
-        # 在庫確認
-        if current_quantity < quantity:
-            return jsonify({'success': False, 'message': '在庫が不足しています'})
-        
-        total_amount = quantity * price
+        quantity, price = positive_int(quantity), positive_int(price)
+        if quantity is None or price is None:
+            return jsonify({'success': False, 'message': '数量と単価は1以上の整数で入力してください'})
         
-        # 売上登録
-        cursor.execute("""
-            INSERT INTO sales_history (product_id, product_name, quantity, unit_price, total_amount) 
-            VALUES (?, ?, ?, ?, ?)
-        """, (product_id, product_name, quantity, price, total_amount))
+        # 在庫引当と売上登録を1つのトランザクションで行う（GROUP_COMMIT=1 ならほかの書き込みとまとめてコミット）
+        error = writer.execute(sales.apply_sale, product_id, quantity, price)
+        if error:
+            return jsonify({'success': False, 'message': error})
         
-        # 在庫更新
-        cursor.execute("UPDATE products SET quantity = quantity - ? WHERE id = ?", (quantity, product_id))
-        
-        conn.commit()
-        conn.close()
+        cursor = get_db().cursor()
+        events.publish_sale(cursor, product_id, quantity, quantity * price)
+        events.publish_stock_change(cursor, product_id, -quantity)
+        events.publish_kpis()
         
         return jsonify({'success': True, 'message': '売上が登録されました'})
     except Exception as e:
         return jsonify({'success': False, 'message': f'エラー: {str(e)}'})
 
-@app.route('/api/sales-analysis')
+@bp.route('/api/sales-analysis')
 @login_required
+@conditional_get
 def sales_analysis():
     try:
-        if os.environ.get('RENDER'):
-            db_path = '/tmp/inventory.db'
-        else:
-            db_path = os.environ.get('DATABASE_PATH', 'inventory.db')
-        
-        conn = sqlite3.connect(db_path)
+        try:
+            start, end = sales.parse_date_range(request.args.get('start_date'), request.args.get('end_date'))
+            limit = int(request.args.get('limit', sales.DEFAULT_PAGE_SIZE))
+            after = request.args.get('cursor')
+            if after:
+                sales.decode_cursor(after)
+            response_format = request.args.get('format', 'objects')
+            if response_format not in responses.FORMATS:
+                raise ValueError(f'formatは {", ".join(responses.FORMATS)} のいずれかを指定してください')
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        conn = get_db()
         cursor = conn.cursor()
         
-        # 商品別売上データ
-        cursor.execute("""
-            SELECT product_name, SUM(total_amount) as sales 
-            FROM sales_history 
-            GROUP BY product_name 
-            ORDER BY sales DESC
-        """)
-        chart_data = [{'product': row[0], 'sales': row[1]} for row in cursor.fetchall()]
-        
-        # 売上履歴
-        cursor.execute("""
-            SELECT created_at, product_name, quantity, unit_price, total_amount 
-            FROM sales_history 
-            ORDER BY created_at DESC 
-            LIMIT 50
-        """)
-        sales_history = [{
-            'date': row[0], 
-            'product_name': row[1], 
-            'quantity': row[2], 
-            'price': row[3], 
-            'total': row[4]
-        } for row in cursor.fetchall()]
-        
-        conn.close()
+        # 売上履歴（キーセット方式のページング）
+        sales_history, next_cursor = sales.history_page(cursor, start, end, limit, after,
+                                                        columnar=response_format == 'columns')
+        result = {
+            'sales_history': sales_history,
+            'next_cursor': next_cursor
+        }
+        
+        # 商品別売上データ（先頭ページのみ）
+        if not after:
+            result['chart_data'] = sales.product_totals(cursor, start, end)
+        
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({'error': str(e)})
+
+@bp.route('/api/sales-analysis/timeseries')
+@login_required
+@conditional_get
+def sales_timeseries():
+    """ロールアップテーブルのみを読む期間別・商品別の売上集計"""
+    try:
+        bucket = request.args.get('bucket', 'month')
+        if bucket not in rollups.BUCKETS:
+            return jsonify({'error': f'bucketは {", ".join(rollups.BUCKETS)} のいずれかを指定してください'}), 400
+        try:
+            start, end = sales.parse_date_range(request.args.get('start_date'), request.args.get('end_date'))
+            product_id = request.args.get('product_id', type=int)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
+        cursor = get_db().cursor()
         return jsonify({
-            'chart_data': chart_data,
-            'sales_history': sales_history
+            'bucket': bucket,
+            'series': rollups.timeseries(cursor, bucket, start, end, product_id),
+            'products': rollups.product_totals(cursor, bucket, start, end)
         })
     except Exception as e:
-        return jsonify({'error': str(e)})
+        return jsonify({'error': str(e)}), 500
+
+def csv_download(chunks, filename, compress):
+    """CSVチャンクのジェネレーターをダウンロード用のストリーミングレスポンスにする"""
+    if compress:
+        filename += '.gz'
+    response = Response(stream_with_context(exports.encode(chunks, compress)),
+                        mimetype='application/gzip' if compress else 'text/csv')
+    if not compress:
+        response.headers['Content-Type'] = 'text/csv; charset=utf-8'
+    response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(filename)}"
+    return response
 
-@app.route('/health')
+@bp.route('/api/export/sales')
+@login_required
+def export_sales():
+    try:
+        start, end = sales.parse_date_range(request.args.get('start_date'), request.args.get('end_date'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    filename = f"売上データ_{request.args.get('start_date', '')}_{request.args.get('end_date', '')}.csv"
+    return csv_download(exports.iter_sales_csv(start, end), filename, request.args.get('gzip') == '1')
+
+@bp.route('/api/export/products')
+@login_required
+def export_products():
+    filename = f"商品一覧_{datetime.now().strftime('%Y-%m-%d')}.csv"
+    return csv_download(exports.iter_products_csv(), filename, request.args.get('gzip') == '1')
+
+@bp.route('/api/events')
+def event_stream():
+    """KPIの変化・在庫僅少の発生/解消・売上登録をServer-Sent Eventsで配信する"""
+    subscriber = events.broadcaster.subscribe()
+    if subscriber is None:
+        # 上限を超えた接続でワーカーのスレッドを使い切らない（画面側は定期取得に切り替える）
+        response = jsonify({'error': '接続数が上限に達しています'})
+        response.headers['Retry-After'] = '30'
+        return response, 503
+    response = Response(stream_with_context(events.stream(subscriber)), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # プロキシでのバッファリングを無効化
+    return response
+
+@bp.route('/metrics')
+def metrics_endpoint():
+    """Prometheusのテキスト形式でメトリクスを返す（このワーカープロセスの値）"""
+    if not current_app.config['METRICS']:
+        return jsonify({'error': 'メトリクスは無効です'}), 404
+    token = current_app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return jsonify({'error': '認証が必要です'}), 401
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@bp.route('/health')
 def health():
     return jsonify({'status': 'ok', 'message': 'アプリケーションは正常に動作しています'})
 
-@app.route('/test')
+@bp.route('/test')
 def test():
     return jsonify({'status': 'ok', 'message': 'テストエンドポイントが正常に動作しています'})
 
-@app.route('/api/check-db')
+@bp.route('/api/check-db')
 def check_database():
     try:
-        if os.environ.get('RENDER'):
-            db_path = '/tmp/inventory.db'
-        else:
-            db_path = os.environ.get('DATABASE_PATH', 'inventory.db')
-        conn = sqlite3.connect(db_path)
+        db_path = get_db_path()
+        conn = get_db()
         cursor = conn.cursor()
         
         # ユーザーテーブルの確認
@@ -593,7 +789,6 @@ def check_database():
         else:
             product_count = 0
         
-        conn.close()
         
         return jsonify({
             'status': 'ok',
@@ -606,7 +801,7 @@ def check_database():
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)})
 
-@app.route('/api/check-user-status')
+@bp.route('/api/check-user-status')
 def check_user_status():
     """ユーザーの認証状態を確認するAPI"""
     try:
@@ -623,23 +818,207 @@ def check_user_status():
                 'message': 'ユーザーがログインしていません'
             })
     except Exception as e:
-        print(f"ユーザー状態確認エラー: {e}")
+        logger.exception("ユーザー状態確認エラー")
         return jsonify({
             'authenticated': False,
             'error': str(e)
         })
 
-@app.route('/static/<path:filename>')
+@bp.cli.command('init-db')
+def init_db_command():
+    """スキーマを作成し、初期データを投入する（INIT_DATABASE=0 で起動する場合に使う）"""
+    init_database()
+    click.echo("データベースを初期化しました")
+
+@bp.cli.command('migrate')
+@click.option('--dry-run', is_flag=True, help='適用せずに操作ごとの所要時間と書き込みロックの見積もりを表示する')
+@click.option('--target', type=int, help='このバージョンまで適用する')
+def migrate_command(dry_run, target):
+    """未適用のスキーママイグレーションを適用する"""
+    conn = get_db()
+    if dry_run:
+        planned = migrations.plan(conn, target)
+        if not planned:
+            click.echo(f"未適用のマイグレーションはありません（現在のバージョン: {migrations.current_version(conn)}）")
+        for item in planned:
+            mode = '1トランザクション' if item['transactional'] else '操作ごとにコミット'
+            click.echo(f"{item['version']:04d} {item['name']}（{mode}）: 推定 {item['seconds']:.1f}秒, "
+                       f"最長の書き込みロック {item['lock_seconds']:.2f}秒"
+                       + ('' if item['complete'] else '（見積もれない操作を除く）'))
+            for step in item['steps']:
+                click.echo(f"  {format_migration_step(step)}")
+        return
+    with db.file_lock(get_db_path() + '-lock'):
+        applied = migrations.migrate(conn, target)
+    for item in applied:
+        click.echo(f"{item['version']:04d} {item['name']}: {item['seconds']:.1f}秒")
+    click.echo(f"現在のバージョン: {migrations.current_version(conn)}")
+
+def format_migration_step(step):
+    text = f"{step['operation']} {step['target']}"
+    if step.get('skipped'):
+        return text + ": 適用済み"
+    if step.get('error'):
+        return text + f": 見積もれません（{step['error']}）"
+    if step['seconds'] is None:
+        return text + ": 見積もりなし"
+    if step.get('rows') is not None:
+        text += f": 約{step['rows']:,}行"
+    if step.get('chunks'):
+        text += f" / {step['chunks']:,}チャンク"
+    return text + f", 推定 {step['seconds']:.2f}秒（書き込みロック {step['lock_seconds']:.2f}秒）"
+
+@bp.cli.command('backup')
+@click.option('--dir', 'directory', help='保存先ディレクトリ（省略時は BACKUP_DIR）')
+@click.option('--compress/--no-compress', default=None, help='gzipで圧縮する（省略時は BACKUP_COMPRESS）')
+def backup_command(directory, compress):
+    """データベースのスナップショットを作成する（アプリの稼働中に実行できる）"""
+    result = backup.create_snapshot(directory, compress)
+    click.echo(f"{result['path']}: {result['bytes']:,}バイト, {result['pages']:,}ページ, {result['seconds']}秒"
+               f"（やり直し {result['restarts']}回, 古いスナップショット {len(result['removed'])}個を削除）")
+
+@bp.cli.command('restore')
+@click.argument('path', required=False)
+@click.option('--dir', 'directory', help='スナップショットのディレクトリ（省略時は BACKUP_DIR）')
+@click.option('--list', 'list_only', is_flag=True, help='復元せずスナップショットの一覧を表示する')
+def restore_command(path, directory, list_only):
+    """スナップショットから復元する（PATH 省略時は integrity_check に通る最新のもの）
+
+    復元中の書き込みは失われるので、アプリを止めて実行する。
+    """
+    if list_only:
+        for snapshot in backup.list_snapshots(directory):
+            click.echo(f"{snapshot}  {os.path.getsize(snapshot):,}バイト")
+        return
+    try:
+        result = backup.restore_snapshot(path) if path else backup.restore_latest(directory)
+    except backup.SnapshotError as e:
+        raise click.ClickException(str(e))
+    if result is None:
+        raise click.ClickException(f"復元できるスナップショットがありません: {directory or current_app.config['BACKUP_DIR']}")
+    click.echo(f"{result['path']} から復元しました（{result['seconds']}秒）")
+
+@bp.cli.command('generate-data')
+@click.option('--products', 'products_count', default=10000, show_default=True, help='商品数（色・サイズ違いを含む）')
+@click.option('--sales', 'sales_count', default=1000000, show_default=True, help='売上履歴の件数')
+@click.option('--years', default=3, show_default=True, help='売上履歴の期間（今日までの年数）')
+@click.option('--end', type=click.DateTime(['%Y-%m-%d']), help='売上履歴の最終日（省略時は今日）')
+@click.option('--seed', default=0, show_default=True, help='乱数の種（同じ値なら同じデータになる）')
+@click.option('--yes', is_flag=True, help='確認せずに実行する')
+def generate_data_command(products_count, sales_count, years, end, seed, yes):
+    """既存の商品・売上履歴を合成データで置き換える（開発・性能検証用）"""
+    if not yes:
+        click.confirm(f"{get_db_path()} の商品と売上履歴をすべて削除して置き換えます。続けますか？", abort=True)
+
+    def progress(done, total):
+        click.echo(f"\r売上履歴 {done:,} / {total:,} 件", nl=False)
+
+    result = datagen.generate(products_count, sales_count, years, end.date() if end else None, seed,
+                              progress=progress)
+    click.echo()
+    click.echo(f"商品 {result['products']:,}件 / 売上 {result['sales']:,}件（{result['start']}〜{result['end']}）: "
+               f"{result['seconds']}秒（売上 {result['sales_rows_per_sec']:,}行/秒）")
+
+@bp.cli.command('rebuild-stats')
+@click.option('--verify', is_flag=True, help='再構築せず保持値と元テーブルの差分のみ表示する')
+def rebuild_stats_command(verify):
+    """ダッシュボード集計値を元テーブルから再構築する"""
+    conn = get_db()
+    if verify:
+        diff = stats.verify_stats(conn.cursor())
+        if not diff:
+            click.echo("集計値は元テーブルと一致しています")
+            return
+        for column, values in diff.items():
+            click.echo(f"{column}: 保持値={values['stored']} 実際={values['actual']}")
+        raise SystemExit(1)
+    with transaction(conn, immediate=True):
+        result = stats.rebuild_stats(conn.cursor())
+    click.echo(f"集計値を再構築しました: {result}")
+
+@bp.cli.command('refresh-reorder')
+@click.option('--as-of', type=click.DateTime(['%Y-%m-%d']), help='この日までの売上で計算する（省略時は今日）')
+def refresh_reorder_command(as_of):
+    """販売速度と自動の発注点を計算し直す（REORDER_INTERVAL ごとの定期実行と同じ処理）"""
+    result = reorder.run(as_of.date() if as_of else None)
+    click.echo(f"商品 {result['products']:,}件（{result['since']}〜{result['until']}）: "
+               f"発注点を変更 {result['changed']:,}件, {result['duration_ms']}ms")
+
+@bp.cli.command('backfill-rollups')
+def backfill_rollups_command():
+    """売上の日次・月次ロールアップを sales_history から再構築する"""
+    conn = get_db()
+    with transaction(conn, immediate=True):
+        result = rollups.backfill(conn.cursor())
+    click.echo(f"ロールアップを再構築しました: 日次 {result['daily_rows']} 行, 月次 {result['monthly_rows']} 行")
+
+@bp.cli.command('archive-sales')
+@click.option('--before', 'before_year', type=int, help='この年より前の売上を移す（今年より前の年。省略時は今年 - ARCHIVE_KEEP_YEARS）')
+@click.option('--chunk-size', type=int, help='1チャンクで移す行数（省略時は ARCHIVE_CHUNK_SIZE）')
+@click.option('--dry-run', is_flag=True, help='移さずに対象の年と行数を表示する')
+def archive_sales_command(before_year, chunk_size, dry_run):
+    """締まった年の売上履歴を年ごとのアーカイブへ移す（アプリの稼働中に実行できる）"""
+    conn = get_db()
+    for year, path, state in reversed(archive.partitions(conn)):
+        click.echo(f"{year}: {path}（{'移動済み' if state == 'archived' else '移動中'}）")
+    if dry_run:
+        try:
+            planned = archive.plan(conn, before_year)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        if not planned:
+            click.echo("移す売上はありません")
+        for item in planned:
+            click.echo(f"{item['year']}: {item['rows']:,}行 / ¥{item['amount']:,} → {item['path']}")
+        return
+
+    def progress(year, moved):
+        click.echo(f"\r{year}: {moved:,}行", nl=False)
+
+    try:
+        results = archive.archive_closed_years(before_year, chunk_size, progress)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    for result in results:
+        click.echo(f"\r{result['year']}: {result['rows']:,}行 / ¥{result['amount']:,} を移しました"
+                   f"（{result['seconds']}秒）→ {result['path']}")
+    if results:
+        click.echo("空いたページは flask --app app vacuum で解放できます")
+    else:
+        click.echo("移す売上はありません")
+
+@bp.cli.command('vacuum')
+def vacuum_command():
+    """未使用のページを解放してデータベースファイルを縮める（実行中は書き込みが待たされる）"""
+    conn = get_db()
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    before = os.path.getsize(get_db_path())
+    started = time.perf_counter()
+    conn.execute("VACUUM")
+    # VACUUM の書き込みはWALに入るので、チェックポイントしてからファイルの大きさを測る
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    click.echo(f"{before:,} → {os.path.getsize(get_db_path()):,} バイト（{time.perf_counter() - started:.1f}秒）")
+
+@bp.cli.command('import-products')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(products.IMPORT_FORMATS), help='省略時は拡張子から判定')
+@click.option('--chunk-size', default=products.IMPORT_CHUNK_SIZE, show_default=True, help='1トランザクションあたりの行数')
+def import_products_command(path, fmt, chunk_size):
+    """CSV / JSONL ファイルから商品を一括取り込みする（SKUが既存なら上書き）"""
+    fmt = fmt or ('jsonl' if path.lower().endswith(('.jsonl', '.ndjson')) else 'csv')
+    with open(path, 'rb') as stream:
+        report = products.import_products(get_db(), products.iter_rows(stream, fmt), chunk_size)
+    for rejected in report['rejected']:
+        click.echo(f"{rejected['row']}行目 ({rejected['sku']}): {rejected['message']}", err=True)
+    click.echo(f"処理 {report['processed']}件 / 取り込み {report['imported']}件 / 不合格 {report['rejected_count']}件 "
+               f"({report['elapsed_seconds']}秒, {report['rows_per_sec']}行/秒)")
+
+@bp.route('/static/<path:filename>')
 def static_files(filename):
     return send_from_directory('static', filename)
 
 if __name__ == '__main__':
-    print("=== アプリケーション起動開始 ===")
-    try:
-        init_database()
-    except Exception as e:
-        print(f"起動時のデータベース初期化エラー: {e}")
-    
+    app = create_app()
     port = int(os.environ.get('PORT', 5000))
-    print(f"ポート {port} でアプリケーションを起動します")
+    logger.info("アプリケーションを起動します", extra={'port': port})
     app.run(host='0.0.0.0', port=port, debug=False)
\ No newline at end of file
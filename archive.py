@@ -0,0 +1,301 @@
+"""売上履歴の年ごとのアーカイブ
+
+締まった年（ARCHIVE_KEEP_YEARS 年より前）の売上履歴を年ごとのSQLiteファイル
+（ARCHIVE_DIR/<データベース名>-sales-<年>.db）に移し、本体のデータベースを小さく保つ。
+移した年は sales_partitions テーブルに記録し、期間を指定した売上履歴の検索（sales.py）は
+期間と重なる年のファイルだけを読み取り専用でアタッチ（ATTACH DATABASE）して UNION ALL で読む。
+
+移動は ARCHIVE_CHUNK_SIZE 行ずつ行う。チャンクごとに先にアーカイブへコピーしてコミットし、
+次に本体から削除する（本体への書き込みロックを保持するのは削除の間だけ）。本体はWALモードのため
+複数ファイルにまたがるコミットは原子的でなく、この順にすることで途中で止まっても行は失われない
+（止まった場合は両方に残った行をやり直しで本体から消す）。移動中の年を読むときは、アーカイブへコピー済みで
+本体にまだ残っている行を本体の側から除くので、移動中や中断中の検索でも行は重複しない。移動は created_at の
+順に進むので、本体から削除し終えた最後の日時（sales_partitions.moved_until）より前の行は両方にはなく、
+除く対象はアーカイブのそれ以降の行（移動中のチャンク）だけを調べる。中断した移動は、ワーカーの最初の
+リクエストで起動するスレッドが続きから行う（resume_moves）。
+
+sales_partitions に登録した年の行の削除は移動として扱い、ダッシュボード集計値（stats.py）と
+ロールアップ（rollups.py）のトリガーは値を減らさない。累計売上の再計算には sales_partitions に
+記録した移動済みの金額を足し、ロールアップの再構築では移動済みの年を作り直さない。
+アーカイブのファイルはスナップショットの作成時に BACKUP_DIR にコピーする（backup.py）。
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import date
+from urllib.parse import quote
+
+import config
+from db import connect, file_lock, get_db_path, transaction
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = 'id, product_id, quantity, unit_price, total_amount, created_at'
+
+# アーカイブのファイルのスキーマ（本体の sales_history と同じ列とインデックス）
+ARCHIVE_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS sales_history (
+        id INTEGER PRIMARY KEY,
+        product_id INTEGER NOT NULL,
+        quantity INTEGER NOT NULL,
+        unit_price INTEGER NOT NULL,
+        total_amount INTEGER NOT NULL,
+        created_at DATETIME
+    )
+    ''',
+    "CREATE INDEX IF NOT EXISTS idx_sales_history_created_at ON sales_history (created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_sales_history_product_created ON sales_history (product_id, created_at)",
+]
+
+
+def archive_dir():
+    """アーカイブの保存先（ARCHIVE_DIR。既定はデータベースと同じディレクトリの archive/）"""
+    return config.get('ARCHIVE_DIR') or os.path.join(os.path.dirname(os.path.abspath(get_db_path())), 'archive')
+
+
+def partition_file(year):
+    return f"{os.path.splitext(os.path.basename(get_db_path()))[0]}-sales-{year}.db"
+
+
+def partitions(conn):
+    """アーカイブした年（移動中を含む）の [(年, ファイルのパス, 状態)]。新しい年から"""
+    try:
+        rows = conn.execute("SELECT year, file, state FROM sales_partitions ORDER BY year DESC").fetchall()
+    except sqlite3.OperationalError:
+        # マイグレーション4より前のデータベース
+        return []
+    return [(year, os.path.join(archive_dir(), name), state) for year, name, state in rows]
+
+
+def _moved_until(conn):
+    """移動中の年ごとの、本体から削除し終えた行の最後の日時（まだなければ None）"""
+    try:
+        rows = conn.execute("SELECT year, moved_until FROM sales_partitions WHERE state != 'archived'").fetchall()
+    except sqlite3.OperationalError:
+        # マイグレーション6より前のデータベース
+        return {}
+    return dict(rows)
+
+
+def archived_amount(cursor):
+    """アーカイブへ移した売上の合計金額（累計売上の再計算に使う）"""
+    try:
+        cursor.execute("SELECT COALESCE(SUM(total_amount), 0) FROM sales_partitions")
+    except sqlite3.OperationalError:
+        return 0
+    return cursor.fetchone()[0]
+
+
+def archived_years(cursor):
+    """アーカイブへ移した（移動中を含む）年"""
+    try:
+        cursor.execute("SELECT year FROM sales_partitions")
+    except sqlite3.OperationalError:
+        return []
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _overlaps(year, start, end):
+    return (start is None or start < f"{year + 1}-01-01") and (end is None or end > f"{year}-01-01")
+
+
+def sales_tables(conn, start=None, end=None):
+    """start以上end未満（'YYYY-MM-DD'。None は制限なし）の売上履歴を持つテーブル
+
+    本体の main.sales_history と、期間と重なる年のアーカイブの sales_history を返す。
+    移動中の年があれば、本体はアーカイブにコピー済みの行（moved_until 以降のもの）を除いたサブクエリになる。
+    アーカイブは接続ごとに読み取り専用でアタッチしたままにし、アタッチ数の上限に達したら
+    今回使わないものをデタッチする。ファイルがないアーカイブはログに残して読まない。
+    トランザクションの中では呼べない（ATTACH の制約）。
+    """
+    needed = [(year, path, state) for year, path, state in partitions(conn) if _overlaps(year, start, end)]
+    if not needed:
+        return ['main.sales_history']
+    attached = [row[1] for row in conn.execute("PRAGMA database_list").fetchall()]
+    names = {f"sales_{year}" for year, _, _ in needed}
+    limit = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+    if len(names) > limit:
+        raise ValueError(f'アーカイブは一度に{limit}年分までしか検索できません。期間を短くしてください')
+    moved_until = _moved_until(conn)
+    tables, moving = [], []
+    for year, path, state in needed:
+        name = f"sales_{year}"
+        if not os.path.exists(path):
+            logger.error("アーカイブのファイルがないため読み飛ばします", extra={'year': year, 'path': path})
+            continue
+        if name not in attached:
+            unused = [schema for schema in attached if schema.startswith('sales_') and schema not in names]
+            if len(attached) - 2 >= limit and unused:
+                conn.execute(f"DETACH DATABASE {unused[0]}")
+                attached.remove(unused[0])
+            conn.execute(f"ATTACH DATABASE ? AS {name}", (f"file:{quote(path)}?mode=ro",))
+            attached.append(name)
+        tables.append(f"{name}.sales_history")
+        if state != 'archived':
+            # 読み取った後に移動が進んで moved_until が新しくなっても、古い値で除く範囲は広がるだけ
+            moving.append((name, moved_until.get(year) or f"{year}-01-01"))
+    main = 'main.sales_history'
+    if moving:
+        # コピーしてから本体で削除するまでの間、同じ行が両方にある
+        copied = ' UNION ALL '.join(f"SELECT id FROM {name}.sales_history WHERE created_at >= {_quote(since)}"
+                                    for name, since in moving)
+        main = f"(SELECT {COLUMNS} FROM main.sales_history WHERE id NOT IN ({copied}))"
+    return [main] + tables
+
+
+def _quote(value):
+    """SQLの文字列リテラル（sales_tables はパラメータを渡せないクエリに埋め込まれる）"""
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def closed_years(conn, before=None):
+    """本体に売上が残っている、before 年より前（既定は今年 - ARCHIVE_KEEP_YEARS）の年
+
+    before が今年より前でなければ ValueError を送出する（今年と昨年の売上は移さない）。
+    """
+    before = before or date.today().year - config.get('ARCHIVE_KEEP_YEARS')
+    if before >= date.today().year:
+        raise ValueError(f'今年（{date.today().year}年）より前の年を指定してください: {before}')
+    first = conn.execute("SELECT MIN(created_at) FROM sales_history").fetchone()[0]
+    if first is None:
+        return []
+    years = []
+    for year in range(int(first[:4]), before):
+        row = conn.execute("SELECT 1 FROM sales_history WHERE created_at >= ? AND created_at < ? LIMIT 1",
+                           (f"{year}-01-01", f"{year + 1}-01-01")).fetchone()
+        if row:
+            years.append(year)
+    return years
+
+
+def plan(conn, before=None):
+    """移動する年と行数・金額（dry run）"""
+    result = []
+    for year in closed_years(conn, before):
+        rows, amount = conn.execute("""
+            SELECT COUNT(*), COALESCE(SUM(total_amount), 0) FROM sales_history
+            WHERE created_at >= ? AND created_at < ?
+        """, (f"{year}-01-01", f"{year + 1}-01-01")).fetchone()
+        result.append({'year': year, 'rows': rows, 'amount': amount,
+                       'path': os.path.join(archive_dir(), partition_file(year))})
+    return result
+
+
+def archive_year(year, chunk_size=None, progress=None):
+    """year 年の売上履歴を本体からアーカイブへ移し、移した行数・金額と所要時間を返す
+
+    途中で止まっても、もう一度実行すれば続きから移す。progress(年, 移した行数) をチャンクごとに呼ぶ。
+    """
+    chunk_size = chunk_size or config.get('ARCHIVE_CHUNK_SIZE')
+    name = partition_file(year)
+    path = os.path.join(archive_dir(), name)
+    os.makedirs(archive_dir(), exist_ok=True)
+    target = sqlite3.connect(path)
+    try:
+        for statement in ARCHIVE_SCHEMA:
+            target.execute(statement)
+        target.commit()
+    finally:
+        target.close()
+
+    bounds = {'start': f"{year}-01-01", 'end': f"{year + 1}-01-01", 'limit': chunk_size}
+    started = time.perf_counter()
+    moved = amount = 0
+    conn = connect()
+    try:
+        conn.execute("ATTACH DATABASE ? AS archive", (path,))
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS archive_chunk (id INTEGER PRIMARY KEY)")
+        # 登録した時点から、この年の行の削除は移動として扱われる（検索もアーカイブを読む）
+        with transaction(conn, immediate=True):
+            conn.execute("INSERT OR IGNORE INTO sales_partitions (year, file) VALUES (?, ?)", (year, name))
+        while True:
+            # 1. 移す行を選んでアーカイブへコピーする（本体には書き込まないので売上の登録を止めない）
+            with transaction(conn):
+                conn.execute("DELETE FROM temp.archive_chunk")
+                conn.execute("""
+                    INSERT INTO temp.archive_chunk (id)
+                    SELECT id FROM main.sales_history
+                    WHERE created_at >= :start AND created_at < :end
+                    ORDER BY created_at
+                    LIMIT :limit
+                """, bounds)
+                conn.execute(f"""
+                    INSERT OR IGNORE INTO archive.sales_history ({COLUMNS})
+                    SELECT {COLUMNS} FROM main.sales_history WHERE id IN (SELECT id FROM temp.archive_chunk)
+                """)
+            # 2. コピーを確定してから本体から削除し、移した件数・金額と削除し終えた最後の日時を記録する
+            with transaction(conn, immediate=True):
+                rows, total, last = conn.execute("""
+                    SELECT COUNT(*), COALESCE(SUM(total_amount), 0), MAX(created_at) FROM main.sales_history
+                    WHERE id IN (SELECT id FROM temp.archive_chunk)
+                """).fetchone()
+                if rows == 0:
+                    break
+                conn.execute("DELETE FROM main.sales_history WHERE id IN (SELECT id FROM temp.archive_chunk)")
+                conn.execute("UPDATE sales_partitions SET rows = rows + ?, total_amount = total_amount + ?, "
+                             "moved_until = ? WHERE year = ?", (rows, total, last, year))
+            moved += rows
+            amount += total
+            if progress:
+                progress(year, moved)
+            time.sleep(config.get('ARCHIVE_CHUNK_PAUSE'))
+        with transaction(conn, immediate=True):
+            conn.execute("UPDATE sales_partitions SET state = 'archived', archived_at = CURRENT_TIMESTAMP "
+                         "WHERE year = ?", (year,))
+        conn.execute("ANALYZE archive")
+        conn.execute("DETACH DATABASE archive")
+    finally:
+        conn.close()
+
+    result = {'year': year, 'rows': moved, 'amount': amount, 'path': path,
+              'seconds': round(time.perf_counter() - started, 1)}
+    logger.info("売上履歴をアーカイブしました", extra=result)
+    return result
+
+
+def archive_closed_years(before=None, chunk_size=None, progress=None):
+    """締まった年を古い順にアーカイブへ移す（複数のプロセスから同時に実行しても1つずつ進む）"""
+    results = []
+    with file_lock(get_db_path() + '-archive-lock'):
+        conn = connect()
+        try:
+            years = closed_years(conn, before)
+        finally:
+            conn.close()
+        for year in years:
+            results.append(archive_year(year, chunk_size, progress))
+    return results
+
+
+def resume_moves():
+    """中断した（移動中のまま残った）年の移動を続きから行う
+
+    ほかのプロセスがアーカイブの移動中なら何もしない（ロックを待つとワーカーを止めるため）。
+    """
+    try:
+        with file_lock(get_db_path() + '-archive-lock', blocking=False):
+            conn = connect()
+            try:
+                years = [year for year, _, state in partitions(conn) if state != 'archived']
+            finally:
+                conn.close()
+            return [archive_year(year) for year in sorted(years)]
+    except BlockingIOError:
+        return []
+
+
+def _resume(app):
+    with app.app_context():
+        try:
+            resume_moves()
+        except Exception:
+            logger.exception("中断したアーカイブの移動を再開できませんでした")
+
+
+def start_resume(app, conn):
+    """移動中の年があれば、resume_moves を実行するスレッドを起動する"""
+    if any(state != 'archived' for _, _, state in partitions(conn)):
+        threading.Thread(target=_resume, args=(app,), name='archive-resume', daemon=True).start()
@@ -0,0 +1,234 @@
+"""パスワードの検証とログイン試行の制限
+
+bcryptの検証は1回数百ミリ秒CPUを使うため、リクエストのスレッドでは実行せず、
+同時実行数を制限した専用スレッドプールで行う（bcryptは計算中にGILを解放する）。
+待ちが PASSWORD_QUEUE_LIMIT 件を超えた場合は PasswordPoolBusy を送出し、
+ログインの殺到でほかのリクエストが止まらないようにする。gevent ワーカー（threading をパッチ済み）では
+スレッドがコルーチンになってbcryptの間ワーカー全体が止まるため、gevent のOSスレッドのプールを使う。
+
+ログインの失敗はユーザー名・接続元IPごとに数え、上限を超えたらしばらくの間は検証自体を
+行わずに拒否する（総当たり攻撃でCPUを使わせない）。失敗の記録は本体とは別のSQLiteファイル
+（<データベース>-auth）に置き、全ワーカーで共有する。失敗が続いても本体の書き込みロックを取らず、
+データバージョン（db.data_version）も上げないので、ETagやキャッシュを無効にしない。
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import bcrypt
+from flask import current_app
+
+import config
+from db import connect, get_db, get_db_path, transaction
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS login_attempts (
+        key TEXT PRIMARY KEY,
+        failures INTEGER NOT NULL,
+        window_start REAL NOT NULL,
+        locked_until REAL
+    )
+"""
+
+pool_rejections = metrics.Counter('password_pool_rejections_total', '検証待ちが上限に達して断ったログイン数')
+throttled_logins = metrics.Counter('login_throttled_total', '失敗回数の上限により拒否したログイン数')
+rehashed_passwords = metrics.Counter('password_rehash_total', 'コスト変更のためハッシュを作り直した回数')
+
+
+class PasswordPoolBusy(Exception):
+    """検証待ちが上限に達している"""
+
+
+_pool = None
+_pool_slots = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_local = threading.local()
+
+
+def _executor_class():
+    try:
+        from gevent import monkey
+    except ImportError:
+        return ThreadPoolExecutor
+    if not monkey.is_module_patched('threading'):
+        return ThreadPoolExecutor
+    from gevent.threadpool import ThreadPoolExecutor as NativeThreadPoolExecutor
+    return NativeThreadPoolExecutor
+
+
+def _get_pool():
+    """プロセスごとのスレッドプール（fork後は作り直す）"""
+    global _pool, _pool_slots, _pool_pid
+    pid = os.getpid()
+    if _pool_pid != pid:
+        with _pool_lock:
+            if _pool_pid != pid:
+                workers = config.get('PASSWORD_WORKERS')
+                _pool = _executor_class()(max_workers=workers)
+                _pool_slots = threading.BoundedSemaphore(workers + config.get('PASSWORD_QUEUE_LIMIT'))
+                _pool_pid = pid
+    return _pool, _pool_slots
+
+
+def _submit(function, *args):
+    """プールで実行する。空きがなければ PasswordPoolBusy"""
+    pool, slots = _get_pool()
+    if not slots.acquire(blocking=False):
+        pool_rejections.inc()
+        raise PasswordPoolBusy()
+    future = pool.submit(function, *args)
+    future.add_done_callback(lambda _: slots.release())
+    return future
+
+
+def hash_password(password):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(config.get('BCRYPT_ROUNDS')))
+
+
+def _to_bytes(hashed):
+    return hashed if isinstance(hashed, bytes) else hashed.encode('utf-8')
+
+
+def _checkpw(password, hashed):
+    try:
+        return bcrypt.checkpw(password.encode('utf-8'), _to_bytes(hashed))
+    except ValueError:
+        logger.exception("パスワードハッシュの形式が不正です")
+        return False
+
+
+def verify_password(password, hashed):
+    """パスワードを検証する（スレッドプールで実行し、結果を待つ）"""
+    if config.get('PASSWORD_WORKERS') <= 0:
+        return _checkpw(password, hashed)
+    return _submit(_checkpw, password, hashed).result(timeout=config.get('PASSWORD_TIMEOUT'))
+
+
+def needs_rehash(hashed):
+    """保存済みハッシュのコストが BCRYPT_ROUNDS と異なるか"""
+    try:
+        return int(_to_bytes(hashed).split(b'$')[2]) != config.get('BCRYPT_ROUNDS')
+    except (IndexError, ValueError):
+        return False
+
+
+def _rehash(app, user_id, password, old_hash):
+    with app.app_context():
+        _rehash_user(user_id, password, old_hash)
+
+
+def _rehash_user(user_id, password, old_hash):
+    new_hash = hash_password(password)
+    with transaction(get_db(), immediate=True) as conn:
+        # 並行して変更されていたら上書きしない
+        cursor = conn.execute("UPDATE users SET password_hash = ? WHERE id = ? AND password_hash = ?",
+                              (new_hash, user_id, old_hash))
+    if cursor.rowcount:
+        rehashed_passwords.inc()
+        logger.info("パスワードハッシュのコストを更新しました",
+                    extra={'user_id': user_id, 'rounds': config.get('BCRYPT_ROUNDS')})
+
+
+def rehash_in_background(user_id, password, old_hash):
+    """ログイン成功後、ハッシュを現在のコストで作り直す（応答は待たせない）"""
+    if config.get('PASSWORD_WORKERS') <= 0:
+        _rehash_user(user_id, password, old_hash)
+        return
+    try:
+        # プールのスレッドでもリクエストと同じアプリの設定（データベース）を使う
+        future = _submit(_rehash, current_app._get_current_object(), user_id, password, old_hash)
+    except PasswordPoolBusy:
+        return  # 次回のログインで作り直す
+    future.add_done_callback(_log_rehash_error)
+
+
+def _log_rehash_error(future):
+    error = future.exception()
+    if error is not None:
+        logger.error("パスワードハッシュの更新に失敗しました", exc_info=error)
+
+
+# ログイン試行の制限
+
+def throttle_path():
+    """失敗の記録を置くファイルのパス"""
+    return get_db_path() + '-auth'
+
+
+def _throttle_db():
+    """現在のスレッド用の失敗の記録への接続（fork後・データベースの切り替え後は作り直す）"""
+    pid, path = os.getpid(), throttle_path()
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.pid == pid and _local.path == path:
+        return conn
+    if conn is not None and _local.pid == pid:
+        conn.close()
+    conn = connect(path)
+    conn.execute(SCHEMA)
+    _local.conn, _local.pid, _local.path = conn, pid, path
+    return conn
+
+
+@contextmanager
+def _throttle_transaction():
+    """失敗の記録を書き込むトランザクション（db.transaction と違いデータバージョンを上げない）"""
+    conn = _throttle_db()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    else:
+        conn.commit()
+
+
+def _throttle_keys(username, remote_addr):
+    return [(f"user:{username}", config.get('LOGIN_MAX_FAILURES_PER_USER')),
+            (f"ip:{remote_addr}", config.get('LOGIN_MAX_FAILURES_PER_IP'))]
+
+
+def locked_for(username, remote_addr):
+    """ログインを拒否すべき残り秒数（拒否しない場合は0）"""
+    keys = [key for key, _ in _throttle_keys(username, remote_addr)]
+    cursor = _throttle_db().execute(
+        f"SELECT MAX(locked_until) FROM login_attempts WHERE key IN ({','.join('?' * len(keys))})", keys)
+    locked_until = cursor.fetchone()[0]
+    remaining = (locked_until or 0) - time.time()
+    if remaining > 0:
+        throttled_logins.inc()
+        return int(remaining) + 1
+    return 0
+
+
+def record_failure(username, remote_addr):
+    """失敗を数え、上限に達したキーをロックする"""
+    now = time.time()
+    window, lockout = config.get('LOGIN_WINDOW'), config.get('LOGIN_LOCKOUT')
+    with _throttle_transaction() as conn:
+        # 期限切れの記録を削除する
+        conn.execute("DELETE FROM login_attempts WHERE window_start < ? AND COALESCE(locked_until, 0) < ?",
+                     (now - window, now))
+        for key, limit in _throttle_keys(username, remote_addr):
+            conn.execute("""
+                INSERT INTO login_attempts (key, failures, window_start) VALUES (:key, 1, :now)
+                ON CONFLICT (key) DO UPDATE SET
+                    failures = CASE WHEN window_start < :expired THEN 1 ELSE failures + 1 END,
+                    window_start = CASE WHEN window_start < :expired THEN :now ELSE window_start END
+            """, {'key': key, 'now': now, 'expired': now - window})
+            conn.execute("""
+                UPDATE login_attempts SET locked_until = ?, failures = 0, window_start = ?
+                WHERE key = ? AND failures >= ?
+            """, (now + lockout, now, key, limit))
+
+
+def record_success(username):
+    with _throttle_transaction() as conn:
+        conn.execute("DELETE FROM login_attempts WHERE key = ?", (f"user:{username}",))
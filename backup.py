@@ -0,0 +1,337 @@
+"""データベースのオンラインバックアップとスナップショットからの復元
+
+sqlite3 のオンラインバックアップAPI（Connection.backup）でスナップショットを作る。
+ファイルを直接コピーすると書き込み中のページやWALの内容が欠けた壊れたコピーになりうるが、
+バックアップAPIは読み取りトランザクションの中で一貫した内容をコピーする。WALモードでは
+読み取りは書き込みを止めないので、バックアップ中もワーカーは書き込める。
+
+BACKUP_PAGES ページずつコピーし、ステップの間は読み取りロックを手放す（その間チェックポイントが進む）。
+ただしステップの間にほかの接続が書き込むとSQLiteはコピーを最初からやり直すため、
+BACKUP_MAX_RESTARTS 回やり直したら残りを1ステップでコピーする。
+
+スナップショットは BACKUP_DIR に <データベース名>-<UTC時刻>.db(.gz) として保存し、新しいものから
+BACKUP_KEEP 個を残す。復元時は integrity_check に通ったものだけを使う。
+
+売上履歴のアーカイブ（archive.py）のファイルはスナップショットに含まれないので、スナップショットを作るたびに
+BACKUP_DIR/archive/ にコピーする（移動済みの年は一度だけ、移動中の年は毎回 .moving を付けた名前で）。
+スナップショットの後にコピーするので、
+コピーには本体から削除済みの行がすべて含まれる。復元時は ARCHIVE_DIR にないファイルをここから戻す。
+"""
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+import archive
+import config
+import db
+import metrics
+
+logger = logging.getLogger(__name__)
+
+snapshots_total = metrics.Counter('backup_snapshots_total', '作成したスナップショット数', labels=('result',))
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+class SnapshotError(Exception):
+    """スナップショットが壊れている・見つからない"""
+
+
+class _Restarted(Exception):
+    pass
+
+
+def _prefix(db_path):
+    return os.path.splitext(os.path.basename(db_path))[0] + '-'
+
+
+def list_snapshots(directory=None, db_path=None):
+    """スナップショットのパス（新しい順）"""
+    directory = directory or config.get('BACKUP_DIR')
+    prefix = _prefix(db_path or db.get_db_path())
+    if not os.path.isdir(directory):
+        return []
+    names = [name for name in os.listdir(directory)
+             if name.startswith(prefix) and name.endswith(('.db', '.db.gz'))]
+    # 名前の時刻部分で並べる（.db と .db.gz が混在しても順序が崩れないように）
+    names.sort(key=lambda name: name[len(prefix):].split('.')[0], reverse=True)
+    return [os.path.join(directory, name) for name in names]
+
+
+def latest_snapshot_time(directory=None):
+    """最新のスナップショットの作成時刻（UNIX時刻。なければ0）"""
+    snapshots = list_snapshots(directory)
+    return os.path.getmtime(snapshots[0]) if snapshots else 0
+
+
+metrics.Gauge('backup_last_snapshot_timestamp_seconds', '最新のスナップショットの作成時刻', latest_snapshot_time)
+
+
+def _copy(source, target):
+    """source の内容を target にコピーし、(ページ数, やり直し回数) を返す"""
+    restarts = 0
+    state = {'remaining': None}
+
+    def progress(status, remaining, total):
+        if state['remaining'] is not None and remaining > state['remaining']:
+            raise _Restarted()
+        state['remaining'] = remaining
+        state['total'] = total
+
+    pages, max_restarts = config.get('BACKUP_PAGES'), config.get('BACKUP_MAX_RESTARTS')
+    while restarts < max_restarts and pages > 0:
+        state['remaining'] = None
+        try:
+            source.backup(target, pages=pages, progress=progress)
+            return state.get('total', 0), restarts
+        except _Restarted:
+            restarts += 1
+    # 1ステップ（1つの読み取りトランザクション）でコピーする。WALモードでは書き込みは止まらない
+    source.backup(target)
+    return target.execute("PRAGMA page_count").fetchone()[0], restarts
+
+
+def create_snapshot(directory=None, compress=None, db_path=None):
+    """スナップショットを作成し、古いものを BACKUP_KEEP 個まで削除する"""
+    directory = directory or config.get('BACKUP_DIR')
+    compress = config.get('BACKUP_COMPRESS') if compress is None else compress
+    db_path = db_path or db.get_db_path()
+    os.makedirs(directory, exist_ok=True)
+
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')
+    path = os.path.join(directory, f"{_prefix(db_path)}{stamp}.db" + ('.gz' if compress else ''))
+    temp_path = os.path.join(directory, f".{_prefix(db_path)}{stamp}.tmp")
+    started = time.perf_counter()
+    source = db.connect(db_path)
+    try:
+        target = sqlite3.connect(temp_path)
+        try:
+            pages, restarts = _copy(source, target)
+            # 単体のファイルで完結するようにする（復元時は -wal なしで開ける）
+            target.execute("PRAGMA journal_mode = DELETE")
+        finally:
+            target.close()
+        if compress:
+            with open(temp_path, 'rb') as raw, gzip.open(path + '.tmp', 'wb', compresslevel=6) as packed:
+                shutil.copyfileobj(raw, packed, 1024 * 1024)
+            os.remove(temp_path)
+            temp_path = path + '.tmp'
+        os.replace(temp_path, path)
+    except BaseException:
+        snapshots_total.inc(('error',))
+        for leftover in (temp_path, path + '.tmp'):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        raise
+    finally:
+        source.close()
+    snapshots_total.inc(('ok',))
+    removed = prune(directory, db_path=db_path)
+    archives = save_archives(directory, db_path)
+    result = {
+        'path': path,
+        'bytes': os.path.getsize(path),
+        'pages': pages,
+        'restarts': restarts,
+        'seconds': round(time.perf_counter() - started, 3),
+        'removed': removed,
+        'archives': archives,
+    }
+    logger.info("スナップショットを作成しました", extra=result)
+    return result
+
+
+def _partitions(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return archive.partitions(conn)
+    finally:
+        conn.close()
+
+
+def save_archives(directory=None, db_path=None):
+    """アーカイブのファイルを directory/archive/ にコピーし、コピーしたパスを返す
+
+    移動済みの年はコピーがあれば飛ばす。移動中の年は <名前>.moving にコピーし直す
+    （移動が終わった後の最初のスナップショットで移動済みのコピーに置き換わる）。
+    """
+    directory = directory or config.get('BACKUP_DIR')
+    target_dir = os.path.join(directory, 'archive')
+    copied = []
+    for year, path, state in _partitions(db_path or db.get_db_path()):
+        final = os.path.join(target_dir, os.path.basename(path))
+        target = final if state == 'archived' else final + '.moving'
+        if state == 'archived' and os.path.exists(final):
+            continue
+        if not os.path.exists(path):
+            logger.error("アーカイブのファイルがないためコピーできません", extra={'year': year, 'path': path})
+            continue
+        os.makedirs(target_dir, exist_ok=True)
+        # 移動中のファイルにも書き込み中の内容が混ざらないよう、バックアップAPIでコピーする
+        source = sqlite3.connect(f"file:{quote(path)}?mode=ro", uri=True)
+        try:
+            copy = sqlite3.connect(target + '.tmp')
+            try:
+                source.backup(copy)
+            finally:
+                copy.close()
+        finally:
+            source.close()
+        os.replace(target + '.tmp', target)
+        if target == final and os.path.exists(final + '.moving'):
+            os.remove(final + '.moving')
+        copied.append(target)
+    return copied
+
+
+def restore_archives(directory, db_path=None):
+    """復元したデータベースのアーカイブのうち、ARCHIVE_DIR にないものを directory/archive/ から戻す"""
+    restored = []
+    for year, path, _ in _partitions(db_path or db.get_db_path()):
+        if os.path.exists(path):
+            continue
+        saved = os.path.join(directory, 'archive', os.path.basename(path))
+        if not os.path.exists(saved):
+            saved += '.moving'
+        if not os.path.exists(saved):
+            logger.error("アーカイブのファイルが見つかりません", extra={'year': year, 'path': path})
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copyfile(saved, path + '.tmp')
+        os.replace(path + '.tmp', path)
+        restored.append(path)
+    return restored
+
+
+def prune(directory=None, keep=None, db_path=None):
+    """新しいものから keep 個を残して削除し、削除したパスを返す"""
+    keep = config.get('BACKUP_KEEP') if keep is None else keep
+    removed = list_snapshots(directory, db_path)[keep:]
+    for path in removed:
+        os.remove(path)
+    return removed
+
+
+def _open_snapshot(path, work_dir):
+    """スナップショットを（圧縮されていれば展開して）開き、integrity_check を行う"""
+    if not os.path.exists(path):
+        raise SnapshotError(f"スナップショットが見つかりません: {path}")
+    if path.endswith('.gz'):
+        unpacked = os.path.join(work_dir, '.restore.tmp')
+        try:
+            with gzip.open(path, 'rb') as packed, open(unpacked, 'wb') as raw:
+                shutil.copyfileobj(packed, raw, 1024 * 1024)
+        except (OSError, EOFError) as e:
+            if os.path.exists(unpacked):
+                os.remove(unpacked)
+            raise SnapshotError(f"展開できません: {path}: {e}")
+        path = unpacked
+    conn = sqlite3.connect(f"file:{quote(path)}?mode=ro", uri=True)
+    try:
+        result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+    except sqlite3.DatabaseError as e:
+        result = str(e)
+    if result != 'ok':
+        conn.close()
+        raise SnapshotError(f"integrity_check に失敗しました: {result}")
+    return conn
+
+
+def restore_snapshot(path, db_path=None):
+    """スナップショットの内容でデータベースを置き換える
+
+    バックアップAPIで書き込むので、ほかの接続が開いていても壊れたファイルにはならないが、
+    復元中の書き込みは失われる。通常は起動時（restore_on_start）か、アプリを止めて実行する。
+    """
+    db_path = db_path or db.get_db_path()
+    work_dir = os.path.dirname(os.path.abspath(db_path))
+    os.makedirs(work_dir, exist_ok=True)
+    started = time.perf_counter()
+    snapshot = _open_snapshot(path, work_dir)
+    try:
+        target = db.connect(db_path)
+        try:
+            snapshot.backup(target)
+        finally:
+            target.close()
+    finally:
+        snapshot.close()
+        unpacked = os.path.join(work_dir, '.restore.tmp')
+        if os.path.exists(unpacked):
+            os.remove(unpacked)
+    archives = restore_archives(os.path.dirname(os.path.abspath(path)), db_path)
+    # キャッシュ（ETag・SSE）が古い内容を返さないようにする
+    db.bump_data_version()
+    result = {'path': path, 'db_path': db_path, 'archives': archives,
+              'seconds': round(time.perf_counter() - started, 3)}
+    logger.info("スナップショットから復元しました", extra=result)
+    return result
+
+
+def restore_latest(directory=None, db_path=None):
+    """integrity_check に通る最新のスナップショットから復元する（なければ None）"""
+    for path in list_snapshots(directory, db_path):
+        try:
+            return restore_snapshot(path, db_path)
+        except SnapshotError as e:
+            logger.error("壊れたスナップショットを飛ばします", extra={'path': path, 'error': str(e)})
+    return None
+
+
+def _is_empty(db_path):
+    if not os.path.exists(db_path) or os.path.getsize(db_path) == 0:
+        return True
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table'").fetchone()[0] == 0
+    finally:
+        conn.close()
+
+
+def restore_on_start(db_path=None, directory=None):
+    """データベースが空（再デプロイ直後など）なら最新のスナップショットから復元する
+
+    ensure_database からファイルロックを取った状態で呼ぶ。
+    """
+    db_path = db_path or db.get_db_path()
+    if not _is_empty(db_path):
+        return None
+    return restore_latest(directory, db_path)
+
+
+def _run_scheduler(app, interval):
+    # 設定（BACKUP_DIR・データベースのパス）は起動したアプリのものを使う
+    with app.app_context():
+        lock_path = db.get_db_path() + '-backup-lock'
+        while True:
+            # 複数のワーカーで動いていても、最新のスナップショットが新しければ作らない
+            wait = latest_snapshot_time() + interval - time.time()
+            if wait > 0:
+                time.sleep(wait)
+                continue
+            try:
+                with db.file_lock(lock_path):
+                    if latest_snapshot_time() + interval <= time.time():
+                        create_snapshot()
+            except Exception:
+                logger.exception("定期スナップショットの作成に失敗しました")
+                time.sleep(interval)
+
+
+def start_scheduler(app, interval):
+    """interval 秒ごとにスナップショットを作るスレッドを起動する（プロセスごとに1つ）
+
+    gunicorn --preload でもワーカーで動くよう、app.start_schedulers から最初のリクエストで呼ぶ。
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None or not _scheduler.is_alive():
+            _scheduler = threading.Thread(target=_run_scheduler, args=(app, interval), name='backup', daemon=True)
+            _scheduler.start()
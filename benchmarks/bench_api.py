@@ -0,0 +1,406 @@
+"""全APIエンドポイントの負荷試験・ベンチマーク
+
+使い方:
+    python benchmarks/bench_api.py seed [--products 100000] [--sales 1000000]
+    python benchmarks/bench_api.py run [--seconds 5] [--concurrency 8] [--output result.json]
+    python benchmarks/bench_api.py compare baseline.json result.json [--tolerance 10]
+
+seed: flask generate-data（datagen.py）で合成データを入れたデータベースを --db に作る
+      （既定 benchmarks/.data/seed.db）。乱数の種を固定しているので、同じ引数なら同じデータになる。
+
+run: シードしたデータベースのコピーに対して、エンドポイントごとに --seconds 秒間、
+     --concurrency 並列でリクエストを送り、スループット・p50 / p95 / p99・エラー件数・
+     ロックエラー件数（database is locked）をJSONで出力する。--db がなければ先に seed を行う。
+     ドライバーは2種類（--drivers で選択）:
+       client   Flaskテストクライアント（別プロセスで実行。HTTPを経由しないアプリ内の処理時間）
+       gunicorn gunicorn.conf.py で --workers 個のワーカーを起動し、HTTPで送る（未インストールなら skipped）
+
+compare: 2つの結果を比べ、スループットの低下・p99の増加が --tolerance %を超えるか、
+         ロックエラーが増えたエンドポイントがあれば終了コード1で終わる（CIで使う）。
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from urllib.parse import quote
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_DB = os.path.join(ROOT, 'benchmarks', '.data', 'seed.db')
+RESULT_PREFIX = 'BENCH_RESULT '
+PASSWORD = 'Admin@2024!'
+SECRET_KEY = 'bench-secret-key'
+SEED = 20240101
+# 売上履歴の期間（SALES_END までの SALES_YEARS 年間）
+SALES_END = '2024-12-31'
+SALES_YEARS = 2
+SALES_DAYS = 730
+SEARCH_WORDS = ['ニット', 'デニム', 'ホワイト', 'スニーカー', 'オーバーサイズ', 'カシミヤ', 'TSH00', 'BLK-M']
+
+
+# シード
+
+def seed(db_path, products_count, sales_count):
+    """合成データ（datagen.py）を入れたデータベースを作る（既存のファイルは作り直す）"""
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    for suffix in ('', '-wal', '-shm', '-version', '-lock'):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    env = dict(os.environ, DATABASE_PATH=db_path, LOG_LEVEL='WARNING', DEFAULT_PASSWORD=PASSWORD)
+    env.pop('RENDER', None)
+    started = time.perf_counter()
+    # スキーマ・初期ユーザーはアプリと同じ処理で作る
+    flask = [sys.executable, '-m', 'flask', '--app', 'app']
+    subprocess.run(flask + ['init-db'], env=env, cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+    subprocess.run(flask + ['generate-data', '--products', str(products_count), '--sales', str(sales_count),
+                            '--years', str(SALES_YEARS), '--end', SALES_END, '--seed', str(SEED), '--yes'],
+                   env=env, cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+    return {'products': products_count, 'sales': sales_count, 'seconds': round(time.perf_counter() - started, 1)}
+
+
+def seed_info(db_path):
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        products_count = conn.execute("SELECT MAX(id) FROM products").fetchone()[0] or 0
+        sales_count = conn.execute("SELECT MAX(id) FROM sales_history").fetchone()[0] or 0
+    finally:
+        conn.close()
+    return {'products': products_count, 'sales': sales_count}
+
+
+# シナリオ: 乱数生成器を受け取り (メソッド, パス, JSON本文) を返す（ログイン済みのセッションで送る）
+
+def scenarios(products_count):
+    def random_product(rng):
+        return rng.randint(1, products_count)
+
+    def date_range(rng):
+        start = datetime(2023, 1, 1) + timedelta(days=rng.randrange(SALES_DAYS - 30))
+        return f"start_date={start:%Y-%m-%d}&end_date={start + timedelta(days=30):%Y-%m-%d}"
+
+    return {
+        'GET /api/dashboard': lambda rng: ('GET', '/api/dashboard', None),
+        'GET /api/products': lambda rng: (
+            'GET', f"/api/products?limit=50&sort={rng.choice(['name', 'price'])}&order={rng.choice(['asc', 'desc'])}",
+            None),
+        'GET /api/products?q': lambda rng: ('GET', f"/api/products?limit=50&q={quote(rng.choice(SEARCH_WORDS))}", None),
+        'GET /api/sales-analysis': lambda rng: ('GET', f"/api/sales-analysis?{date_range(rng)}", None),
+        'POST /api/sales': lambda rng: (
+            'POST', '/api/sales', {'product_id': random_product(rng), 'quantity': 1, 'price': 1000}),
+        'POST /api/inventory/inbound': lambda rng: (
+            'POST', '/api/inventory/inbound', {'product_id': random_product(rng), 'quantity': 1}),
+        'POST /api/inventory/outbound': lambda rng: (
+            'POST', '/api/inventory/outbound', {'product_id': random_product(rng), 'quantity': 1}),
+        'POST /api/login': lambda rng: ('POST', '/api/login', {'username': 'admin', 'password': PASSWORD}),
+    }
+
+
+def classify(status, body):
+    """'ok' / 'error' / 'lock'"""
+    if b'locked' in body:
+        return 'lock'
+    if status >= 400:
+        return 'error'
+    if body.startswith(b'{'):
+        try:
+            if json.loads(body).get('success') is False:
+                return 'error'
+        except ValueError:
+            return 'error'
+    return 'ok'
+
+
+def summarize(timings, outcomes, elapsed):
+    timings.sort()
+
+    def percentile(p):
+        return round(timings[min(len(timings) - 1, int(len(timings) * p))] * 1000, 3) if timings else None
+
+    return {
+        'requests': len(timings),
+        'errors': outcomes.count('error'),
+        'lock_errors': outcomes.count('lock'),
+        'throughput': round(len(timings) / elapsed, 1),
+        'p50_ms': percentile(0.50),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+    }
+
+
+def drive(make_sender, scenario, seconds, concurrency):
+    """concurrency 個のスレッドで seconds 秒間 scenario を送り続ける"""
+    timings, outcomes = [], []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def loop(index):
+        rng = random.Random(SEED + index)
+        send = make_sender()
+        local_timings, local_outcomes = [], []
+        while time.perf_counter() < deadline:
+            method, path, body = scenario(rng)
+            started = time.perf_counter()
+            status, payload = send(method, path, body)
+            local_timings.append(time.perf_counter() - started)
+            local_outcomes.append(classify(status, payload))
+        with lock:
+            timings.extend(local_timings)
+            outcomes.extend(local_outcomes)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=loop, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(timings, outcomes, time.perf_counter() - started)
+
+
+# ドライバー: Flaskテストクライアント（--client-worker で起動される子プロセス）
+
+def run_client_worker(products_count, seconds, concurrency, only):
+    sys.path.insert(0, ROOT)
+    from app import create_app
+    app = create_app()
+
+    def make_sender():
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+            sess['username'] = 'admin'
+            sess['role'] = 'admin'
+
+        def send(method, path, body):
+            response = client.open(path, method=method, json=body)
+            payload = response.get_data()
+            response.close()
+            return response.status_code, payload
+        return send
+
+    results = {}
+    for name, scenario in scenarios(products_count).items():
+        if only and name not in only:
+            continue
+        results[name] = drive(make_sender, scenario, seconds, concurrency)
+    print(RESULT_PREFIX + json.dumps(results), file=sys.stderr, flush=True)
+
+
+def run_client(db_path, info, args, env):
+    command = [sys.executable, os.path.abspath(__file__), 'run', '--client-worker',
+               '--seconds', str(args.seconds), '--concurrency', str(args.concurrency),
+               '--products', str(info['products'])]
+    for name in args.only or ():
+        command += ['--only', name]
+    out = subprocess.run(command, env=dict(env, DATABASE_PATH=db_path), cwd=ROOT, capture_output=True, text=True)
+    if out.returncode != 0:
+        raise SystemExit(out.stderr)
+    line = next(l for l in out.stderr.splitlines() if l.startswith(RESULT_PREFIX))
+    return json.loads(line[len(RESULT_PREFIX):])
+
+
+# ドライバー: gunicorn（HTTP）
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _wait_ready(port, process, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise SystemExit("gunicorn が起動できませんでした")
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', '/health')
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise SystemExit("gunicorn の起動を待てませんでした")
+
+
+def _http_sender(port):
+    def make_sender():
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        conn.request('POST', '/api/login', json.dumps({'username': 'admin', 'password': PASSWORD}),
+                     {'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        response.read()
+        cookie = response.getheader('Set-Cookie', '').split(';')[0]
+
+        def send(method, path, body):
+            headers = {'Cookie': cookie}
+            data = None
+            if body is not None:
+                data = json.dumps(body)
+                headers['Content-Type'] = 'application/json'
+            try:
+                conn.request(method, path, data, headers)
+                response = conn.getresponse()
+                return response.status, response.read()
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                return 599, str(e).encode()
+        return send
+    return make_sender
+
+
+def run_gunicorn(db_path, info, args, env):
+    if shutil.which('gunicorn') is None:
+        return {'skipped': 'gunicorn がインストールされていません'}
+    port = _free_port()
+    process = subprocess.Popen(
+        ['gunicorn', 'wsgi:app', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}', '--workers', str(args.workers)],
+        env=dict(env, DATABASE_PATH=db_path), cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        _wait_ready(port, process)
+        results = {}
+        for name, scenario in scenarios(info['products']).items():
+            if args.only and name not in args.only:
+                continue
+            results[name] = drive(_http_sender(port), scenario, args.seconds, args.concurrency)
+        return results
+    finally:
+        process.terminate()
+        process.wait()
+
+
+DRIVERS = {'client': run_client, 'gunicorn': run_gunicorn}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    if not os.path.exists(args.db):
+        print(f"シード中: {args.db}", file=sys.stderr)
+        seed(args.db, args.products, args.sales)
+    info = seed_info(args.db)
+    env = dict(os.environ, LOG_LEVEL='WARNING', SECRET_KEY=SECRET_KEY, DEFAULT_PASSWORD=PASSWORD,
+               WEB_CONCURRENCY=str(args.workers), INIT_DATABASE='1')
+    env.pop('RENDER', None)
+
+    result = {
+        'meta': {
+            'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'git_commit': git_commit(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'cpus': os.cpu_count(),
+            'seconds': args.seconds,
+            'concurrency': args.concurrency,
+            'workers': args.workers,
+            **info,
+        },
+        'results': {},
+    }
+    for driver in args.drivers.split(','):
+        # 書き込みで結果が変わらないよう、毎回シードのコピーに対して実行する
+        with tempfile.TemporaryDirectory() as tmp:
+            work_db = os.path.join(tmp, 'bench.db')
+            shutil.copyfile(args.db, work_db)
+            print(f"{driver} 実行中...", file=sys.stderr)
+            result['results'][driver] = DRIVERS[driver](work_db, info, args, env)
+
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    print_result(result)
+
+
+def print_result(result):
+    for driver, endpoints in result['results'].items():
+        if 'skipped' in endpoints:
+            print(f"[{driver}] skipped: {endpoints['skipped']}")
+            continue
+        print(f"[{driver}]")
+        print(f"  {'endpoint':<30}{'req/s':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'errors':>8}{'locked':>8}")
+        for name, stats in endpoints.items():
+            print(f"  {name:<30}{stats['throughput']:>10.1f}{stats['p50_ms']:>8.2f}ms{stats['p95_ms']:>8.2f}ms"
+                  f"{stats['p99_ms']:>8.2f}ms{stats['errors']:>8}{stats['lock_errors']:>8}")
+
+
+def compare(args):
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(args.result, encoding='utf-8') as f:
+        current = json.load(f)
+
+    regressions = 0
+    print(f"{'endpoint':<40}{'req/s':>22}{'p99':>26}{'locked':>12}")
+    for driver, endpoints in current['results'].items():
+        before_endpoints = baseline['results'].get(driver, {})
+        if 'skipped' in endpoints or 'skipped' in before_endpoints:
+            continue
+        for name, after in endpoints.items():
+            before = before_endpoints.get(name)
+            if before is None:
+                continue
+            throughput_change = (after['throughput'] - before['throughput']) / max(before['throughput'], 1e-9) * 100
+            p99_change = (after['p99_ms'] - before['p99_ms']) / max(before['p99_ms'], 1e-9) * 100
+            regressed = (throughput_change < -args.tolerance or p99_change > args.tolerance
+                         or after['lock_errors'] > before['lock_errors'])
+            regressions += regressed
+            print(f"{driver + ' ' + name:<40}{before['throughput']:>8.1f} -> {after['throughput']:>7.1f}"
+                  f"{throughput_change:>+6.1f}%{before['p99_ms']:>9.2f} -> {after['p99_ms']:>7.2f}ms{p99_change:>+6.1f}%"
+                  f"{before['lock_errors']:>5} -> {after['lock_errors']:<4}{'  REGRESSION' if regressed else ''}")
+    if regressions:
+        print(f"{regressions} 件のエンドポイントで悪化しています（許容 {args.tolerance}%）")
+        raise SystemExit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    seed_parser = commands.add_parser('seed', help='合成データのデータベースを作る')
+    run_parser = commands.add_parser('run', help='ベンチマークを実行する')
+    for command in (seed_parser, run_parser):
+        command.add_argument('--db', default=DEFAULT_DB)
+        command.add_argument('--products', type=int, default=100000)
+        command.add_argument('--sales', type=int, default=1000000)
+    run_parser.add_argument('--seconds', type=float, default=5)
+    run_parser.add_argument('--concurrency', type=int, default=8)
+    run_parser.add_argument('--workers', type=int, default=4, help='gunicorn のワーカー数')
+    run_parser.add_argument('--drivers', default='client,gunicorn')
+    run_parser.add_argument('--only', action='append', help='このエンドポイントだけ実行する（複数指定可）')
+    run_parser.add_argument('--output', help='結果のJSONファイル')
+    run_parser.add_argument('--client-worker', action='store_true', help=argparse.SUPPRESS)
+
+    compare_parser = commands.add_parser('compare', help='保存したベースラインと比較する')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('result')
+    compare_parser.add_argument('--tolerance', type=float, default=10, help='許容する悪化（%%）')
+
+    args = parser.parse_args()
+    if args.command == 'seed':
+        print(json.dumps(seed(args.db, args.products, args.sales)))
+    elif args.command == 'run' and args.client_worker:
+        run_client_worker(args.products, args.seconds, args.concurrency, args.only)
+    elif args.command == 'run':
+        run(args)
+    else:
+        compare(args)
+
+
+if __name__ == '__main__':
+    main()
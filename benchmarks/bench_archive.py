@@ -0,0 +1,126 @@
+"""売上履歴のアーカイブ（archive.py）の効果のベンチマーク
+
+使い方:
+    python benchmarks/bench_archive.py [--products 10000] [--sales 3000000] [--repeat 20]
+
+datagen.py で --products 件の商品と --sales 件の売上履歴（3年分: 2022〜2024年）を作り、
+2024年より前の2年分をアーカイブへ移す前と、移して VACUUM した後で次を計測して比べる。
+
+- 本体のデータベースファイルの大きさと、スナップショット（backup.create_snapshot。非圧縮）の作成時間
+- 売上分析（/api/sales-analysis）の先頭ページの応答時間（p50）。直近（2024年12月）と
+  アーカイブした期間（2022年12月）、期間指定なし（全年を UNION ALL で読む）
+- アーカイブ中に別スレッドから登録した売上（/api/sales）の応答時間（p50 / 最大）と件数。
+  移動は本体の書き込みロックを削除の間だけ持つので、売上の登録は止まらない
+
+ETagによる304は使わない（毎回DBを読む）。
+"""
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import date
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+END = date(2024, 12, 31)
+RANGES = {
+    '直近（2024-12）': '?start_date=2024-12-01&end_date=2024-12-31',
+    'アーカイブ（2022-12）': '?start_date=2022-12-01&end_date=2022-12-31',
+    '期間指定なし': '',
+}
+
+
+def timed(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--sales', type=int, default=3000000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ.update(DATABASE_PATH=os.path.join(tmp, 'bench.db'), ARCHIVE_DIR=os.path.join(tmp, 'archive'),
+                      LOG_LEVEL='WARNING', REORDER_INTERVAL='0', PASSWORD_WORKERS='0')
+    os.environ.pop('RENDER', None)
+    sys.path.insert(0, ROOT)
+    import app as application
+    import archive
+    import backup
+    import datagen
+    from db import close_db, get_db, get_db_path
+
+    app = application.create_app()
+
+    close_db()
+    result = datagen.generate(args.products, args.sales, years=3, end=END)
+    print(f"商品 {result['products']:,}件 / 売上 {result['sales']:,}件を生成（{result['seconds']}秒）")
+
+    client = app.test_client()
+    client.post('/api/login', json={'username': 'admin', 'password': app.config['DEFAULT_PASSWORD']})
+
+    def measure():
+        conn = get_db()
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        snapshot = backup.create_snapshot(os.path.join(tmp, 'backups'), compress=False)
+        os.remove(snapshot['path'])
+        measured = {'本体のファイル（MB）': os.path.getsize(get_db_path()) / 1e6,
+                    'スナップショット作成（秒）': snapshot['seconds']}
+        for label, query in RANGES.items():
+            url = f'/api/sales-analysis{query}'
+            measured[f'売上分析 {label}（ms）'] = timed(lambda: client.get(url), args.repeat) * 1000
+        return measured
+
+    before = measure()
+
+    # アーカイブ中に売上を登録し続ける
+    timings = []
+    stop = threading.Event()
+
+    def sell():
+        rng = random.Random(0)
+        seller = app.test_client()
+        seller.post('/api/login', json={'username': 'admin', 'password': app.config['DEFAULT_PASSWORD']})
+        while not stop.is_set():
+            started = time.perf_counter()
+            seller.post('/api/sales', json={'product_id': rng.randint(1, args.products), 'quantity': 1,
+                                            'price': 1000})
+            timings.append(time.perf_counter() - started)
+
+    thread = threading.Thread(target=sell)
+    thread.start()
+    started = time.perf_counter()
+    moved = archive.archive_closed_years(before=2024)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    thread.join()
+    for item in moved:
+        print(f"{item['year']}: {item['rows']:,}行を移動（{item['seconds']}秒）")
+    print(f"アーカイブ中の売上登録: {len(timings):,}件（{len(timings) / elapsed:.0f}件/秒） "
+          f"p50 {statistics.median(timings) * 1000:.2f}ms / 最大 {max(timings) * 1000:.1f}ms")
+
+    conn = get_db()
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.execute("VACUUM")
+    after = measure()
+
+    print(f"{'':<32}{'移動前':>12}{'移動・VACUUM後':>16}")
+    for label in before:
+        print(f"  {label:<30}{before[label]:>12.2f}{after[label]:>16.2f}")
+    close_db()
+    shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""稼働中のバックアップと起動時の復元のベンチマーク
+
+使い方:
+    python benchmarks/bench_backup.py [--rows 500000]
+
+--rows 件の sales_history を用意し、売上を書き込み続けるスレッドを動かしながら
+次の方法でコピーを作り、所要時間・書き込みの待ち時間（p99 / 最大）・コピーの検査結果と件数
+（live rows はコピーを終えた時点でのデータベースの件数）を比較する。
+
+- copy: データベースファイルをそのままコピーする（-wal の内容は含まれない）
+- snapshot: backup.create_snapshot（オンラインバックアップAPI）
+
+gzip圧縮したスナップショットの大きさと作成時間もあわせて表示する。
+
+最後に、データベースを削除した状態から最新のスナップショットで復元する時間（コールドスタート）を計る。
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def write_loop(stop, timings):
+    from db import get_db, transaction
+
+    conn = get_db()
+    while not stop.is_set():
+        started = time.perf_counter()
+        with transaction(conn, immediate=True):
+            conn.execute("INSERT INTO sales_history (product_id, quantity, unit_price, total_amount) "
+                         "VALUES (1, 1, 1000, 1000)")
+        timings.append(time.perf_counter() - started)
+        time.sleep(0.002)
+
+
+def check(path):
+    """(integrity_check の結果, sales_history の件数)"""
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+        rows = conn.execute("SELECT COUNT(*) FROM sales_history").fetchone()[0]
+    except sqlite3.DatabaseError as e:
+        return str(e), None
+    finally:
+        conn.close()
+    return result, rows
+
+
+def count_rows(conn):
+    return conn.execute("SELECT COUNT(*) FROM sales_history").fetchone()[0]
+
+
+def measure(label, function):
+    from db import get_db
+
+    stop = threading.Event()
+    timings = []
+    writer = threading.Thread(target=write_loop, args=(stop, timings))
+    writer.start()
+    time.sleep(0.2)
+    started = time.perf_counter()
+    path, extra = function()
+    elapsed = time.perf_counter() - started
+    live_rows = count_rows(get_db())  # コピーを終えた時点の件数
+    stop.set()
+    writer.join()
+    timings.sort()
+    result, rows = check(path)
+    print(f"{label:<10}{elapsed:>9.2f}s{timings[int(len(timings) * 0.99) - 1] * 1000:>10.2f}ms"
+          f"{timings[-1] * 1000:>10.2f}ms  {result[:20]:<20}{rows if rows is not None else '-':>10}{live_rows:>10}"
+          f"  {extra}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=500000)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    db_path = os.path.join(tmp, 'bench.db')
+    os.environ.update(DATABASE_PATH=db_path, LOG_LEVEL='WARNING')
+    os.environ.pop('RENDER', None)
+    sys.path.insert(0, ROOT)
+    from db import close_db, get_db, transaction
+    from app import create_app
+    create_app()  # スキーマを作成する
+    import backup
+
+    conn = get_db()
+    for start in range(0, args.rows, 10000):
+        with transaction(conn, immediate=True):
+            conn.executemany(
+                "INSERT INTO sales_history (product_id, quantity, unit_price, total_amount) "
+                "VALUES (?, 1, 1000, 1000)",
+                [((i % 5) + 1,) for i in range(start, min(start + 10000, args.rows))],
+            )
+
+    def file_copy():
+        target = os.path.join(tmp, 'copy.db')
+        shutil.copyfile(db_path, target)
+        return target, ''
+
+    snapshot_dir = os.path.join(tmp, 'snapshots')
+
+    def snapshot():
+        result = backup.create_snapshot(snapshot_dir, compress=False)
+        return result['path'], f"pages={result['pages']} restarts={result['restarts']}"
+
+    print(f"{'':<10}{'elapsed':>10}{'write p99':>12}{'write max':>12}  {'integrity':<20}{'rows':>10}{'live rows':>10}")
+    measure('copy', file_copy)
+    measure('snapshot', snapshot)
+    compressed = backup.create_snapshot(snapshot_dir, compress=True)
+    print(f"gzip: {os.path.getsize(db_path + '-wal') + os.path.getsize(db_path):,} -> {compressed['bytes']:,} バイト"
+          f"（{compressed['seconds']}秒）")
+
+    # コールドスタート: データベースを削除して最新のスナップショットから復元する
+    close_db()
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    started = time.perf_counter()
+    restored = backup.restore_on_start(db_path, snapshot_dir)
+    print(f"restore: {time.perf_counter() - started:.2f}秒 ({os.path.basename(restored['path'])}), "
+          f"{get_db().execute('SELECT COUNT(*) FROM sales_history').fetchone()[0]} 行")
+    shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""商品カタログのキャッシュの効果のベンチマーク
+
+使い方:
+    python benchmarks/bench_catalog_cache.py [--products 5000] [--seconds 5] [--concurrency 4] [--list-limit 0]
+
+generate-data（datagen.py）で作ったデータベースに対して、商品一覧（/api/products?format=columns。
+--list-limit N を指定すると先頭N件）と検索（/api/products?q=...）を --concurrency 個のスレッドから送り続け、キャッシュなし
+（CATALOG_CACHE_SEARCHES=0）とありのリクエスト数/秒・p50・ヒット率を比較する。
+ETagによる304は使わない（別々の利用者が初めて開いたときの負荷）。
+
+--write-every N を指定すると、各スレッドがN回に1回売上を登録する（書き込みのたびにキャッシュが無効になる）。
+各モードは別プロセスで、同じシードのデータベースのコピーに対して実行する。
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SEARCH_WORDS = ['ニット', 'デニム', 'ホワイト', 'スニーカー', 'オーバーサイズ', 'カシミヤ']
+
+
+def worker(seconds, concurrency, write_every, list_limit):
+    """子プロセス: 環境変数の設定でリクエストを送り続け、結果をJSONで出力する"""
+    sys.path.insert(0, ROOT)
+    import app as application
+    import metrics
+
+    app = application.create_app()
+    list_url = '/api/products?format=columns' + (f'&limit={list_limit}' if list_limit else '')
+    timings = []
+    deadline = time.perf_counter() + seconds
+
+    def run(index):
+        rng = random.Random(index)
+        client = app.test_client()
+        client.post('/api/login', json={'username': 'admin', 'password': app.config['DEFAULT_PASSWORD']})
+        local = []
+        count = 0
+        while time.perf_counter() < deadline:
+            count += 1
+            if write_every and count % write_every == 0:
+                client.post('/api/sales', json={'product_id': rng.randint(1, 100), 'quantity': 1, 'price': 1000})
+                continue
+            url = (list_url if rng.random() < 0.5
+                   else f"/api/products?q={rng.choice(SEARCH_WORDS)}&limit=100")
+            started = time.perf_counter()
+            client.get(url)
+            local.append(time.perf_counter() - started)
+        timings.extend(local)
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    counts = {}
+    for line in metrics.render().splitlines():
+        if line.startswith('catalog_cache_lookups_total{cache="search"'):
+            counts[line.split('result="')[1].split('"')[0]] = float(line.split()[-1])
+    lookups = counts.get('hit', 0) + counts.get('miss', 0)
+    print(json.dumps({
+        'requests_per_sec': round(len(timings) / elapsed, 1),
+        'p50_ms': round(statistics.median(timings) * 1000, 2),
+        'hit_ratio': round(counts.get('hit', 0) / lookups, 3) if lookups else None,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--write-every', type=int, default=0)
+    parser.add_argument('--list-limit', type=int, default=0, help='商品一覧の件数（0 は全件）')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        worker(args.seconds, args.concurrency, args.write_every, args.list_limit)
+        return
+
+    tmp = tempfile.mkdtemp()
+    seed_path = os.path.join(tmp, 'seed.db')
+    env = dict(os.environ, DATABASE_PATH=seed_path, LOG_LEVEL='WARNING', PASSWORD_WORKERS='0')
+    env.pop('RENDER', None)
+    flask = [sys.executable, '-m', 'flask', '--app', 'app']
+    subprocess.run(flask + ['init-db'], env=env, cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+    subprocess.run(flask + ['generate-data', '--products', str(args.products), '--sales', '10000', '--yes'],
+                   env=env, cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+
+    print(f"{'mode':<10}{'req/s':>10}{'p50':>12}{'hit ratio':>12}")
+    for mode, size in (('no cache', '0'), ('cache', '64')):
+        db_path = os.path.join(tmp, f'{size}.db')
+        shutil.copyfile(seed_path, db_path)
+        output = subprocess.run(
+            [sys.executable, __file__, '--worker', '--seconds', str(args.seconds),
+             '--concurrency', str(args.concurrency), '--write-every', str(args.write_every),
+             '--list-limit', str(args.list_limit)],
+            env=dict(env, DATABASE_PATH=db_path, CATALOG_CACHE_SEARCHES=size),
+            cwd=ROOT, check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        hit_ratio = '-' if result['hit_ratio'] is None else f"{result['hit_ratio']:.1%}"
+        print(f"{mode:<10}{result['requests_per_sec']:>10.1f}{result['p50_ms']:>10.2f}ms{hit_ratio:>12}")
+    shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""接続プールとリクエストごと接続の比較ベンチマーク
+
+使い方:
+    python benchmarks/bench_db_pool.py [--requests 2000]
+
+DB_POOL=1（プール）と DB_POOL=0（従来のリクエストごと接続）をそれぞれ
+別プロセスで起動し、Flaskテストクライアントで requests/sec を計測する。
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENDPOINTS = ['/api/dashboard', '/api/products', '/api/sales-analysis']
+
+
+def run_worker(requests_count):
+    sys.path.insert(0, ROOT)
+    from app import create_app, init_database
+    app = create_app()
+
+    init_database()
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+        sess['username'] = 'admin'
+        sess['role'] = 'admin'
+
+    results = {}
+    for endpoint in ENDPOINTS:
+        client.get(endpoint)  # ウォームアップ
+        start = time.perf_counter()
+        for _ in range(requests_count):
+            client.get(endpoint)
+        elapsed = time.perf_counter() - start
+        results[endpoint] = round(requests_count / elapsed, 1)
+
+    start = time.perf_counter()
+    for _ in range(requests_count):
+        client.post('/api/sales', json={'product_id': 1, 'quantity': 1, 'price': 2500})
+        client.post('/api/inventory/inbound', json={'product_id': 1, 'quantity': 1})
+    elapsed = time.perf_counter() - start
+    results['/api/sales + inbound'] = round(requests_count * 2 / elapsed, 1)
+    print(json.dumps(results))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.requests)
+        return
+
+    summary = {}
+    for label, pool in (('connect_per_request', '0'), ('pooled', '1')):
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ, DB_POOL=pool, DATABASE_PATH=os.path.join(tmp, 'bench.db'))
+            env.pop('RENDER', None)
+            out = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--worker', '--requests', str(args.requests)],
+                env=env, cwd=ROOT, capture_output=True, text=True, check=True,
+            )
+            summary[label] = json.loads(out.stdout.strip().splitlines()[-1])
+
+    print(f"{'endpoint':<28}{'per-request':>14}{'pooled':>14}{'speedup':>10}")
+    for endpoint, before in summary['connect_per_request'].items():
+        after = summary['pooled'][endpoint]
+        print(f"{endpoint:<28}{before:>12.1f}/s{after:>12.1f}/s{after / before:>9.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""グループコミットの有無による売上登録のスループットのベンチマーク
+
+使い方:
+    python benchmarks/bench_group_commit.py [--seconds 5] [--concurrency 32] [--window-ms 2] [--max-batch 256]
+
+POST /api/sales を --concurrency 個のスレッドから送り続け、GROUP_COMMIT=0（リクエストごとにコミット）と
+GROUP_COMMIT=1 の売上件数/秒・応答時間（p50 / p99）・在庫不足で断られた件数を比較する。
+DB_SYNCHRONOUS=NORMAL（既定。WALではコミットごとのfsyncなし）と FULL（コミットごとにfsync）の両方で計測する。
+
+在庫の少ない商品を混ぜて一部の売上が在庫不足になるようにし、終了後に
+「初期在庫 = 現在の在庫 + 売れた数量」が商品ごとに成り立つことを確認する。
+各モードは別プロセスで、新しいデータベースに対して実行する。
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PRODUCTS = 50
+# 在庫不足が起きるよう、一部の商品だけ在庫を少なくする
+LOW_STOCK_PRODUCTS = 5
+LOW_STOCK = 200
+STOCK = 10 ** 9
+
+
+def worker(seconds, concurrency):
+    """子プロセス: 環境変数の設定で売上を送り続け、結果をJSONで出力する"""
+    sys.path.insert(0, ROOT)
+    import app as application
+    from db import get_db, transaction
+
+    app = application.create_app()
+    with transaction(get_db(), immediate=True) as conn:
+        conn.executemany("INSERT INTO products (sku, name, price, quantity) VALUES (?, ?, 1000, ?)",
+                         [(f"BENCH{i:03d}", f"ベンチ商品{i}", LOW_STOCK if i < LOW_STOCK_PRODUCTS else STOCK)
+                          for i in range(PRODUCTS)])
+        initial = dict(conn.execute("SELECT id, quantity FROM products"))
+    product_ids = sorted(initial)
+
+    timings, rejected, errors = [], [], []
+    deadline = time.perf_counter() + seconds
+
+    def run(index):
+        rng = random.Random(index)
+        client = app.test_client()
+        client.post('/api/login', json={'username': 'admin', 'password': app.config['DEFAULT_PASSWORD']})
+        local_timings, local_rejected, local_errors = [], 0, 0
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            result = client.post('/api/sales', json={
+                'product_id': rng.choice(product_ids), 'quantity': rng.randint(1, 3), 'price': 1000}).get_json()
+            local_timings.append(time.perf_counter() - started)
+            if not result['success']:
+                if result['message'] == '在庫が不足しています':
+                    local_rejected += 1
+                else:
+                    local_errors += 1
+        timings.extend(local_timings)
+        rejected.append(local_rejected)
+        errors.append(local_errors)
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    conn = get_db()
+    sold = dict(conn.execute("SELECT product_id, SUM(quantity) FROM sales_history GROUP BY product_id"))
+    current = dict(conn.execute("SELECT id, quantity FROM products"))
+    consistent = all(initial[i] - current[i] == sold.get(i, 0) for i in product_ids)
+    count = conn.execute("SELECT COUNT(*) FROM sales_history").fetchone()[0]
+    timings.sort()
+    print(json.dumps({
+        'sales_per_sec': round(count / elapsed, 1),
+        'p50_ms': round(statistics.median(timings) * 1000, 2),
+        'p99_ms': round(timings[int(len(timings) * 0.99) - 1] * 1000, 2),
+        'rejected': sum(rejected),
+        'errors': sum(errors),
+        'consistent': consistent and min(current.values()) >= 0,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--window-ms', type=float, default=2)
+    parser.add_argument('--max-batch', type=int, default=256)
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        worker(args.seconds, args.concurrency)
+        return
+
+    print(f"{'synchronous':<13}{'mode':<14}{'sales/s':>10}{'p50':>10}{'p99':>10}{'rejected':>10}{'errors':>8}  consistent")
+    for synchronous in ('NORMAL', 'FULL'):
+        for group_commit in ('0', '1'):
+            tmp = tempfile.mkdtemp()
+            env = dict(os.environ, DATABASE_PATH=os.path.join(tmp, 'bench.db'), LOG_LEVEL='WARNING',
+                       DB_SYNCHRONOUS=synchronous, GROUP_COMMIT=group_commit,
+                       GROUP_COMMIT_WINDOW_MS=str(args.window_ms), GROUP_COMMIT_MAX_BATCH=str(args.max_batch),
+                       PASSWORD_WORKERS='0', BCRYPT_ROUNDS='4')
+            env.pop('RENDER', None)
+            output = subprocess.run(
+                [sys.executable, __file__, '--worker', '--seconds', str(args.seconds),
+                 '--concurrency', str(args.concurrency)],
+                env=env, cwd=ROOT, check=True, capture_output=True, text=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            mode = 'group commit' if group_commit == '1' else 'per request'
+            print(f"{synchronous:<13}{mode:<14}{result['sales_per_sec']:>10.1f}{result['p50_ms']:>8.2f}ms"
+                  f"{result['p99_ms']:>8.2f}ms{result['rejected']:>10}{result['errors']:>8}  {result['consistent']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""一括在庫更新と1件ずつの入庫APIの比較ベンチマーク
+
+使い方:
+    python benchmarks/bench_inventory_batch.py [--lines 1000]
+
+同じ件数の在庫更新を /api/inventory/inbound への個別リクエストと
+/api/inventory/batch への1リクエストで実行し、所要時間を比較する。
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', type=int, default=1000)
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    os.environ['DATABASE_PATH'] = os.path.join(tmp.name, 'bench.db')
+    os.environ.pop('RENDER', None)
+    sys.path.insert(0, ROOT)
+    from app import create_app, init_database
+    app = create_app()
+    from db import get_db, transaction
+
+    init_database()
+    conn = get_db()
+    with transaction(conn):
+        conn.executemany("INSERT INTO products (sku, name, price, quantity) VALUES (?, ?, ?, ?)",
+                         [(f"BENCH{i:06d}", f"ベンチ商品{i}", 1000, 100) for i in range(args.lines)])
+    ids = [row[0] for row in conn.execute("SELECT id FROM products WHERE sku LIKE 'BENCH%' ORDER BY id")]
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+
+    start = time.perf_counter()
+    for product_id in ids:
+        client.post('/api/inventory/inbound', json={'product_id': product_id, 'quantity': 1})
+    single = time.perf_counter() - start
+
+    start = time.perf_counter()
+    response = client.post('/api/inventory/batch', json={'lines': [{'product_id': i, 'delta': 1} for i in ids]})
+    batched = time.perf_counter() - start
+    assert response.get_json()['success'], response.get_json()['message']
+
+    print(f"{args.lines} lines")
+    print(f"  single requests: {single * 1000:9.1f} ms ({args.lines / single:,.0f} lines/s)")
+    print(f"  batch request:   {batched * 1000:9.1f} ms ({args.lines / batched:,.0f} lines/s)")
+    print(f"  speedup:         {single / batched:9.1f}x")
+    tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
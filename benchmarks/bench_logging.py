@@ -0,0 +1,104 @@
+"""同期ログと非同期ログ（QueueListener）のレイテンシ比較
+
+使い方:
+    python benchmarks/bench_logging.py [--requests 2000] [--drain-bytes-per-ms 128]
+
+LOG_ASYNC=0（リクエスト処理中のスレッドで書き込む）と LOG_ASYNC=1 をそれぞれ
+別プロセスで起動し、/api/products と /api/sales のリクエストごとの処理時間の
+p50 / p99 を比較する。全リクエストのアクセスログを出力し（LOG_SAMPLE_RATE=1）、
+標準出力は親プロセスが --drain-bytes-per-ms の速さでしか読まないパイプにつなぐ
+（取り込みの遅いログ収集基盤を想定）。
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULT_PREFIX = 'BENCH_RESULT '
+
+
+def run_worker(requests_count):
+    sys.path.insert(0, ROOT)
+    from app import create_app, init_database
+    app = create_app()
+
+    init_database()
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+        sess['username'] = 'admin'
+        sess['role'] = 'admin'
+
+    requests = {
+        'GET /api/products': lambda: client.get('/api/products'),
+        'POST /api/sales': lambda: client.post('/api/sales', json={'product_id': 1, 'quantity': 1, 'price': 2500}),
+    }
+    results = {}
+    for label, send in requests.items():
+        send().close()  # ウォームアップ
+        timings = []
+        for _ in range(requests_count):
+            start = time.perf_counter()
+            send().close()
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        results[label] = {
+            'p50_ms': statistics.median(timings) * 1000,
+            'p99_ms': timings[int(len(timings) * 0.99) - 1] * 1000,
+        }
+    # 結果はログに混ざらないよう標準エラー出力に書く
+    print(RESULT_PREFIX + json.dumps(results), file=sys.stderr, flush=True)
+
+
+def drain(stream, bytes_per_ms):
+    """遅いログ収集基盤を模して、一定の速さでしか読み出さない"""
+    while stream.read(bytes_per_ms):
+        time.sleep(0.001)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--drain-bytes-per-ms', type=int, default=128)
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.requests)
+        return
+
+    summary = {}
+    for label, async_logging in (('sync', '0'), ('async', '1')):
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ, LOG_ASYNC=async_logging, LOG_SAMPLE_RATE='1', LOG_LEVEL='DEBUG',
+                       DATABASE_PATH=os.path.join(tmp, 'bench.db'))
+            env.pop('RENDER', None)
+            process = subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), '--worker', '--requests', str(args.requests)],
+                env=env, cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+            )
+            reader = threading.Thread(target=drain, args=(process.stdout, args.drain_bytes_per_ms), daemon=True)
+            reader.start()
+            stderr = process.stderr.read()
+            process.wait()
+            reader.join()
+            if process.returncode != 0:
+                raise SystemExit(stderr)
+            line = next(l for l in stderr.splitlines() if l.startswith(RESULT_PREFIX))
+            summary[label] = json.loads(line[len(RESULT_PREFIX):])
+
+    print(f"{'request':<22}{'sync p50':>12}{'sync p99':>12}{'async p50':>12}{'async p99':>12}")
+    for request_label, sync in summary['sync'].items():
+        async_ = summary['async'][request_label]
+        print(f"{request_label:<22}{sync['p50_ms']:>10.3f}ms{sync['p99_ms']:>10.3f}ms"
+              f"{async_['p50_ms']:>10.3f}ms{async_['p99_ms']:>10.3f}ms")
+
+
+if __name__ == '__main__':
+    main()
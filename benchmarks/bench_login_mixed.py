@@ -0,0 +1,115 @@
+"""ログイン集中時にほかのAPIが受ける影響のベンチマーク
+
+使い方:
+    python benchmarks/bench_login_mixed.py [--logins 30] [--readers 4] [--seconds 10]
+
+--logins 個のスレッドがログインを繰り返す（始業時の一斉ログインを想定）あいだ、
+--readers 個のスレッドが /api/dashboard と /api/sales を呼び続け、その処理時間の
+p50 / p99 と、ログイン・その他のリクエストの件数を比較する。
+PASSWORD_WORKERS=0（リクエストのスレッドで直接bcryptを実行する従来の方式）と
+PASSWORD_WORKERS=2（専用スレッドプール）をそれぞれ別プロセスで実行する。
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULT_PREFIX = 'BENCH_RESULT '
+PASSWORD = 'Admin@2024!'
+
+
+def run_worker(logins, readers, seconds):
+    sys.path.insert(0, ROOT)
+    from app import create_app, init_database
+    app = create_app()
+
+    init_database()
+    deadline = time.perf_counter() + seconds
+    login_counts = {'ok': 0, 'busy': 0}
+    reader_timings = []
+    lock = threading.Lock()
+
+    def login_loop():
+        client = app.test_client()
+        while time.perf_counter() < deadline:
+            response = client.post('/api/login', json={'username': 'admin', 'password': PASSWORD})
+            with lock:
+                login_counts['ok' if response.status_code == 200 else 'busy'] += 1
+            if response.status_code != 200:
+                time.sleep(float(response.headers.get('Retry-After', 1)))
+
+    def reader_loop():
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        timings = []
+        while time.perf_counter() < deadline:
+            for send in (lambda: client.get('/api/dashboard'),
+                         lambda: client.post('/api/sales', json={'product_id': 1, 'quantity': 1, 'price': 2500})):
+                start = time.perf_counter()
+                send().close()
+                timings.append(time.perf_counter() - start)
+        with lock:
+            reader_timings.extend(timings)
+
+    threads = [threading.Thread(target=login_loop) for _ in range(logins)]
+    threads += [threading.Thread(target=reader_loop) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    reader_timings.sort()
+    result = {
+        'logins': login_counts['ok'],
+        'rejected_logins': login_counts['busy'],
+        'other_requests': len(reader_timings),
+        'other_p50_ms': statistics.median(reader_timings) * 1000,
+        'other_p99_ms': reader_timings[int(len(reader_timings) * 0.99) - 1] * 1000,
+    }
+    print(RESULT_PREFIX + json.dumps(result), file=sys.stderr, flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--logins', type=int, default=30)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.logins, args.readers, args.seconds)
+        return
+
+    summary = {}
+    for label, workers in (('inline', '0'), ('pool', '2')):
+        with tempfile.TemporaryDirectory() as tmp:
+            # 成功するログインだけなので試行回数の制限には掛からない
+            env = dict(os.environ, PASSWORD_WORKERS=workers, LOG_LEVEL='ERROR', DEFAULT_PASSWORD=PASSWORD,
+                       DATABASE_PATH=os.path.join(tmp, 'bench.db'))
+            env.pop('RENDER', None)
+            out = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--worker', '--logins', str(args.logins),
+                 '--readers', str(args.readers), '--seconds', str(args.seconds)],
+                env=env, cwd=ROOT, capture_output=True, text=True,
+            )
+            if out.returncode != 0:
+                raise SystemExit(out.stderr)
+            line = next(l for l in out.stderr.splitlines() if l.startswith(RESULT_PREFIX))
+            summary[label] = json.loads(line[len(RESULT_PREFIX):])
+
+    print(f"{'':<8}{'logins':>8}{'rejected':>10}{'other req':>11}{'other p50':>12}{'other p99':>12}")
+    for label, result in summary.items():
+        print(f"{label:<8}{result['logins']:>8}{result['rejected_logins']:>10}{result['other_requests']:>11}"
+              f"{result['other_p50_ms']:>10.2f}ms{result['other_p99_ms']:>10.2f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""計測（/metrics）のオーバーヘッドのベンチマーク
+
+使い方:
+    python benchmarks/bench_metrics.py [--requests 1000] [--rounds 3] [--threshold 5]
+
+1. METRICS=0（計測なし）と METRICS=1（リクエスト単位 + SQL文ごと）をそれぞれ別プロセスで
+   起動し、Flaskテストクライアントで requests/sec を計測する（各モードを交互に --rounds 回
+   実行し、最も速かった回の値を使う）。
+2. 計測フック1回分と、計測付きカーソルでのSQL文1回分の追加コストを直接計り、
+   エンドポイントごとのSQL文の数から1リクエストあたりのオーバーヘッドを求める。
+
+2. の値が --threshold %を超えるエンドポイントがあれば終了コード1を返す
+（1. は環境のばらつきの影響が大きいため参考値）。
+"""
+import argparse
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENDPOINTS = ['/api/dashboard', '/api/products', '/api/sales-analysis']
+
+
+def run_worker(requests_count):
+    sys.path.insert(0, ROOT)
+    from app import create_app, init_database
+    app = create_app()
+    import metrics
+
+    init_database()
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+        sess['username'] = 'admin'
+        sess['role'] = 'admin'
+
+    def statement_count():
+        return sum(series[-1] for series in metrics.sql_duration._series.values())
+
+    results = {}
+    for endpoint in ENDPOINTS:
+        client.get(endpoint).close()  # ウォームアップ
+        before = statement_count()
+        start = time.process_time()
+        for _ in range(requests_count):
+            client.get(endpoint).close()
+        elapsed = time.process_time() - start
+        results[endpoint] = {
+            'seconds_per_request': elapsed / requests_count,
+            'statements_per_request': (statement_count() - before) / requests_count,
+        }
+    print(json.dumps(results))
+
+
+def measure_unit_costs(number=100000):
+    """(計測フック1回, SQL文1回あたりの追加コスト) を秒で返す"""
+    sys.path.insert(0, ROOT)
+    import metrics
+
+    def hooks():
+        metrics.start_request()
+        metrics.finish_request('GET', '/bench', 200)
+
+    hook_cost = min(timeit.repeat(hooks, number=number, repeat=3)) / number
+
+    costs = {}
+    for factory in (sqlite3.Connection, metrics.TimedConnection):
+        conn = sqlite3.connect(':memory:', factory=factory)
+        conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, value INTEGER)")
+        conn.executemany("INSERT INTO t (value) VALUES (?)", [(i,) for i in range(100)])
+        cursor = conn.cursor()
+        costs[factory] = min(timeit.repeat(
+            lambda: cursor.execute("SELECT value FROM t WHERE id = ?", (42,)).fetchone(),
+            number=number, repeat=3)) / number
+        conn.close()
+    return hook_cost, costs[metrics.TimedConnection] - costs[sqlite3.Connection]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--threshold', type=float, default=5.0, help='許容するオーバーヘッド（%%）')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.requests)
+        return
+
+    summary = {'off': {}, 'on': {}}
+    for _ in range(args.rounds):
+        for label, enabled in (('off', '0'), ('on', '1')):
+            with tempfile.TemporaryDirectory() as tmp:
+                env = dict(os.environ, METRICS=enabled, METRICS_SQL=enabled,
+                           DATABASE_PATH=os.path.join(tmp, 'bench.db'))
+                env.pop('RENDER', None)
+                out = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), '--worker', '--requests', str(args.requests)],
+                    env=env, cwd=ROOT, capture_output=True, text=True, check=True,
+                )
+            for endpoint, result in json.loads(out.stdout.strip().splitlines()[-1]).items():
+                best = summary[label].get(endpoint)
+                if best is None or result['seconds_per_request'] < best['seconds_per_request']:
+                    summary[label][endpoint] = result
+
+    hook_cost, statement_cost = measure_unit_costs()
+    print(f"hooks: {hook_cost * 1e6:.2f}us/request  sql timing: {statement_cost * 1e6:.2f}us/statement")
+    print(f"{'endpoint':<24}{'off':>12}{'on':>12}{'stmts':>8}{'estimated':>12}")
+    failed = False
+    for endpoint, off in summary['off'].items():
+        on = summary['on'][endpoint]
+        overhead = hook_cost + on['statements_per_request'] * statement_cost
+        percent = overhead / off['seconds_per_request'] * 100
+        failed = failed or percent > args.threshold
+        print(f"{endpoint:<24}{1 / off['seconds_per_request']:>10.1f}/s{1 / on['seconds_per_request']:>10.1f}/s"
+              f"{on['statements_per_request']:>8.1f}{percent:>11.2f}%")
+    print(f"threshold: {args.threshold}%")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
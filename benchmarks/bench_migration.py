@@ -0,0 +1,140 @@
+"""マイグレーション中の書き込みへの影響と、dry run の見積もり精度のベンチマーク
+
+使い方:
+    python benchmarks/bench_migration.py [--rows 300000] [--chunk-size 5000]
+
+--rows 件の sales_history を用意し、売上を書き込み続けるスレッドを動かしながら
+次の2通りで列の埋め戻し、インデックス作成、列の削除を行い、書き込みの待ち時間（p50 / p99 / 最大）と
+失敗件数を比較する。
+
+- single: 1つのUPDATEを1トランザクションで実行する（従来の手作業）
+- chunked: migrations.Operations.backfill（transactional=False）
+
+インデックスの作成（index）は分割できないため、作成中の待ち時間をそのまま表示する。
+列の削除は ALTER TABLE DROP COLUMN（alter）と migrations.Operations.drop_column（rebuild、
+新しいテーブルへのチャンクごとのコピーと入れ替え）を比較する。
+
+あわせて、dry run（plan）の見積もりと実際の所要時間を表示する。
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def populate(conn, rows):
+    from db import transaction
+
+    batch = 10000
+    for start in range(0, rows, batch):
+        with transaction(conn, immediate=True):
+            conn.executemany(
+                "INSERT INTO sales_history (product_id, quantity, unit_price, total_amount, created_at) "
+                "VALUES (?, 1, 1000, 1000, datetime('2024-01-01', ? || ' minutes'))",
+                [((i % 5) + 1, str(i)) for i in range(start, min(start + batch, rows))],
+            )
+
+
+def write_loop(stop, timings, errors):
+    """別の接続で売上を1件ずつ書き込み、1件あたりの所要時間を記録する"""
+    import sqlite3
+
+    from db import get_db, transaction
+
+    conn = get_db()
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            with transaction(conn, immediate=True):
+                conn.execute("INSERT INTO sales_history (product_id, quantity, unit_price, total_amount) "
+                             "VALUES (1, 1, 1000, 1000)")
+        except sqlite3.OperationalError:
+            errors.append(time.perf_counter() - started)
+            continue
+        timings.append(time.perf_counter() - started)
+        time.sleep(0.002)
+
+
+def measure(label, function):
+    stop = threading.Event()
+    timings, errors = [], []
+    writer = threading.Thread(target=write_loop, args=(stop, timings, errors))
+    writer.start()
+    time.sleep(0.2)
+    started = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - started
+    time.sleep(0.2)
+    stop.set()
+    writer.join()
+    timings.sort()
+    print(f"{label:<10}{elapsed:>9.2f}s{len(timings):>9}{len(errors):>8}"
+          f"{statistics.median(timings) * 1000:>10.2f}ms{timings[int(len(timings) * 0.99) - 1] * 1000:>10.2f}ms"
+          f"{timings[-1] * 1000:>10.2f}ms")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=300000)
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ.update(DATABASE_PATH=os.path.join(tmp, 'bench.db'), LOG_LEVEL='WARNING')
+    os.environ.pop('RENDER', None)
+    sys.path.insert(0, ROOT)
+    from db import get_db, transaction
+    from app import create_app
+    create_app()  # スキーマを作成する
+    import migrations
+
+    conn = get_db()
+    populate(conn, args.rows)
+    for column in ('note_single', 'note_chunked', 'drop_alter', 'drop_rebuild'):
+        conn.execute(f"ALTER TABLE sales_history ADD COLUMN {column} TEXT")
+
+    def single():
+        with transaction(conn, immediate=True):
+            conn.execute("UPDATE sales_history SET note_single = 'n' || product_id WHERE note_single IS NULL")
+
+    def backfill(operations):
+        return operations.backfill('sales_history', "note_chunked = 'n' || product_id", 'note_chunked IS NULL',
+                                   chunk_size=args.chunk_size)
+
+    def create_index(operations):
+        operations.create_index('idx_bench_chunked', 'sales_history', ['note_chunked', 'created_at'])
+
+    def alter():
+        with transaction(conn, immediate=True):
+            conn.execute("ALTER TABLE sales_history DROP COLUMN drop_alter")
+
+    def drop_column(operations):
+        operations.drop_column('sales_history', 'drop_rebuild')
+
+    dry_run = migrations.Operations(conn, transactional=False, dry_run=True)
+    backfill(dry_run)
+
+    print(f"{'':<10}{'elapsed':>10}{'writes':>9}{'failed':>8}{'write p50':>12}{'write p99':>12}{'write max':>12}")
+    measure('single', single)
+    actual = measure('chunked', lambda: backfill(migrations.Operations(conn, transactional=False)))
+    create_index(dry_run)
+    actual += measure('index', lambda: create_index(migrations.Operations(conn, transactional=False)))
+    measure('alter', alter)
+    drop_column(dry_run)
+    actual += measure('rebuild', lambda: drop_column(migrations.Operations(conn, transactional=False)))
+    print()
+    print("dry run の見積もり:")
+    for step in dry_run.steps:
+        print(f"  {step['operation']:<13}{step['target']:<20} 推定 {step['seconds']:.2f}秒"
+              f"（書き込みロック {step['lock_seconds']:.3f}秒）")
+    print(f"  合計 推定 {sum(step['seconds'] for step in dry_run.steps):.2f}秒 / 実際 {actual:.2f}秒")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""在庫僅少の商品の取得と発注点の定期更新のベンチマーク
+
+使い方:
+    python benchmarks/bench_reorder.py [--products 100000] [--sales 10000000] [--repeat 20]
+
+datagen.py で --products 件の商品と --sales 件の売上履歴（2年分）を作り、次を計測する。
+
+- 在庫僅少の商品: 従来の方法（商品一覧 /api/products?format=columns を全件取得して在庫で絞り込む）と
+  /api/inventory/at-risk（部分インデックス idx_products_low_stock）の応答時間（p50）。
+  SQLだけの比較として、在庫僅少の件数を部分インデックスと全件走査（NOT INDEXED）で数える時間も計測する
+- 発注点の定期更新（reorder.run。sales_daily から販売速度を集計する）の所要時間。
+  この間は書き込みロックを保持する
+- ダッシュボード（/api/dashboard）の応答時間（在庫僅少数はトリガーで更新済み）
+
+ETagによる304は使わない（毎回DBを読む）。
+"""
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+END = date(2024, 12, 31)
+COUNT_LOW_STOCK = "SELECT COUNT(*) FROM products {} WHERE quantity < reorder_point"
+
+
+def timed(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--sales', type=int, default=10000000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ.update(DATABASE_PATH=os.path.join(tmp, 'bench.db'), LOG_LEVEL='WARNING', REORDER_INTERVAL='0',
+                      PASSWORD_WORKERS='0')
+    os.environ.pop('RENDER', None)
+    sys.path.insert(0, ROOT)
+    import app as application
+    import datagen
+    import reorder
+    from db import close_db, get_db
+
+    app = application.create_app()
+    close_db()
+    result = datagen.generate(args.products, args.sales, years=2, end=END)
+    print(f"商品 {result['products']:,}件 / 売上 {result['sales']:,}件を生成（{result['seconds']}秒）")
+
+    client = app.test_client()
+    conn = get_db()
+    low_stock = conn.execute(COUNT_LOW_STOCK.format('')).fetchone()[0]
+    print(f"在庫僅少の商品: {low_stock:,}件")
+
+    def legacy():
+        listing = client.get('/api/products?format=columns').get_json()
+        quantity, point = listing['columns'].index('quantity'), listing['columns'].index('reorder_point')
+        return [row for row in listing['rows'] if row[quantity] < row[point]]
+
+    results = {
+        '商品一覧を全件取得して絞り込む': timed(legacy, max(args.repeat // 10, 1)),
+        '/api/inventory/at-risk': timed(lambda: client.get('/api/inventory/at-risk'), args.repeat),
+        '件数: 全件走査（NOT INDEXED）':
+            timed(lambda: conn.execute(COUNT_LOW_STOCK.format('NOT INDEXED')).fetchone(), args.repeat),
+        '件数: 部分インデックス': timed(lambda: conn.execute(COUNT_LOW_STOCK.format('')).fetchone(), args.repeat),
+        '/api/dashboard': timed(lambda: client.get('/api/dashboard'), args.repeat),
+        '発注点の更新（reorder.run）': timed(lambda: reorder.run(END), 3),
+    }
+    for label, seconds in results.items():
+        print(f"  {label:<32}{seconds * 1000:>10.2f}ms")
+    close_db()
+    shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""売上履歴の正規化（product_name の削除）前後のファイルサイズと集計時間のベンチマーク
+
+使い方:
+    python benchmarks/bench_sales_schema.py [--rows 10000000] [--products 10000] [--repeat 3]
+
+マイグレーション1（product_name あり）のスキーマに datagen.py の売上履歴を --rows 件入れ、
+次を計測してからマイグレーション2（product_name の削除）を適用し、同じものを計測し直す。
+
+- データベースファイルの大きさ（VACUUM 後の大きさも表示する）
+- 商品別売上合計: 従来の GROUP BY product_name と、sales.product_totals（GROUP BY product_id）
+  （全期間・直近90日）
+- 売上履歴の先頭ページ（sales.history_page、500行）
+
+あわせて dry run（plan）の見積もりと、マイグレーション・VACUUM の実際の所要時間を表示する。
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+END = date(2024, 12, 31)
+
+LEGACY_TOTALS = """
+    SELECT product_name, SUM(total_amount) as sales
+    FROM sales_history
+    {where}
+    GROUP BY product_name
+    ORDER BY sales DESC
+"""
+
+
+def load(db_path, products_count, rows):
+    """マイグレーション1のスキーマに商品と売上履歴（商品名つき）を入れる"""
+    import datagen
+    import migrations
+    from db import connect
+
+    conn = connect(db_path)
+    migrations.migrate(conn, target=1)
+    conn.close()
+
+    rng = random.Random(0)
+    catalog = datagen.generate_catalog(rng, products_count)
+    names = [item[1] for item in catalog]
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute("PRAGMA locking_mode = EXCLUSIVE")
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("BEGIN")
+    recreate = datagen._drop_derived(conn, ('products', 'sales_history'))
+    conn.executemany("INSERT INTO products (id, sku, name, price, quantity) VALUES (?, ?, ?, ?, ?)",
+                     [(product_id, sku, name, price, quantity)
+                      for product_id, (sku, name, price, quantity, _, _) in enumerate(catalog, 1)])
+    datagen._insert(conn, "INSERT INTO sales_history (product_id, product_name, quantity, unit_price, total_amount, "
+                          "created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    ((row[0], names[row[0] - 1]) + row[1:]
+                     for row in datagen.generate_sales(rng, catalog, rows, END.replace(year=END.year - 2), END)))
+    for sql in recreate:
+        conn.execute(sql)
+    conn.execute("COMMIT")
+    conn.execute("ANALYZE")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.close()
+
+
+def file_size(conn, db_path):
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return os.path.getsize(db_path)
+
+
+def timed(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def measure(conn, repeat, legacy):
+    import sales
+
+    recent = (END - timedelta(days=89)).isoformat()
+    cursor = conn.cursor()
+    results = {}
+    if legacy:
+        results['GROUP BY product_name（全期間）'] = timed(
+            lambda: cursor.execute(LEGACY_TOTALS.format(where='')).fetchall(), repeat)
+        results['GROUP BY product_name（90日）'] = timed(
+            lambda: cursor.execute(LEGACY_TOTALS.format(where='WHERE created_at >= ?'), (recent,)).fetchall(), repeat)
+    results['product_totals（全期間）'] = timed(lambda: sales.product_totals(cursor), repeat)
+    results['product_totals（90日）'] = timed(lambda: sales.product_totals(cursor, recent), repeat)
+    results['history_page（500行）'] = timed(lambda: sales.history_page(cursor, limit=500), repeat)
+    for label, seconds in results.items():
+        print(f"  {label:<34}{seconds * 1000:>10.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=10000000)
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    db_path = os.path.join(tmp, 'bench.db')
+    os.environ.update(DATABASE_PATH=db_path, LOG_LEVEL='WARNING')
+    os.environ.pop('RENDER', None)
+    sys.path.insert(0, ROOT)
+    import migrations
+    from db import connect
+
+    started = time.perf_counter()
+    load(db_path, args.products, args.rows)
+    print(f"{args.rows:,} 行を投入（{time.perf_counter() - started:.1f}秒）")
+
+    conn = connect(db_path)
+    print(f"変更前: {file_size(conn, db_path) / 1024 ** 2:,.1f}MB")
+    measure(conn, args.repeat, legacy=True)
+
+    for item in migrations.plan(conn):
+        print(f"dry run: {item['name']} 推定 {item['seconds']:.1f}秒（書き込みロック {item['lock_seconds']:.1f}秒）")
+    started = time.perf_counter()
+    migrations.migrate(conn)
+    print(f"マイグレーション: {time.perf_counter() - started:.1f}秒")
+    print(f"変更後: {file_size(conn, db_path) / 1024 ** 2:,.1f}MB")
+    started = time.perf_counter()
+    conn.execute("VACUUM")
+    print(f"VACUUM 後: {file_size(conn, db_path) / 1024 ** 2:,.1f}MB（{time.perf_counter() - started:.1f}秒）")
+    measure(conn, args.repeat, legacy=False)
+    conn.close()
+    shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""JSONのエンコード・列形式・圧縮による転送量と処理時間のベンチマーク
+
+使い方:
+    python benchmarks/bench_serialization.py [--products 20000] [--sales 200000] [--repeat 20]
+
+generate-data（datagen.py）で作ったデータベースに対して、/api/products（全件）と
+/api/sales-analysis?limit=500 を次の組み合わせで取得し、本文のバイト数・エンコード時間
+（取得済みのデータをJSONにする時間）・リクエスト全体の時間（p50）を比較する。
+
+- default: Flask標準のJSONプロバイダー（日本語を \\uXXXX にエスケープ・キーを並べ替え）
+- json: responses.JSONProvider（orjson なし）
+- orjson: responses.JSONProvider（orjson があるときのみ）
+- +columns: ?format=columns
+- +gzip / +br: Accept-Encoding（br は brotli があるときのみ）
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def timed(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--products', type=int, default=20000)
+    parser.add_argument('--sales', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ.update(DATABASE_PATH=os.path.join(tmp, 'bench.db'), LOG_LEVEL='WARNING')
+    os.environ.pop('RENDER', None)
+    sys.path.insert(0, ROOT)
+    from flask.json.provider import DefaultJSONProvider
+
+    import app as application
+    import datagen
+    import products
+    import responses
+    import sales
+    from db import close_db, get_db
+
+    close_db()  # スキーマ作成時の接続を閉じる（generate はデータベースを排他ロックする）
+    datagen.generate(args.products, args.sales, years=2, seed=0)
+    app = application.create_app({'COMPRESS_MIN_BYTES': 0})
+    client = app.test_client()
+    client.post('/api/login', json={'username': 'admin', 'password': app.config['DEFAULT_PASSWORD']})
+
+    def payloads(columnar):
+        cursor = get_db().cursor()
+        return {
+            '/api/products': products.search(cursor, columnar=columnar)[0],
+            '/api/sales-analysis?limit=500': {
+                'sales_history': sales.history_page(cursor, limit=500, columnar=columnar)[0],
+                'next_cursor': None,
+                'chart_data': sales.product_totals(cursor),
+            },
+        }
+
+    orjson = responses.orjson
+    providers = [('default', DefaultJSONProvider, None), ('json', responses.JSONProvider, None)]
+    if orjson:
+        providers.append(('orjson', responses.JSONProvider, orjson))
+    encodings = ['identity', 'gzip'] + (['br'] if responses.brotli else [])
+
+    print(f"{'':<34}{'variant':<22}{'bytes':>12}{'encode':>11}{'request p50':>14}")
+    for label, provider_class, module in providers:
+        app.json = provider_class(app)
+        responses.orjson = module
+        for columnar in (False, True):
+            with app.app_context():
+                data = payloads(columnar)
+            for path, payload in data.items():
+                with app.app_context():
+                    encode_ms, _ = timed(lambda: app.json.response(payload), args.repeat)
+                url = path + ('&' if '?' in path else '?') + 'format=columns' if columnar else path
+                for encoding in encodings:
+                    request_ms, response = timed(
+                        lambda: client.get(url, headers={'Accept-Encoding': encoding}), args.repeat)
+                    variant = label + ('+columns' if columnar else '') + ('' if encoding == 'identity' else '+' + encoding)
+                    print(f"{path:<34}{variant:<22}{len(response.get_data()):>12,}{encode_ms:>9.2f}ms"
+                          f"{request_ms:>12.2f}ms")
+    responses.orjson = orjson
+
+
+if __name__ == '__main__':
+    main()
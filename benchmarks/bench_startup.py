@@ -0,0 +1,108 @@
+"""ワーカーの起動時間とリクエストごとのオーバーヘッドのベンチマーク
+
+使い方:
+    python benchmarks/bench_startup.py [--root .] [--requests 2000]
+
+--root に別のチェックアウト（git worktree で作った変更前のコミットなど）を指定すると、
+同じ条件で比較できる。計測する項目:
+
+- import: 新しいPythonプロセスで app を読み込み終えるまでの時間（--preload なしの各ワーカー）
+- fork: app を読み込み済みのプロセスからforkした子プロセスが最初のリクエストに応答するまでの時間
+  （gunicorn --preload の各ワーカー）
+- 各エンドポイントの requests/sec（Flaskテストクライアント）
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+PROBE = r"""
+import json, os, sys, time
+started = time.perf_counter()
+sys.path.insert(0, os.environ['BENCH_ROOT'])
+os.chdir(os.environ['BENCH_ROOT'])
+try:
+    import wsgi as module
+except ImportError:
+    import app as module  # 変更前のコードは app.py にアプリケーションがある
+imported = time.perf_counter() - started
+if os.environ.get('BENCH_MODE') == 'import':
+    print(json.dumps({'import': imported}))
+    raise SystemExit
+
+app = module.app
+if hasattr(module, 'init_database'):
+    module.init_database()  # 変更前のコードは import 時に初期化しない
+requests_count = int(os.environ['BENCH_REQUESTS'])
+
+# fork してから最初のリクエストに応答するまで
+fork_times = []
+for _ in range(5):
+    read_fd, write_fd = os.pipe()
+    started = time.perf_counter()
+    pid = os.fork()
+    if pid == 0:
+        app.test_client().get('/api/dashboard')
+        os.write(write_fd, b'x')
+        os._exit(0)
+    os.read(read_fd, 1)
+    fork_times.append(time.perf_counter() - started)
+    os.waitpid(pid, 0)
+    os.close(read_fd)
+    os.close(write_fd)
+
+client = app.test_client()
+with client.session_transaction() as sess:
+    sess['user_id'] = 1
+    sess['username'] = 'admin'
+    sess['role'] = 'admin'
+results = {'fork': sorted(fork_times)[len(fork_times) // 2]}
+for label, send in (
+    ('GET /api/dashboard', lambda i: client.get('/api/dashboard', headers={'Cache-Control': 'no-cache'})),
+    ('GET /api/products', lambda i: client.get('/api/products')),
+    ('POST /api/products', lambda i: client.post('/api/products', json={'sku': f'B{i}', 'name': 'b', 'price': 1, 'quantity': 1})),
+):
+    send(-1)
+    started = time.perf_counter()
+    for i in range(requests_count):
+        send(i).close()
+    results[label] = requests_count / (time.perf_counter() - started)
+print(json.dumps(results))
+"""
+
+
+def run_probe(root, db_path, mode, requests_count):
+    env = dict(os.environ, BENCH_ROOT=root, BENCH_MODE=mode, BENCH_REQUESTS=str(requests_count),
+               DATABASE_PATH=db_path, LOG_LEVEL='ERROR', METRICS='0')
+    env.pop('RENDER', None)
+    out = subprocess.run([sys.executable, '-c', PROBE], env=env, capture_output=True, text=True)
+    if out.returncode != 0:
+        raise SystemExit(out.stderr)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--root', default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    root = os.path.abspath(args.root)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        results = run_probe(root, db_path, 'requests', args.requests)  # 初期化済みのデータベースで計測する
+        imports = [run_probe(root, db_path, 'import', 0)['import'] for _ in range(args.repeat)]
+
+    print(f"root: {root}")
+    print(f"worker boot (import app): {statistics.median(imports) * 1000:8.1f} ms")
+    print(f"worker boot (fork):       {results.pop('fork') * 1000:8.1f} ms")
+    for label, rate in results.items():
+        print(f"{label:<26}{rate:>10.1f}/s")
+
+
+if __name__ == '__main__':
+    main()
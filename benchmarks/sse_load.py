@@ -0,0 +1,160 @@
+"""/api/events（Server-Sent Events）の同時接続負荷テスト
+
+使い方:
+    gunicorn wsgi:app -c gunicorn.conf.py --bind 127.0.0.1:8000 &
+    python benchmarks/sse_load.py [--url http://127.0.0.1:8000] [--clients 1000] [--writes 20]
+
+--clients 本のSSE接続をノンブロッキングソケットで同時に張り、ログインした別の
+接続から /api/inventory/inbound を --writes 回呼ぶ。書き込みごとに、全接続へ
+kpi イベントが届くまでの遅延（中央値・95パーセンタイル・最大）を表示する。
+既定の gevent ワーカーではワーカーごとに SSE_MAX_SUBSCRIBERS（1800）まで接続を受け付ける。
+上限を超えた接続は 503 で断られ、rejected として数える（GUNICORN_WORKER_CLASS=gthread では
+WEB_CONCURRENCY × スレッド数の半分を超えた分）。
+ulimit -n が --clients より大きいことを確認してから実行すること。
+"""
+import argparse
+import json
+import selectors
+import socket
+import statistics
+import time
+import urllib.parse
+import urllib.request
+from http.cookiejar import CookieJar
+
+
+def open_stream(host, port):
+    sock = socket.create_connection((host, port))
+    sock.sendall(f"GET /api/events HTTP/1.1\r\nHost: {host}\r\nAccept: text/event-stream\r\n\r\n".encode('ascii'))
+    sock.setblocking(False)
+    return sock
+
+
+def parse_events(buffer):
+    """受信済みバッファから完結したイベントを取り出す。戻り値は (イベントのリスト, 残り)"""
+    found = []
+    while b"\n\n" in buffer:
+        block, buffer = buffer.split(b"\n\n", 1)
+        event, data = None, None
+        for line in block.decode('utf-8', 'replace').splitlines():
+            if line.startswith('event: '):
+                event = line[7:]
+            elif line.startswith('data: '):
+                data = line[6:]
+        if event:
+            found.append((event, json.loads(data) if data else None))
+    return found, buffer
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--writes', type=int, default=20)
+    parser.add_argument('--username', default='admin')
+    parser.add_argument('--password', default='Admin@2024!')
+    parser.add_argument('--timeout', type=float, default=10.0)
+    args = parser.parse_args()
+
+    parsed = urllib.parse.urlparse(args.url)
+    host, port = parsed.hostname, parsed.port or 80
+
+    selector = selectors.DefaultSelector()
+    buffers = {}
+    started = time.perf_counter()
+    for _ in range(args.clients):
+        sock = open_stream(host, port)
+        selector.register(sock, selectors.EVENT_READ)
+        buffers[sock] = b""
+
+    latest = {}  # 接続ごとに最後に受け取ったデータバージョン
+    rejected = 0
+
+    def poll(deadline, on_event):
+        nonlocal rejected
+        while time.perf_counter() < deadline:
+            ready = selector.select(timeout=max(0.0, deadline - time.perf_counter()))
+            if not ready:
+                return
+            for key, _ in ready:
+                sock = key.fileobj
+                try:
+                    chunk = sock.recv(65536)
+                except BlockingIOError:
+                    continue
+                if not chunk:
+                    selector.unregister(sock)
+                    sock.close()
+                    continue
+                data = buffers[sock] + chunk
+                if sock not in latest and data.startswith(b"HTTP/1.1 503"):
+                    rejected += 1
+                    selector.unregister(sock)
+                    sock.close()
+                    continue
+                events, buffers[sock] = parse_events(data)
+                for event, payload in events:
+                    if event == 'kpi':
+                        latest[sock] = payload['version']
+                        on_event(sock, payload)
+            if on_event.done():
+                return
+
+    class WaitAll:
+        def __init__(self, socks, target_version=None):
+            self.target_version = target_version
+            self.pending = set(socks)
+            self.arrivals = []
+
+        def __call__(self, sock, payload):
+            if sock in self.pending and (self.target_version is None or payload['version'] >= self.target_version):
+                self.pending.discard(sock)
+                self.arrivals.append(time.perf_counter())
+
+        def done(self):
+            return not self.pending
+
+    # 全接続で最初のkpiを受け取るまで待つ
+    waiter = WaitAll(buffers)
+    poll(time.perf_counter() + args.timeout, waiter)
+    connected = args.clients - len(waiter.pending) - rejected
+    print(f"connected: {connected}/{args.clients} ({rejected} rejected) in {time.perf_counter() - started:.2f}s")
+
+    # 書き込み用のセッション
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+
+    def post(path, body):
+        req = urllib.request.Request(args.url + path, data=json.dumps(body).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'})
+        with opener.open(req) as res:
+            return json.load(res)
+
+    if not post('/api/login', {'username': args.username, 'password': args.password}).get('success'):
+        raise SystemExit('ログインに失敗しました')
+
+    live = {sock for sock in buffers if sock in latest}
+    worst, medians, p95s, missed = [], [], [], 0
+    for _ in range(args.writes):
+        target = max(latest[sock] for sock in live) + 1
+        waiter = WaitAll(live, target)
+        sent = time.perf_counter()
+        post('/api/inventory/inbound', {'product_id': 1, 'quantity': 1})
+        poll(sent + args.timeout, waiter)
+        missed += len(waiter.pending)
+        delays = sorted(t - sent for t in waiter.arrivals)
+        if delays:
+            medians.append(statistics.median(delays))
+            p95s.append(delays[int(len(delays) * 0.95) - 1 if len(delays) > 1 else 0])
+            worst.append(delays[-1])
+
+    if medians:
+        print(f"writes: {args.writes}  delivery latency "
+              f"median={statistics.median(medians) * 1000:.1f}ms "
+              f"p95={statistics.median(p95s) * 1000:.1f}ms "
+              f"max={max(worst) * 1000:.1f}ms  missed={missed}")
+    for sock in list(buffers):
+        sock.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""売上登録の同時実行ストレステスト
+
+使い方:
+    python benchmarks/stress_oversell.py [--processes 8] [--attempts 300] [--stock 1000]
+
+在庫 --stock 個の商品に対し、--processes 個のプロセスが --attempts 回ずつ
+1個の売上登録を同時に行う。売上件数が在庫数を超えない（過剰販売がない）ことを
+検証し、1プロセスで順番に処理した場合（プロキシで直列化した場合に相当）と
+スループットを比較する。
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def sell(args):
+    db_path, attempts, start_event = args
+    os.environ['DATABASE_PATH'] = db_path
+    from app import create_app
+    app = create_app()
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+    start_event.wait()
+    sold = 0
+    for _ in range(attempts):
+        result = client.post('/api/sales', json={'product_id': 1, 'quantity': 1, 'price': 100}).get_json()
+        sold += result['success']
+    return sold
+
+
+def run(db_path, processes, attempts, stock):
+    from db import connect
+
+    conn = connect(db_path)
+    conn.execute("UPDATE products SET quantity = ? WHERE id = 1", (stock,))
+    conn.execute("DELETE FROM sales_history")
+    conn.close()
+
+    with multiprocessing.Manager() as manager:
+        start_event = manager.Event()
+        with multiprocessing.Pool(processes) as pool:
+            pending = pool.map_async(sell, [(db_path, attempts, start_event)] * processes)
+            time.sleep(1)  # 全プロセスの起動を待つ
+            started = time.perf_counter()
+            start_event.set()
+            sold = sum(pending.get())
+            elapsed = time.perf_counter() - started
+
+    conn = connect(db_path)
+    remaining = conn.execute("SELECT quantity FROM products WHERE id = 1").fetchone()[0]
+    recorded = conn.execute("SELECT COALESCE(SUM(quantity), 0) FROM sales_history").fetchone()[0]
+    conn.close()
+    return {
+        'attempts': processes * attempts,
+        'sold': sold,
+        'recorded': recorded,
+        'remaining': remaining,
+        'elapsed': elapsed,
+        'ok': sold == recorded == min(stock, processes * attempts) and remaining == stock - recorded >= 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--processes', type=int, default=8)
+    parser.add_argument('--attempts', type=int, default=300)
+    parser.add_argument('--stock', type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'stress.db')
+        os.environ['DATABASE_PATH'] = db_path
+        os.environ.pop('RENDER', None)
+        from app import init_database
+        init_database()
+
+        total = args.processes * args.attempts
+        serialized = run(db_path, 1, total, args.stock)
+        concurrent = run(db_path, args.processes, args.attempts, args.stock)
+
+    for label, result in (('serialized (1 process)', serialized),
+                          (f'concurrent ({args.processes} processes)', concurrent)):
+        print(f"{label}: sold={result['sold']} recorded={result['recorded']} remaining={result['remaining']} "
+              f"{result['attempts'] / result['elapsed']:,.0f} attempts/s "
+              f"{'OK' if result['ok'] else 'OVERSOLD'}")
+    if not (serialized['ok'] and concurrent['ok']):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
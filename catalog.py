@@ -0,0 +1,125 @@
+"""商品カタログのキャッシュ
+
+商品一覧・検索結果（products.search）と商品1件の参照を、プロセス内のLRUキャッシュに保持する。
+キャッシュはデータバージョン（db.data_version。全ワーカーで共有するmmapのカウンター）ごとに持ち、
+どのワーカーで書き込みがコミットされてもバージョンが上がるので、次の参照で全件を捨てて読み直す。
+在庫の変化（売上・入出庫）もバージョンを上げるため、古い在庫数を返すことはない。
+
+バージョンはデータベースを読む前に取得し、読み終えたときにキャッシュが別のバージョンに
+切り替わっていれば保存しない（読んでいる間に書き込みがあっても古い内容が残らない）。
+キャッシュした値はスレッド間で共有するので、呼び出し側で変更しないこと。
+
+キャッシュは件数に加えておおよそのバイト数（approximate_size）でも制限する。件数を絞らない検索
+（limit なし。商品数に比例して大きくなる）も上限のバイト数に収まればキャッシュし、収まらなかったキーは
+そのバージョンの間は大きさを測らずに毎回読む。
+"""
+import sys
+import threading
+from collections import OrderedDict
+
+import config
+from db import data_version, get_db_path
+import metrics
+import products
+
+lookups = metrics.Counter('catalog_cache_lookups_total', '商品カタログのキャッシュの参照数', labels=('cache', 'result'))
+
+
+def approximate_size(value):
+    """値のおおよそのメモリ使用量（バイト）。dict・list・tuple は中身も数える"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(approximate_size(key) + approximate_size(item) for key, item in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(approximate_size(item) for item in value)
+    return size
+
+
+class LRUCache:
+    """データバージョンごとに中身を入れ替える、件数とバイト数の上限付きのLRUキャッシュ
+
+    上限の件数は設定 setting（0 でキャッシュしない）、バイト数は設定 bytes_setting から読む。
+    1件で上限のバイト数を超える値は保存せず、同じバージョンの間はそのキーを測り直さない。
+    """
+
+    def __init__(self, name, setting, bytes_setting):
+        self.name = name
+        self.setting = setting
+        self.bytes_setting = bytes_setting
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._oversized = set()
+        self._bytes = 0
+        self._version = None
+        self._lock = threading.Lock()
+
+    def get(self, key, load):
+        """key の値を返す。なければ load() で読み込んで保存する"""
+        maxsize = config.get(self.setting)
+        if maxsize <= 0:
+            return load()
+        # 別のデータベースを使うアプリ（create_app の設定）とは中身を共有しない
+        version = (get_db_path(),) + data_version()[:2]
+        with self._lock:
+            if self._version != version:
+                self._entries.clear()
+                self._sizes.clear()
+                self._oversized.clear()
+                self._bytes = 0
+                self._version = version
+            elif key in self._entries:
+                self._entries.move_to_end(key)
+                lookups.inc((self.name, 'hit'))
+                return self._entries[key]
+            elif key in self._oversized:
+                lookups.inc((self.name, 'oversized'))
+                return load()
+        lookups.inc((self.name, 'miss'))
+        value = load()
+        size = approximate_size(value)
+        max_bytes = config.get(self.bytes_setting)
+        if size > max_bytes:
+            with self._lock:
+                if self._version == version:
+                    self._oversized.add(key)
+            return value
+        with self._lock:
+            if self._version == version:
+                self._bytes += size - self._sizes.get(key, 0)
+                self._entries[key] = value
+                self._sizes[key] = size
+                self._entries.move_to_end(key)
+                while len(self._entries) > maxsize or self._bytes > max_bytes:
+                    evicted, _ = self._entries.popitem(last=False)
+                    self._bytes -= self._sizes.pop(evicted)
+        return value
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def bytes(self):
+        return self._bytes
+
+
+searches = LRUCache('search', 'CATALOG_CACHE_SEARCHES', 'CATALOG_CACHE_SEARCH_BYTES')
+product_rows = LRUCache('product', 'CATALOG_CACHE_PRODUCTS', 'CATALOG_CACHE_PRODUCT_BYTES')
+
+metrics.Gauge('catalog_cache_entries', '商品カタログのキャッシュの件数', lambda: len(searches) + len(product_rows))
+metrics.Gauge('catalog_cache_bytes', '商品カタログのキャッシュのおおよそのバイト数',
+              lambda: searches.bytes + product_rows.bytes)
+
+
+def search(cursor, query=None, field='all', sort='name', order='asc', limit=None, after=None, columnar=False):
+    """products.search の結果（キャッシュがあればそれ）を返す"""
+    key = (query, field, sort, order, limit, after, columnar)
+    return searches.get(key, lambda: products.search(cursor, query, field, sort, order, limit, after, columnar))
+
+
+def get_product(cursor, product_id):
+    """商品1件（PRODUCT_COLUMNS の辞書。なければ None）"""
+    def load():
+        row = cursor.execute("SELECT id, sku, name, price, quantity, reorder_point FROM products WHERE id = ?",
+                             (product_id,)).fetchone()
+        return dict(zip(products.PRODUCT_COLUMNS, row)) if row else None
+    return product_rows.get(product_id, load)
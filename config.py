@@ -0,0 +1,176 @@
+"""アプリケーション設定
+
+環境変数は起動時に load_config() で1回だけ読み込み、Flaskの app.config に入れる。
+リクエストの処理中は環境変数を参照しない。各モジュールは get() で設定値を読む
+（アプリケーションコンテキストの中ではそのアプリの app.config、外（ベンチマーク・スクリプト）では
+環境変数から読んだ既定の設定）。create_app(config) で上書きした値はそのアプリの中でだけ有効になる。
+"""
+import os
+from datetime import timedelta
+
+from flask import current_app, has_app_context
+
+_defaults = None
+
+
+def database_path(environ=None):
+    """データベースファイルのパス"""
+    environ = os.environ if environ is None else environ
+    # Render環境では必ず/tmp/inventory.dbを使用
+    if environ.get('RENDER'):
+        return '/tmp/inventory.db'
+    return environ.get('DATABASE_PATH', 'inventory.db')
+
+
+def sse_max_subscribers(environ=None):
+    """ワーカーあたりのSSE接続数の上限の既定値（gunicorn.conf.py と同じ環境変数から決める）
+
+    gevent ワーカーでは待機中の接続はコルーチン1つ分しか使わないので、同時接続数
+    （GUNICORN_WORKER_CONNECTIONS）の9割までSSEに使い、残りを通常のリクエストに残す。
+    gthread ワーカーでは接続ごとにスレッドを占有するので、スレッド数の半分にする。
+    """
+    environ = os.environ if environ is None else environ
+    if environ.get('GUNICORN_WORKER_CLASS', 'gevent') == 'gevent':
+        return max(1, int(environ.get('GUNICORN_WORKER_CONNECTIONS', 2000)) * 9 // 10)
+    return max(1, int(environ.get('GUNICORN_THREADS', 64)) // 2)
+
+
+def load_config(environ=None):
+    environ = os.environ if environ is None else environ
+    from_cli = bool(environ.get('FLASK_RUN_FROM_CLI'))
+    return {
+        'DATABASE_PATH': database_path(environ),
+        'SECRET_KEY': environ.get('SECRET_KEY', 'dev-secret-key'),
+        'PERMANENT_SESSION_LIFETIME': timedelta(hours=2),
+        # 起動時にスキーマを作成・更新する（0 で無効。flask init-db / migrate で手動実行する）。
+        # flask コマンドから読み込んだ場合は既定で無効（migrate --dry-run の前に適用されないように）
+        'INIT_DATABASE': environ.get('INIT_DATABASE', '0' if from_cli else '1') != '0',
+        # 初期ユーザー（admin）のパスワード
+        'DEFAULT_PASSWORD': environ.get('DEFAULT_PASSWORD', 'Admin@2024!'),
+        # リバースプロキシ（Render等）の背後では X-Forwarded-For から接続元IPを得る（ログイン試行の制限に使う）
+        'TRUSTED_PROXIES': int(environ.get('TRUSTED_PROXIES', 0)),
+
+        # SQLite接続（db.py）
+        'DB_BUSY_TIMEOUT_MS': int(environ.get('DB_BUSY_TIMEOUT_MS', 5000)),
+        'DB_CACHE_SIZE_KB': int(environ.get('DB_CACHE_SIZE_KB', 20000)),
+        'DB_MMAP_SIZE': int(environ.get('DB_MMAP_SIZE', 256 * 1024 * 1024)),
+        'DB_SYNCHRONOUS': environ.get('DB_SYNCHRONOUS', 'NORMAL'),
+        # プリペアドステートメントのキャッシュ数（接続ごと）
+        'DB_STATEMENT_CACHE_SIZE': int(environ.get('DB_STATEMENT_CACHE_SIZE', 256)),
+        # 0 で従来どおりリクエストごとに接続する（比較・切り分け用）
+        'DB_POOL': environ.get('DB_POOL', '1') != '0',
+        # busy_timeout を待っても書き込みロックを取れなかったときに BEGIN IMMEDIATE をやり直す回数
+        'DB_LOCK_RETRIES': int(environ.get('DB_LOCK_RETRIES', 2)),
+
+        # スキーママイグレーション（migrations.py）: backfill の1チャンクの rowid の範囲・合間に待つ秒数と、
+        # インデックス作成時間の見積もりに使う標本の行数
+        'MIGRATION_CHUNK_SIZE': int(environ.get('MIGRATION_CHUNK_SIZE', 5000)),
+        'MIGRATION_CHUNK_PAUSE': float(environ.get('MIGRATION_CHUNK_PAUSE', 0.05)),
+        'MIGRATION_SAMPLE_ROWS': int(environ.get('MIGRATION_SAMPLE_ROWS', 20000)),
+
+        # バックアップ（backup.py）
+        'BACKUP_DIR': environ.get('BACKUP_DIR', 'backups'),
+        # 残すスナップショットの数
+        'BACKUP_KEEP': int(environ.get('BACKUP_KEEP', 7)),
+        'BACKUP_COMPRESS': environ.get('BACKUP_COMPRESS', '1') != '0',
+        # 1ステップでコピーするページ数と、ステップ方式をあきらめるまでのやり直し回数
+        'BACKUP_PAGES': int(environ.get('BACKUP_PAGES', 1024)),
+        'BACKUP_MAX_RESTARTS': int(environ.get('BACKUP_MAX_RESTARTS', 3)),
+        # 起動時にデータベースが空（再デプロイ直後など）なら BACKUP_DIR の最新のスナップショットから復元する
+        'RESTORE_ON_START': environ.get('RESTORE_ON_START', '0') != '0',
+        # 定期スナップショットの間隔（秒）。0 で無効（flask コマンドから読み込んだ場合は無効）
+        'BACKUP_INTERVAL': 0 if from_cli else int(environ.get('BACKUP_INTERVAL', 0)),
+
+        # 発注点（reorder.py）
+        # 販売速度と発注点を計算し直す間隔（秒）。0 で無効（flask コマンドから読み込んだ場合は無効）
+        'REORDER_INTERVAL': 0 if from_cli else int(environ.get('REORDER_INTERVAL', 3600)),
+        # 販売速度を求める期間（日）
+        'REORDER_VELOCITY_DAYS': int(environ.get('REORDER_VELOCITY_DAYS', 28)),
+        # 発注から入荷までの日数と、安全在庫として上乗せする日数
+        'REORDER_LEAD_TIME_DAYS': float(environ.get('REORDER_LEAD_TIME_DAYS', 7)),
+        'REORDER_SAFETY_DAYS': float(environ.get('REORDER_SAFETY_DAYS', 3)),
+        # 推奨発注数: 発注点に加えて、この日数分の販売を賄える数まで補充する
+        'REORDER_CYCLE_DAYS': float(environ.get('REORDER_CYCLE_DAYS', 14)),
+
+        # 売上履歴のアーカイブ（archive.py）
+        # 保存先（空なら既定のデータベースと同じディレクトリの archive/）
+        'ARCHIVE_DIR': environ.get('ARCHIVE_DIR'),
+        # 本体に残す、今年より前の年数（1 なら今年と昨年を残す）
+        'ARCHIVE_KEEP_YEARS': int(environ.get('ARCHIVE_KEEP_YEARS', 1)),
+        # 1チャンクで移動する行数と、チャンクの合間に待つ秒数
+        'ARCHIVE_CHUNK_SIZE': int(environ.get('ARCHIVE_CHUNK_SIZE', 5000)),
+        'ARCHIVE_CHUNK_PAUSE': float(environ.get('ARCHIVE_CHUNK_PAUSE', 0.05)),
+
+        # パスワードの検証とログイン試行の制限（auth.py）
+        # 新しく作るハッシュのコスト。保存済みのハッシュのコストが異なればログイン成功時に作り直す
+        'BCRYPT_ROUNDS': int(environ.get('BCRYPT_ROUNDS', 12)),
+        # 検証を同時に実行するスレッド数（0 でリクエストのスレッドで直接検証する）と、
+        # 実行中に加えて待たせておける件数・結果を待つ上限（秒）
+        'PASSWORD_WORKERS': int(environ.get('PASSWORD_WORKERS', 2)),
+        'PASSWORD_QUEUE_LIMIT': int(environ.get('PASSWORD_QUEUE_LIMIT', 16)),
+        'PASSWORD_TIMEOUT': float(environ.get('PASSWORD_TIMEOUT', 10)),
+        # LOGIN_WINDOW 秒以内に上限回数失敗したら LOGIN_LOCKOUT 秒間ログインを受け付けない
+        'LOGIN_MAX_FAILURES_PER_USER': int(environ.get('LOGIN_MAX_FAILURES_PER_USER', 5)),
+        'LOGIN_MAX_FAILURES_PER_IP': int(environ.get('LOGIN_MAX_FAILURES_PER_IP', 20)),
+        'LOGIN_WINDOW': int(environ.get('LOGIN_WINDOW', 300)),
+        'LOGIN_LOCKOUT': int(environ.get('LOGIN_LOCKOUT', 300)),
+
+        # 売上・入出庫のグループコミット（writer.py）
+        'GROUP_COMMIT': environ.get('GROUP_COMMIT', '0') != '0',
+        # 最初の操作を受け取ってから集める時間（ミリ秒）と、1回のコミットにまとめる最大件数
+        'GROUP_COMMIT_WINDOW_MS': float(environ.get('GROUP_COMMIT_WINDOW_MS', 2)),
+        'GROUP_COMMIT_MAX_BATCH': int(environ.get('GROUP_COMMIT_MAX_BATCH', 256)),
+        # 操作の期限（秒）。この時間内に書き込みスレッドが実行を始められなければ、実行せずに失敗を返す
+        'GROUP_COMMIT_TIMEOUT': float(environ.get('GROUP_COMMIT_TIMEOUT', 30)),
+
+        # 商品カタログのキャッシュ（catalog.py）: キャッシュする検索結果と商品の最大件数（0 でキャッシュしない）と、
+        # それぞれのおおよその最大バイト数（ワーカーごと）
+        'CATALOG_CACHE_SEARCHES': int(environ.get('CATALOG_CACHE_SEARCHES', 64)),
+        'CATALOG_CACHE_PRODUCTS': int(environ.get('CATALOG_CACHE_PRODUCTS', 10000)),
+        'CATALOG_CACHE_SEARCH_BYTES': int(environ.get('CATALOG_CACHE_SEARCH_BYTES', 16 * 1024 * 1024)),
+        'CATALOG_CACHE_PRODUCT_BYTES': int(environ.get('CATALOG_CACHE_PRODUCT_BYTES', 8 * 1024 * 1024)),
+
+        # Server-Sent Events（events.py）
+        # ワーカーあたりの接続数の上限（既定はワーカーの種類による。sse_max_subscribers を参照）
+        'SSE_MAX_SUBSCRIBERS': int(environ.get('SSE_MAX_SUBSCRIBERS', sse_max_subscribers(environ))),
+        'SSE_QUEUE_SIZE': int(environ.get('SSE_QUEUE_SIZE', 100)),
+        # 他ワーカーの書き込みを確認する間隔と、接続維持用のコメントを送る間隔（秒）
+        'SSE_POLL_INTERVAL': float(environ.get('SSE_POLL_INTERVAL', 1.0)),
+        'SSE_HEARTBEAT_INTERVAL': float(environ.get('SSE_HEARTBEAT_INTERVAL', 15.0)),
+
+        # レスポンスの圧縮（responses.py）
+        # COMPRESS_MIN_BYTES 以上のレスポンスを Accept-Encoding に応じて gzip / brotli で圧縮する（0 で無効）
+        'COMPRESS_RESPONSES': environ.get('COMPRESS_RESPONSES', '1') != '0',
+        'COMPRESS_MIN_BYTES': int(environ.get('COMPRESS_MIN_BYTES', 1024)),
+        # 圧縮レベル（gzip は 1〜9、brotli は 0〜11）。リクエストごとに圧縮するため、圧縮率より速さを優先する
+        'GZIP_LEVEL': int(environ.get('GZIP_LEVEL', 3)),
+        'BROTLI_QUALITY': int(environ.get('BROTLI_QUALITY', 4)),
+
+        # メトリクス（metrics.py）
+        'METRICS': environ.get('METRICS', '1') != '0',
+        # SQL文ごとの計測（接続をラップするので、無効にするとその分のオーバーヘッドもなくなる）
+        'METRICS_SQL': environ.get('METRICS_SQL', '1') != '0',
+        # 設定すると /metrics に Authorization: Bearer <トークン> を要求する
+        'METRICS_TOKEN': environ.get('METRICS_TOKEN'),
+
+        # ログ（logs.py）
+        'LOG_LEVEL': environ.get('LOG_LEVEL', 'INFO').upper(),
+        'LOG_FORMAT': environ.get('LOG_FORMAT', 'json'),
+        # 0 で呼び出したスレッドから直接書き込む（切り分け・比較用）
+        'LOG_ASYNC': environ.get('LOG_ASYNC', '1') != '0',
+        # アクセスログなど件数の多いレコードを出力する割合（0〜1）
+        'LOG_SAMPLE_RATE': float(environ.get('LOG_SAMPLE_RATE', 0.1)),
+        'LOG_QUEUE_SIZE': int(environ.get('LOG_QUEUE_SIZE', 10000)),
+        # これより遅いリクエストはサンプリングせずにログに出す（ミリ秒）
+        'LOG_SLOW_REQUEST_MS': float(environ.get('LOG_SLOW_REQUEST_MS', 1000)),
+    }
+
+
+def get(key):
+    """設定値を返す（アプリケーションコンテキストの外では環境変数から読んだ既定の設定）"""
+    if has_app_context():
+        return current_app.config[key]
+    global _defaults
+    if _defaults is None:
+        _defaults = load_config()
+    return _defaults[key]
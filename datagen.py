@@ -0,0 +1,261 @@
+"""本番規模の合成データ（商品カタログと複数年の売上履歴）の生成
+
+商品は「スタイル（カテゴリ・素材・シルエット）× 色 × サイズ」の組み合わせで作る。
+売上は次の偏りを持たせる。
+
+- 人気: スタイルの人気をパレート分布で決める（一部の売れ筋に売上が集中する）。
+  サイズはM・L、色は定番色ほど売れる
+- 季節: カテゴリごとに売れる時期（Tシャツは夏、ニット・アウターは冬など）がある
+- 日ごとの件数: 月（年末・セール月）・曜日（週末）で増減し、年ごとに伸びる
+- 時刻: 営業時間（10〜21時）に集中し、1日の中では時刻順に id が振られる
+- セール月（1月・7月）は一部を値引き価格で販売する
+
+大量の行を短時間で書き込むため、既存の商品・売上を消したうえで、
+products・sales_history のトリガーとインデックスを一時的に削除し、
+ジャーナルなし（journal_mode = OFF, synchronous = OFF）の排他接続で executemany する。
+書き込み後にインデックスとトリガーを作り直し、集計値・ロールアップ・発注点・全文検索インデックスを再構築する。
+途中で失敗するとデータベースが壊れうるので、稼働中のデータベースには使わない。
+"""
+import bisect
+import logging
+import math
+import os
+import random
+import sqlite3
+import time
+from collections import namedtuple
+from datetime import date, timedelta
+from itertools import accumulate
+
+from db import bump_data_version, get_db_path
+import archive
+import products
+import reorder
+import rollups
+import stats
+
+logger = logging.getLogger(__name__)
+
+Category = namedtuple('Category', 'code name price_range sizes peak_month seasonality')
+
+LETTER_SIZES = (('XS', 0.05), ('S', 0.20), ('M', 0.35), ('L', 0.28), ('XL', 0.12))
+SHOE_SIZES = tuple((f"{size / 10:.1f}", weight) for size, weight in
+                   ((230, 0.06), (240, 0.14), (250, 0.20), (260, 0.24), (270, 0.22), (280, 0.14)))
+FREE_SIZE = (('F', 1.0),)
+
+# peak_month: 最も売れる月、seasonality: 季節による増減の大きさ（0 で1年中同じ）
+CATEGORIES = (
+    Category('TSH', 'Tシャツ', (1500, 4000), LETTER_SIZES, 7, 0.8),
+    Category('SHT', 'シャツ', (3000, 8000), LETTER_SIZES, 4, 0.3),
+    Category('KNT', 'ニット', (4000, 12000), LETTER_SIZES, 12, 0.8),
+    Category('JKT', 'ジャケット', (8000, 30000), LETTER_SIZES, 11, 0.7),
+    Category('PTS', 'パンツ', (3000, 9000), LETTER_SIZES, 4, 0.1),
+    Category('SKT', 'スカート', (3000, 8000), LETTER_SIZES, 5, 0.4),
+    Category('SWT', 'スウェット', (3500, 8000), LETTER_SIZES, 10, 0.5),
+    Category('SHO', 'スニーカー', (6000, 15000), SHOE_SIZES, 4, 0.2),
+    Category('ACC', '小物', (1000, 5000), FREE_SIZE, 12, 0.5),
+)
+MATERIALS = ('コットン', 'リネン', 'ウール', 'デニム', 'ストレッチ', 'ポリエステル', 'カシミヤ', 'ナイロン')
+FITS = ('ベーシック', 'オーバーサイズ', 'スリム', 'リラックス', 'クロップド', 'ワイド')
+# 先頭ほど定番（よく売れる）
+COLORS = (('WHT', 'ホワイト'), ('BLK', 'ブラック'), ('NVY', 'ネイビー'), ('GRY', 'グレー'), ('BEG', 'ベージュ'),
+          ('KHK', 'カーキ'), ('BRN', 'ブラウン'), ('RED', 'レッド'), ('BLU', 'ブルー'), ('GRN', 'グリーン'))
+
+# 月ごとの売上件数の倍率（1月・7月はセール、12月は年末商戦）
+MONTH_VOLUME = (1.3, 0.8, 0.9, 1.0, 1.0, 0.9, 1.2, 0.9, 0.9, 1.0, 1.1, 1.5)
+# 曜日ごとの倍率（月曜=0）
+WEEKDAY_VOLUME = (0.85, 0.8, 0.85, 0.9, 1.1, 1.45, 1.35)
+# 時刻ごとの重み（0〜23時）
+HOUR_WEIGHTS = (0, 0, 0, 0, 0, 0, 0, 0, 0, 0.2, 0.6, 0.9, 1.0, 0.9, 0.8, 0.9, 1.0, 1.1, 1.2, 1.1, 0.8, 0.3, 0, 0)
+QUANTITY_WEIGHTS = ((1, 0.72), (2, 0.19), (3, 0.06), (4, 0.02), (5, 0.01))
+YEARLY_GROWTH = 0.10
+SALE_MONTHS = (1, 7)
+SALE_SHARE = 0.4
+SALE_DISCOUNT = 0.7
+# パレート分布の形状（1.16 で上位20%が約80%を占める）
+PARETO_ALPHA = 1.16
+
+CHUNK_SIZE = 200000
+
+
+def generate_catalog(rng, count):
+    """(sku, name, price, quantity, category, 売れやすさの重み) を count 件作る"""
+    catalog = []
+    style = 0
+    while len(catalog) < count:
+        style += 1
+        category = rng.choice(CATEGORIES)
+        fit, material = rng.choice(FITS), rng.choice(MATERIALS)
+        low, high = category.price_range
+        price = rng.randrange(low, high + 1, 100) - 10  # 1990円のような価格
+        popularity = rng.paretovariate(PARETO_ALPHA)
+        colors = COLORS[:rng.randint(2, 6)]
+        for color_rank, (color_code, color_name) in enumerate(colors):
+            for size, size_weight in category.sizes:
+                if len(catalog) >= count:
+                    break
+                sku = f"{category.code}{style:05d}-{color_code}-{size}"
+                name = f"{fit}{material}{category.name} {color_name} {size}"
+                # 人気の商品ほど多めに在庫を持つ。一部は在庫わずか
+                quantity = rng.randint(0, 9) if rng.random() < 0.03 else int(20 + popularity * rng.randint(20, 80))
+                weight = popularity * size_weight / (color_rank + 1)
+                catalog.append((sku, name, price, quantity, category, weight))
+    return catalog
+
+
+def _season(category, month):
+    return 1 + category.seasonality * math.cos(2 * math.pi * (month - category.peak_month) / 12)
+
+
+def _daily_counts(rng, days, total):
+    """各日の売上件数（合計が total になるように配分する）"""
+    first_year = days[0].year
+    weights = [MONTH_VOLUME[day.month - 1] * WEEKDAY_VOLUME[day.weekday()]
+               * (1 + YEARLY_GROWTH) ** (day.year - first_year) * rng.uniform(0.85, 1.15) for day in days]
+    scale = total / sum(weights)
+    counts = [int(weight * scale) for weight in weights]
+    # 端数は重みに比例してランダムに配る
+    cumulative = list(accumulate(weights))
+    for _ in range(total - sum(counts)):
+        counts[bisect.bisect_left(cumulative, rng.random() * cumulative[-1])] += 1
+    return counts
+
+
+def generate_sales(rng, catalog, count, start, end):
+    """(product_id, quantity, unit_price, total_amount, created_at) を時刻順に生成する
+
+    product_id は catalog の並び順に1から振られる前提。
+    """
+    product_ids = range(1, len(catalog) + 1)
+    # 月ごとに、季節を反映した商品の累積重み
+    month_weights = [list(accumulate(weight * _season(category, month) for *_, category, weight in catalog))
+                     for month in range(1, 13)]
+    hours = [hour for hour, weight in enumerate(HOUR_WEIGHTS) if weight]
+    hour_weights = [HOUR_WEIGHTS[hour] for hour in hours]
+    quantities, quantity_weights = zip(*QUANTITY_WEIGHTS)
+    prices = [item[2] for item in catalog]
+    discounted = [int(price * SALE_DISCOUNT) // 10 * 10 for price in prices]
+
+    days = [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+    for day, day_count in zip(days, _daily_counts(rng, days, count)):
+        if not day_count:
+            continue
+        prefix = day.isoformat() + ' '
+        chosen = rng.choices(product_ids, cum_weights=month_weights[day.month - 1], k=day_count)
+        seconds = sorted(hour * 3600 + rng.randrange(3600)
+                         for hour in rng.choices(hours, weights=hour_weights, k=day_count))
+        sold = rng.choices(quantities, weights=quantity_weights, k=day_count)
+        on_sale = day.month in SALE_MONTHS
+        for product_id, second, quantity in zip(chosen, seconds, sold):
+            index = product_id - 1
+            price = discounted[index] if on_sale and rng.random() < SALE_SHARE else prices[index]
+            yield (product_id, quantity, price, quantity * price,
+                   f"{prefix}{second // 3600:02d}:{second // 60 % 60:02d}:{second % 60:02d}")
+
+
+def _drop_derived(conn, tables):
+    """tables のトリガーとインデックスを削除し、作り直すためのSQLを返す"""
+    placeholders = ','.join('?' * len(tables))
+    rows = conn.execute(f"""
+        SELECT type, name, sql FROM sqlite_master
+        WHERE tbl_name IN ({placeholders}) AND type IN ('trigger', 'index') AND sql IS NOT NULL
+    """, tables).fetchall()
+    for kind, name, _ in rows:
+        conn.execute(f"DROP {kind.upper()} {name}")
+    # インデックスを先に作る（トリガーはデータ投入後に不要な処理をしないよう最後に）
+    return [sql for kind, _, sql in sorted(rows, key=lambda row: row[0] != 'index')]
+
+
+def _insert(conn, sql, rows, progress=None, total=None):
+    inserted = 0
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= CHUNK_SIZE:
+            conn.executemany(sql, chunk)
+            inserted += len(chunk)
+            chunk = []
+            if progress:
+                progress(inserted, total)
+    if chunk:
+        conn.executemany(sql, chunk)
+        inserted += len(chunk)
+        if progress:
+            progress(inserted, total)
+    return inserted
+
+
+def generate(products_count=10000, sales_count=1000000, years=3, end=None, seed=0, db_path=None, progress=None):
+    """既存の商品・売上を置き換えて合成データを書き込み、件数と所要時間を返す
+
+    progress(書き込んだ売上件数, 合計) を渡すと CHUNK_SIZE 件ごとに呼ぶ。
+    アプリが稼働中（ほかの接続がある）場合は database is locked で失敗する。
+    """
+    rng = random.Random(seed)
+    end = end or date.today()
+    start = end.replace(year=end.year - years) + timedelta(days=1)
+    db_path = db_path or get_db_path()
+    started = time.perf_counter()
+
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        conn.execute("PRAGMA locking_mode = EXCLUSIVE")
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute("PRAGMA cache_size = -262144")
+        conn.execute("PRAGMA temp_store = MEMORY")
+
+        conn.execute("BEGIN")
+        recreate = _drop_derived(conn, ('products', 'sales_history'))
+        # トリガーがないので全件削除は高速（truncate）
+        conn.execute("DELETE FROM sales_history")
+        conn.execute("DELETE FROM products")
+        conn.execute("DELETE FROM sqlite_sequence WHERE name IN ('products', 'sales_history')")
+        # アーカイブへ移した売上も置き換える（ファイルはコミット後に削除する）
+        archived = archive.partitions(conn)
+        if archived:
+            conn.execute("DELETE FROM sales_partitions")
+
+        catalog = generate_catalog(rng, products_count)
+        _insert(conn, "INSERT INTO products (id, sku, name, price, quantity) VALUES (?, ?, ?, ?, ?)",
+                ((product_id, sku, name, price, quantity)
+                 for product_id, (sku, name, price, quantity, _, _) in enumerate(catalog, 1)))
+        loaded = time.perf_counter()
+        sales_total = _insert(
+            conn,
+            "INSERT INTO sales_history (product_id, quantity, unit_price, total_amount, created_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            generate_sales(rng, catalog, sales_count, start, end), progress, sales_count)
+        load_seconds = time.perf_counter() - loaded
+
+        for sql in recreate:
+            conn.execute(sql)
+        cursor = conn.cursor()
+        rollups.backfill(cursor)
+        # 発注点は最終日までの販売速度で決める
+        reorder.refresh(cursor, end)
+        stats.rebuild_stats(cursor)
+        if products.has_fts(cursor):
+            cursor.execute("INSERT INTO products_fts (products_fts) VALUES ('rebuild')")
+        conn.execute("COMMIT")
+        conn.execute("ANALYZE")
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.close()
+    for _, path, _ in archived:
+        if os.path.exists(path):
+            os.remove(path)
+    bump_data_version()
+
+    result = {
+        'products': len(catalog),
+        'sales': sales_total,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'seconds': round(time.perf_counter() - started, 1),
+        'sales_rows_per_sec': round(sales_total / load_seconds) if load_seconds else None,
+    }
+    logger.info("合成データを生成しました", extra=result)
+    return result
@@ -0,0 +1,211 @@
+"""SQLite接続レイヤー
+
+ワーカープロセス・スレッドごとに接続を1本だけ保持し、リクエストのたびに
+sqlite3.connect しないようにする。接続時にWALモードと各種PRAGMAを設定する。
+
+また、書き込みをコミットするたびに増えるデータバージョンを
+データベースと同じ場所のファイル（<db>-version）に保持する。
+全ワーカーがこのファイルをmmapして共有するため、データベースに問い合わせずに
+「前回から変更があったか」を判定できる。
+"""
+import mmap
+import os
+import secrets
+import sqlite3
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+import config
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows（ワーカー間の排他なし）
+    fcntl = None
+
+_local = threading.local()
+
+# データバージョンファイルの形式: エポック（ファイル作成時の乱数）、バージョン、最終更新時刻（ナノ秒）
+_VERSION_FORMAT = '<QQQ'
+_VERSION_SIZE = struct.calcsize(_VERSION_FORMAT)
+_version_lock = threading.Lock()
+_version_files = {}
+
+
+def get_db_path():
+    """データベースファイルのパス（アプリケーションの設定 DATABASE_PATH）"""
+    return config.get('DATABASE_PATH')
+
+
+def connect(db_path=None):
+    """PRAGMAを設定済みの新しい接続を作成する（PRAGMAの値は設定の DB_* で変更できる）"""
+    busy_timeout_ms = config.get('DB_BUSY_TIMEOUT_MS')
+    sql_timing = config.get('METRICS') and config.get('METRICS_SQL')
+    conn = sqlite3.connect(
+        db_path or get_db_path(),
+        timeout=busy_timeout_ms / 1000,
+        isolation_level=None,  # トランザクションは transaction() で明示的に開始する
+        uri=True,  # 売上履歴のアーカイブを読み取り専用（file:...?mode=ro）でアタッチするため（archive.py）
+        check_same_thread=False,
+        cached_statements=config.get('DB_STATEMENT_CACHE_SIZE'),
+        factory=metrics.TimedConnection if sql_timing else sqlite3.Connection,
+    )
+    conn.execute(f"PRAGMA busy_timeout = {busy_timeout_ms}")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute(f"PRAGMA synchronous = {config.get('DB_SYNCHRONOUS')}")
+    conn.execute(f"PRAGMA cache_size = -{config.get('DB_CACHE_SIZE_KB')}")
+    conn.execute(f"PRAGMA mmap_size = {config.get('DB_MMAP_SIZE')}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    return conn
+
+
+def get_db():
+    """現在のスレッド用の接続を返す
+
+    gunicornのfork後に親プロセスの接続を使い回さないよう、PIDが変わったら作り直す。
+    """
+    pid = os.getpid()
+    db_path = get_db_path()
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.pid == pid and _local.db_path == db_path:
+        return conn
+    if conn is not None and _local.pid == pid:
+        conn.close()
+    conn = connect(db_path)
+    _local.conn = conn
+    _local.pid = pid
+    _local.db_path = db_path
+    return conn
+
+
+def release_db(exception=None):
+    """リクエスト終了時の後始末（プール無効時（DB_POOL=0）のみ接続を閉じる）"""
+    if config.get('DB_POOL'):
+        return
+    close_db()
+
+
+def close_db():
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.pid == os.getpid():
+        conn.close()
+    _local.conn = None
+
+
+@contextmanager
+def transaction(conn=None, immediate=False):
+    """BEGIN〜COMMITを囲むコンテキストマネージャ（例外時はROLLBACK）
+
+    immediate=True の場合は BEGIN IMMEDIATE で最初から書き込みロックを取得する。
+    まだ何も実行していないので、ロックを取れなかった場合は DB_LOCK_RETRIES 回までやり直す。
+    """
+    conn = conn or get_db()
+    if immediate:
+        _begin_immediate(conn)
+    else:
+        conn.execute("BEGIN")
+    changes = conn.total_changes
+    try:
+        yield conn
+    except BaseException as e:
+        conn.rollback()
+        if _is_locked(e):
+            metrics.lock_errors.inc()
+        raise
+    else:
+        conn.commit()
+        # コミット後に上げる（先に上げると古いデータが新しいバージョンで返される）
+        if conn.total_changes != changes:
+            bump_data_version()
+
+
+def _is_locked(error):
+    return isinstance(error, sqlite3.OperationalError) and 'locked' in str(error)
+
+
+def _begin_immediate(conn):
+    started = time.perf_counter()
+    retries = config.get('DB_LOCK_RETRIES')
+    for attempt in range(retries + 1):
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            break
+        except sqlite3.OperationalError as e:
+            if not _is_locked(e) or attempt == retries:
+                if _is_locked(e):
+                    metrics.lock_errors.inc()
+                raise
+            metrics.lock_retries.inc()
+    metrics.lock_wait.observe(time.perf_counter() - started)
+
+
+def _version_file():
+    """(mmap, ファイルディスクリプタ) をプロセスごとに1つ開く"""
+    path = get_db_path() + '-version'
+    key = (os.getpid(), path)
+    opened = _version_files.get(key)
+    if opened is not None:
+        return opened
+    with _version_lock:
+        opened = _version_files.get(key)
+        if opened is None:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            _lock_file(fd)
+            try:
+                if os.fstat(fd).st_size < _VERSION_SIZE:
+                    os.ftruncate(fd, _VERSION_SIZE)
+                    os.pwrite(fd, struct.pack(_VERSION_FORMAT, secrets.randbits(63), 0, time.time_ns()), 0)
+            finally:
+                _unlock_file(fd)
+            opened = (mmap.mmap(fd, _VERSION_SIZE), fd)
+            _version_files[key] = opened
+    return opened
+
+
+@contextmanager
+def file_lock(path, blocking=True):
+    """ファイルロックで全プロセスを通して排他する（blocking=False でほかが保持中なら BlockingIOError）"""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        _lock_file(fd, blocking)
+        try:
+            yield
+        finally:
+            _unlock_file(fd)
+    finally:
+        os.close(fd)
+
+
+def _lock_file(fd, blocking=True):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+
+def _unlock_file(fd):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+def data_version():
+    """(エポック, バージョン, 最終更新時刻[秒]) を返す（データベースにはアクセスしない）
+
+    エポックはバージョンファイル作成時に決まる乱数で、データベースを作り直して
+    バージョンが0から数え直しになっても以前の値と区別できるようにする。
+    """
+    mapped, _ = _version_file()
+    epoch, version, modified_ns = struct.unpack_from(_VERSION_FORMAT, mapped, 0)
+    return epoch, version, modified_ns / 1e9
+
+
+def bump_data_version():
+    """データバージョンを1つ上げる（全ワーカー共通）"""
+    mapped, fd = _version_file()
+    with _version_lock:
+        _lock_file(fd)
+        try:
+            epoch, version, _ = struct.unpack_from(_VERSION_FORMAT, mapped, 0)
+            struct.pack_into(_VERSION_FORMAT, mapped, 0, epoch, version + 1, time.time_ns())
+        finally:
+            _unlock_file(fd)
@@ -0,0 +1,170 @@
+"""Server-Sent Events（/api/events）の配信
+
+書き込み処理は publish() でイベントをプロセス内の全購読者のキューに入れる。
+キューは上限付きで put_nowait するだけなので、購読者が詰まっても書き込み側は
+待たされない。溢れた購読者には resync を送り、画面側で再取得させる。
+
+他のワーカーでの書き込みは届かないため、各ストリームは共有データバージョンを
+定期的に確認し、変わっていれば最新のKPIを送る。
+"""
+import json
+import queue
+import threading
+import time
+
+import config
+from db import close_db, data_version, get_db
+import catalog
+import stats
+
+
+class Subscriber:
+    def __init__(self, queue_size):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.overflowed = False
+
+
+class Broadcaster:
+    """プロセス内の購読者へイベントを配る（購読者数（SSE_MAX_SUBSCRIBERS）・キュー長（SSE_QUEUE_SIZE）とも上限付き）"""
+
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        """購読者を登録する。上限に達している場合は None"""
+        max_subscribers, queue_size = config.get('SSE_MAX_SUBSCRIBERS'), config.get('SSE_QUEUE_SIZE')
+        with self._lock:
+            if len(self._subscribers) >= max_subscribers:
+                return None
+            subscriber = Subscriber(queue_size)
+            self._subscribers.add(subscriber)
+            return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def publish(self, event, data):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        message = (event, data)
+        for subscriber in subscribers:
+            try:
+                subscriber.queue.put_nowait(message)
+            except queue.Full:
+                subscriber.overflowed = True
+
+
+broadcaster = Broadcaster()
+
+# 他ワーカーでの変更を検知したときのKPI（プロセス内の全ストリームで共有）
+_kpi_lock = threading.Lock()
+_kpi_snapshot = (None, None)
+
+
+def format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _version_key():
+    epoch, version, _ = data_version()
+    return epoch, version
+
+
+def current_kpis():
+    """最新のKPI（データバージョンごとに1回だけDBを読む）"""
+    global _kpi_snapshot
+    key = _version_key()
+    with _kpi_lock:
+        if _kpi_snapshot[0] != key:
+            kpis = stats.read_stats(get_db().cursor()) or {}
+            _kpi_snapshot = (key, dict(kpis, version=key[1]))
+        return _kpi_snapshot[1]
+
+
+def publish_kpis():
+    """書き込みのコミット後に呼び、最新のKPIを配信する"""
+    if broadcaster.subscriber_count():
+        broadcaster.publish('kpi', current_kpis())
+
+
+def publish_stock_change(cursor, product_id, delta):
+    """在庫が delta 変化した商品について、在庫僅少の境界をまたいだら通知する"""
+    if not broadcaster.subscriber_count():
+        return
+    product = catalog.get_product(cursor, product_id)
+    if product is None:
+        return
+    name, quantity, reorder_point = product['name'], product['quantity'], product['reorder_point']
+    was_low = quantity - delta < reorder_point
+    is_low = quantity < reorder_point
+    if was_low != is_low:
+        broadcaster.publish('low_stock', {'product_id': product_id, 'name': name, 'quantity': quantity, 'low': is_low})
+
+
+def publish_sale(cursor, product_id, quantity, total):
+    if not broadcaster.subscriber_count():
+        return
+    product = catalog.get_product(cursor, product_id)
+    broadcaster.publish('sale', {
+        'product_id': product_id,
+        'product_name': product['name'] if product else None,
+        'quantity': quantity,
+        'total': total
+    })
+
+
+def _stream_kpis():
+    # 接続中はデータベースの接続を持ち続けない（gevent ワーカーではストリームごとに別の接続になる）
+    kpis = current_kpis()
+    close_db()
+    return kpis
+
+
+def stream(subscriber):
+    """1購読者分のイベントストリーム（レスポンスのジェネレーター。stream_with_context で包んで返す）"""
+    poll_interval, heartbeat_interval = config.get('SSE_POLL_INTERVAL'), config.get('SSE_HEARTBEAT_INTERVAL')
+    try:
+        yield "retry: 3000\n\n"
+        kpis = _stream_kpis()
+        last_version = kpis.get('version')
+        yield format_event('kpi', kpis)
+        last_sent = time.monotonic()
+        while True:
+            try:
+                event, data = subscriber.queue.get(timeout=poll_interval)
+            except queue.Empty:
+                event = None
+
+            if subscriber.overflowed:
+                # 取りこぼしがあるので画面側で全体を取り直してもらう
+                subscriber.overflowed = False
+                while not subscriber.queue.empty():
+                    subscriber.queue.get_nowait()
+                yield format_event('resync', {})
+                last_sent = time.monotonic()
+                continue
+
+            if event is not None:
+                if event == 'kpi':
+                    last_version = max(last_version or 0, data.get('version') or 0)
+                yield format_event(event, data)
+                last_sent = time.monotonic()
+                continue
+
+            # 他ワーカーでの書き込み
+            _, version = _version_key()
+            if version != last_version:
+                kpis = _stream_kpis()
+                last_version = kpis.get('version')
+                yield format_event('kpi', kpis)
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent >= heartbeat_interval:
+                yield ": ping\n\n"
+                last_sent = time.monotonic()
+    finally:
+        broadcaster.unsubscribe(subscriber)
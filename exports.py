@@ -0,0 +1,66 @@
+"""CSVエクスポート
+
+行をまとめて読み出しながらCSVを逐次生成する。件数にかかわらずメモリ使用量は
+FETCH_SIZE 行分で一定になる。列構成は画面のエクスポート（app.js）と同じ。
+"""
+import csv
+import io
+import zlib
+
+from db import connect
+import sales
+
+FETCH_SIZE = 1000
+
+SALES_HEADER = ['日付', '商品名', '数量', '単価', '売上']
+PRODUCTS_HEADER = ['SKU', '商品名', '価格', '在庫数']
+
+
+def _iter_csv(header, execute):
+    """専用接続で execute(cursor) の結果をCSV文字列のチャンクとして返す
+
+    ストリーミング中はリクエストの接続を使わず、終了時（中断時も）に閉じる。
+    """
+    conn = connect()
+    try:
+        cursor = execute(conn.cursor())
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        writer.writerow(header)
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            writer.writerows(rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+    finally:
+        conn.close()
+
+
+def iter_sales_csv(start=None, end=None):
+    return _iter_csv(SALES_HEADER, lambda cursor: sales.history_rows(cursor, start, end))
+
+
+def iter_products_csv():
+    def execute(cursor):
+        cursor.execute("SELECT sku, name, price, quantity FROM products ORDER BY name")
+        return cursor
+    return _iter_csv(PRODUCTS_HEADER, execute)
+
+
+def encode(chunks, compress=False):
+    """文字列チャンクをUTF-8にし、必要ならgzip形式で逐次圧縮する"""
+    if not compress:
+        for chunk in chunks:
+            yield chunk.encode('utf-8')
+        return
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: gzipヘッダー付き
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
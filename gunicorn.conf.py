@@ -0,0 +1,33 @@
+# gunicorn設定
+#
+# /api/events（Server-Sent Events）は接続したまま待つので、既定で gevent ワーカーを使う。
+# 待機中の接続はコルーチン1つ分のメモリしか使わず、ワーカーごとに GUNICORN_WORKER_CONNECTIONS
+# （既定2000）の接続を保持でき、SSEにはその9割（SSE_MAX_SUBSCRIBERS）まで使う。
+# GUNICORN_WORKER_CLASS=gthread ではスレッドワーカーになり、SSEの接続数はスレッド数の半分に抑える。
+import os
+
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent')
+if worker_class == 'gevent':
+    # preload でアプリを読み込む前にパッチする（モジュールの読み込み時に作るロック・スレッドローカル・
+    # キューも gevent 用になり、SSEの待機がワーカー全体を止めない）
+    from gevent import monkey
+    monkey.patch_all()
+
+# gthread: ワーカーあたりのスレッド数（= 同時に保持できる接続数）
+threads = int(os.environ.get('GUNICORN_THREADS', 64))
+# gevent: ワーカーあたりの最大同時接続数
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 2000))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+# アプリケーションの読み込みとデータベースの初期化をマスタープロセスで1回だけ行い、
+# ワーカーはfork後すぐにリクエストを受け付ける（GUNICORN_PRELOAD=0 で無効）。
+# 定期処理のスレッドはマスターでは起動せず、各ワーカーの最初のリクエストで起動する（app.start_schedulers）
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') != '0'
+
+
+def pre_fork(server, worker):
+    # マスタープロセスが初期化に使った接続をワーカーに引き継がない
+    import db
+    db.close_db()
@@ -0,0 +1,140 @@
+"""在庫の一括更新
+
+複数商品の入庫・出庫と在庫数の設定をまとめて1トランザクションで適用する。
+出庫で在庫が不足する行が1つでもあれば何も適用しない（全件成功か全件失敗）。
+在庫数の設定（quantity）はトランザクション内で読んだ現在の在庫から増減を求めるので、
+画面に表示していた古い在庫数で上書きしない。
+"""
+from db import transaction
+
+MAX_BATCH_LINES = 10000
+# SQLiteのバインド変数上限を超えないよう IN 句を分割する
+IN_CHUNK_SIZE = 500
+
+
+def reserve_stock(conn, product_id, quantity):
+    """在庫が足りる場合だけ1文で減算する（トランザクション内で呼ぶこと）
+
+    判定と減算を同じUPDATE文で行うため、複数ワーカーが同時に出庫しても
+    在庫がマイナスにならない。戻り値はエラーメッセージ（成功時はNone）。
+    """
+    cursor = conn.execute("UPDATE products SET quantity = quantity - ? WHERE id = ? AND quantity >= ?",
+                          (quantity, product_id, quantity))
+    if cursor.rowcount == 1:
+        return None
+    if conn.execute("SELECT 1 FROM products WHERE id = ?", (product_id,)).fetchone() is None:
+        return '商品が見つかりません'
+    return '在庫が不足しています'
+
+
+def receive_stock(conn, product_id, quantity):
+    """入庫（トランザクション内で呼ぶこと）。戻り値はエラーメッセージ（成功時はNone）"""
+    conn.execute("UPDATE products SET quantity = quantity + ? WHERE id = ?", (quantity, product_id))
+    return None
+
+
+def _parse_line(line):
+    """1行分の入力を検証して (product_id, sku, delta, quantity) を返す。不正ならエラーメッセージ
+
+    delta（増減）か quantity（設定する在庫数）のどちらか一方を指定する。
+    """
+    if not isinstance(line, dict):
+        return None, '行の形式が不正です'
+    product_id = line.get('product_id')
+    sku = line.get('sku')
+    if product_id in (None, '') and not sku:
+        return None, 'product_id または sku を指定してください'
+    if (line.get('delta') is None) == (line.get('quantity') is None):
+        return None, 'delta と quantity のどちらか一方を指定してください'
+    delta = quantity = None
+    try:
+        if line.get('delta') is not None:
+            delta = int(line.get('delta'))
+        else:
+            quantity = int(line.get('quantity'))
+        if product_id not in (None, ''):
+            product_id = int(product_id)
+    except (ValueError, TypeError):
+        return None, 'product_id と delta・quantity は数値で指定してください'
+    if delta == 0:
+        return None, 'delta に0は指定できません'
+    if quantity is not None and quantity < 0:
+        return None, 'quantity は0以上で指定してください'
+    return (product_id if product_id not in (None, '') else None,
+            str(sku).strip() if sku else None, delta, quantity), None
+
+
+def _lookup(cursor, column, values):
+    found = {}
+    values = list(values)
+    for i in range(0, len(values), IN_CHUNK_SIZE):
+        chunk = values[i:i + IN_CHUNK_SIZE]
+        placeholders = ', '.join('?' * len(chunk))
+        cursor.execute(f"SELECT id, sku, quantity FROM products WHERE {column} IN ({placeholders})", chunk)
+        for row_id, sku, quantity in cursor.fetchall():
+            found[row_id if column == 'id' else sku] = (row_id, sku, quantity or 0)
+    return found
+
+
+def apply_batch(conn, lines):
+    """在庫増減（delta: 正=入庫、負=出庫）と在庫数の設定（quantity）をまとめて適用する
+
+    同じ商品の行は順番に適用する（設定の行はその時点の在庫との差を増減とする）。
+    戻り値は (成功したか, 行ごとの結果のリスト)。
+    """
+    results = []
+    parsed = []
+    for index, line in enumerate(lines):
+        value, error = _parse_line(line)
+        results.append({'line': index, 'status': 'error', 'message': error} if error else {'line': index})
+        parsed.append(value)
+
+    with transaction(conn, immediate=True):
+        cursor = conn.cursor()
+        by_id = _lookup(cursor, 'id', {p[0] for p in parsed if p and p[0] is not None})
+        by_sku = _lookup(cursor, 'sku', {p[1] for p in parsed if p and p[0] is None})
+
+        # 商品ごとに行を順番に適用した後の在庫を求めて在庫不足を判定する
+        current = {product[0]: product[2] for product in list(by_id.values()) + list(by_sku.values())}
+        after = dict(current)
+        for result, value in zip(results, parsed):
+            if value is None:
+                continue
+            product_id, sku, delta, quantity = value
+            product = by_id.get(product_id) if product_id is not None else by_sku.get(sku)
+            if product is None:
+                result.update(status='error', message='商品が見つかりません')
+                continue
+            if quantity is not None:
+                delta = quantity - after[product[0]]
+            result.update(product_id=product[0], sku=product[1], delta=delta)
+            after[product[0]] += delta
+
+        for result in results:
+            if 'product_id' not in result:
+                continue
+            quantity = after[result['product_id']]
+            if quantity < 0 and result['delta'] < 0:
+                result.update(status='error', message='在庫が不足しています')
+            else:
+                result.update(status='ok', quantity=quantity)
+
+        if any(result['status'] == 'error' for result in results):
+            for result in results:
+                if result['status'] == 'ok':
+                    result.update(status='skipped', message='他の行にエラーがあるため適用されませんでした')
+                    result.pop('quantity', None)
+            # まだ何も書き込んでいないのでそのまま終了する
+            return False, results
+
+        cursor.executemany("UPDATE products SET quantity = quantity + ? WHERE id = ?",
+                           [(after[product_id] - quantity, product_id) for product_id, quantity in current.items()
+                            if after[product_id] != quantity])
+    return True, results
+
+
+def set_all(conn, quantity):
+    """すべての商品の在庫数を quantity にする（1文で更新する）。戻り値は変更した商品数"""
+    with transaction(conn, immediate=True):
+        cursor = conn.execute("UPDATE products SET quantity = ? WHERE quantity IS NOT ?", (quantity, quantity))
+    return cursor.rowcount
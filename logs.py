@@ -0,0 +1,175 @@
+"""構造化ログ（JSON）の設定
+
+ログはキュー経由で専用スレッド（QueueListener）が標準出力に書き込むため、
+リクエスト処理中のスレッドが出力のI/Oで待たされない。
+
+- 1レコード1行のJSON（LOG_FORMAT=text で従来に近いテキスト形式）
+- extra に渡した項目はそのままJSONの項目になる（パスワード等は伏せ字にする）
+- リクエストごとの相関ID（X-Request-ID）を request_id として付ける
+- extra={'sampled': True} のレコードは LOG_SAMPLE_RATE の割合だけ出力する
+
+設定（LOG_*）は create_app から setup() に渡す。ロガーはプロセス全体で共有するので、最初に設定したものが使われる。
+"""
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+import metrics
+
+# 値を伏せ字にする項目名（小文字で部分一致）
+REDACTED_KEYS = ('password', 'passwd', 'secret', 'token', 'authorization', 'cookie', 'session')
+REDACTED = '[REDACTED]'
+
+# LogRecordの標準属性（これ以外の属性を extra の項目として出力する）
+_RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'sampled', 'request_id'}
+
+request_id_var = contextvars.ContextVar('request_id', default=None)
+
+dropped_records = metrics.Counter('log_records_dropped_total', 'ログキューが満杯で破棄したレコード数')
+
+_handler = None
+_listener = None
+
+
+def redact(value):
+    """dict / list を再帰的にたどり、資格情報らしい項目の値を伏せ字にする"""
+    if isinstance(value, dict):
+        return {k: REDACTED if _is_secret(k) else redact(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(v) for v in value]
+    return value
+
+
+def _is_secret(key):
+    key = str(key).lower()
+    return any(word in key for word in REDACTED_KEYS)
+
+
+class ContextFilter(logging.Filter):
+    """相関IDの付与とサンプリング（呼び出したスレッドで実行される）"""
+
+    def __init__(self, sample_rate):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record):
+        if getattr(record, 'sampled', False) and random.random() >= self.sample_rate:
+            return False
+        record.request_id = request_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if getattr(record, 'request_id', None):
+            entry['request_id'] = record.request_id
+        for key, value in vars(record).items():
+            if key not in _RESERVED and not key.startswith('_'):
+                entry[key] = REDACTED if _is_secret(key) else redact(value)
+        if record.exc_text or record.exc_info:
+            entry['exception'] = record.exc_text or self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    def format(self, record):
+        text = super().format(record)
+        fields = {k: v for k, v in vars(record).items() if k not in _RESERVED and not k.startswith('_')}
+        if getattr(record, 'request_id', None):
+            fields['request_id'] = record.request_id
+        if fields:
+            text += ' ' + json.dumps(redact(fields), ensure_ascii=False, default=str)
+        return text
+
+
+class _QueueHandler(QueueHandler):
+    def prepare(self, record):
+        # 整形は出力スレッドで行う。例外のトレースバックだけはここで文字列にする
+        if record.exc_info:
+            record = copy.copy(record)
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped_records.inc()
+
+
+class _DirectHandler(logging.Handler):
+    """LOG_ASYNC=0 用: 呼び出したスレッドで出力ハンドラーに渡す"""
+
+    def __init__(self, output):
+        super().__init__()
+        self.output = output
+
+    def emit(self, record):
+        self.output.handle(record)
+
+
+def _threads_patched():
+    """gevent で threading をパッチ済みか（出力スレッドもコルーチンになるので、キューを使わず直接出力する）"""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('threading')
+
+
+def setup(settings):
+    """ルートロガーを設定する（何度呼んでも1回だけ設定する）。settings は app.config（LOG_*）"""
+    global _handler, _listener
+    root = logging.getLogger()
+    if any(isinstance(h, (_QueueHandler, _DirectHandler)) for h in root.handlers):
+        return
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if settings['LOG_FORMAT'] == 'json' else TextFormatter())
+
+    if settings['LOG_ASYNC'] and not _threads_patched():
+        handler = _QueueHandler(queue.Queue(maxsize=settings['LOG_QUEUE_SIZE']))
+        _listener = QueueListener(handler.queue, output, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_stop_listener)
+        # gunicornのfork後はリスナースレッドが子プロセスに引き継がれないので起動し直す
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=_restart_listener)
+    else:
+        handler = _DirectHandler(output)
+    handler.addFilter(ContextFilter(settings['LOG_SAMPLE_RATE']))
+    _handler = handler
+
+    root.addHandler(handler)
+    root.setLevel(settings['LOG_LEVEL'])
+
+
+def _stop_listener():
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
+
+
+def _restart_listener():
+    if _listener is not None:
+        # fork時点でキューのロックが保持されている可能性があるので、キューごと作り直す
+        _handler.queue = _listener.queue = queue.Queue(maxsize=_handler.queue.maxsize)
+        _listener._thread = None
+        _listener.start()
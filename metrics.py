@@ -0,0 +1,244 @@
+"""リクエスト・SQLの計測とPrometheus形式での出力（/metrics）
+
+値はワーカープロセスごとに保持する（gunicornで複数ワーカーを使う場合、
+/metrics はリクエストを受けたワーカーの値を返す）。
+
+- エンドポイントごとの処理時間（ヒストグラム）と、そのうちSQLに費やした時間
+- SQL文ごとの実行時間（execute / executemany）と結果の読み出し時間
+- 書き込みロックの待ち時間とロック取得のリトライ回数
+
+計測の有無とトークンは設定の METRICS / METRICS_SQL / METRICS_TOKEN で切り替える（config.py）。
+"""
+import bisect
+import sqlite3
+import threading
+import time
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+# ラベルに使うSQL文の最大種類数と最大長（超えた分は other にまとめる）
+MAX_STATEMENTS = 200
+MAX_STATEMENT_LENGTH = 160
+
+_registry = []
+
+
+class _RequestState(threading.local):
+    started = None  # 計測中のリクエストの開始時刻
+    sql_seconds = 0.0
+
+
+_local = _RequestState()
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{escaped}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            yield f"{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}"
+
+
+class Gauge:
+    """出力時に関数を呼んで値を得るゲージ"""
+
+    def __init__(self, name, help_text, function):
+        self.name = name
+        self.help_text = help_text
+        self.function = function
+        _registry.append(self)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} gauge"
+        yield f"{self.name} {_format_value(self.function())}"
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}  # ラベル -> [バケットごとの件数..., 合計, 件数]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, labels=()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = sorted((labels, list(series)) for labels, series in self._series.items())
+        names = self.labels + ('le',)
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels(names, labels + (bound,))} {cumulative}"
+            yield f"{self.name}_bucket{_format_labels(names, labels + ('+Inf',))} {series[-1]}"
+            yield f"{self.name}_sum{_format_labels(self.labels, labels)} {_format_value(series[-2])}"
+            yield f"{self.name}_count{_format_labels(self.labels, labels)} {series[-1]}"
+
+
+request_duration = Histogram(
+    'http_request_duration_seconds', 'リクエストの処理時間', ('method', 'endpoint'))
+request_sql_duration = Histogram(
+    'http_request_sql_seconds', '1リクエスト内でSQLに費やした時間', ('method', 'endpoint'))
+requests_total = Counter(
+    'http_requests_total', 'リクエスト数', ('method', 'endpoint', 'status'))
+sql_duration = Histogram(
+    'sqlite_statement_duration_seconds', 'SQL文の実行時間（execute / executemany）', ('statement',), SQL_BUCKETS)
+sql_fetch_seconds = Counter(
+    'sqlite_fetch_seconds_total', 'SQL文の結果の読み出しにかかった時間の合計', ('statement',))
+lock_wait = Histogram(
+    'sqlite_lock_wait_seconds', '書き込みロック（BEGIN IMMEDIATE）の取得待ち時間', (), SQL_BUCKETS)
+lock_retries = Counter('sqlite_lock_retries_total', '書き込みロック取得のリトライ回数')
+lock_errors = Counter('sqlite_lock_errors_total', 'database is locked で失敗したトランザクション数')
+
+
+def render():
+    """Prometheusのテキスト形式で全メトリクスを返す"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# リクエスト単位の計測
+
+def start_request():
+    _local.started = time.perf_counter()
+    _local.sql_seconds = 0.0
+
+
+def finish_request(method, endpoint, status, sql_timing=False):
+    """リクエストの処理時間を記録する（sql_timing が真ならそのうちSQLに費やした時間も）"""
+    started = _local.started
+    if started is None:
+        return
+    _local.started = None
+    labels = (method, endpoint)
+    request_duration.observe(time.perf_counter() - started, labels)
+    if sql_timing:
+        request_sql_duration.observe(_local.sql_seconds, labels)
+    requests_total.inc((method, endpoint, str(status)))
+
+
+# SQL文ごとの計測
+
+_statement_keys = {}
+
+
+def _statement_key(sql):
+    key = _statement_keys.get(sql)
+    if key is None:
+        key = ' '.join(sql.split())
+        if len(key) > MAX_STATEMENT_LENGTH:
+            key = key[:MAX_STATEMENT_LENGTH] + '...'
+        if len(_statement_keys) >= MAX_STATEMENTS:
+            return 'other'
+        _statement_keys[sql] = key
+    return key
+
+
+def _record_sql(key, elapsed, fetch=False):
+    if fetch:
+        sql_fetch_seconds.inc((key,), elapsed)
+    else:
+        sql_duration.observe(elapsed, (key,))
+    if _local.started is not None:
+        _local.sql_seconds += elapsed
+
+
+class TimedCursor(sqlite3.Cursor):
+    """execute と結果の読み出しにかかった時間をSQL文ごとに記録するカーソル"""
+    _statement = 'other'
+
+    def execute(self, sql, parameters=()):
+        self._statement = _statement_key(sql)
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record_sql(self._statement, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._statement = _statement_key(sql)
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _record_sql(self._statement, time.perf_counter() - started)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            _record_sql(self._statement, time.perf_counter() - started, fetch=True)
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(self.arraysize if size is None else size)
+        finally:
+            _record_sql(self._statement, time.perf_counter() - started, fetch=True)
+
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            _record_sql(self._statement, time.perf_counter() - started, fetch=True)
+
+
+class TimedConnection(sqlite3.Connection):
+    """カーソルを TimedCursor にする接続（sqlite3.connect の factory に指定する）"""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
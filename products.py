@@ -0,0 +1,218 @@
+"""商品データの検証・検索と一括取り込み"""
+import base64
+import csv
+import io
+import json
+import time
+
+import responses
+from db import transaction
+
+IMPORT_CHUNK_SIZE = 1000
+# レポートに含める不合格行の最大件数（件数自体はすべて数える）
+MAX_REPORTED_REJECTS = 1000
+IMPORT_FORMATS = ('csv', 'jsonl')
+
+# CSVの見出し（エクスポートの日本語見出しも受け付ける）
+CSV_HEADER_ALIASES = {
+    'sku': 'sku',
+    'name': 'name',
+    'price': 'price',
+    'quantity': 'quantity',
+    'SKU': 'sku',
+    '商品名': 'name',
+    '価格': 'price',
+    '在庫数': 'quantity',
+}
+
+PRODUCT_COLUMNS = ('id', 'sku', 'name', 'price', 'quantity', 'reorder_point')
+SEARCH_FIELDS = ('all', 'name', 'sku', 'price')
+SORT_COLUMNS = ('name', 'sku', 'price', 'quantity')
+DEFAULT_SEARCH_LIMIT = 100
+MAX_SEARCH_LIMIT = 1000
+# trigramトークナイザーは3文字以上でないと索引を使えない
+MIN_FTS_QUERY_LENGTH = 3
+
+UPSERT_SQL = """
+    INSERT INTO products (sku, name, price, quantity) VALUES (?, ?, ?, ?)
+    ON CONFLICT (sku) DO UPDATE SET
+        name = excluded.name,
+        price = excluded.price,
+        quantity = excluded.quantity
+"""
+
+
+def has_fts(cursor):
+    cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'products_fts'")
+    return cursor.fetchone()[0] > 0
+
+
+def encode_cursor(value, row_id):
+    return base64.urlsafe_b64encode(json.dumps([value, row_id], ensure_ascii=False).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(token):
+    try:
+        value, row_id = json.loads(base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8'))
+        return value, int(row_id)
+    except (ValueError, TypeError, UnicodeError):
+        raise ValueError('カーソルが不正です')
+
+
+def _match_expression(query, columns):
+    """FTS5のMATCH式（フレーズとして扱い、記号を演算子と解釈させない）"""
+    phrase = '"' + query.replace('"', '""') + '"'
+    return f"{{{' '.join(columns)}}} : {phrase}"
+
+
+def _search_conditions(cursor, query, field):
+    """検索語に対応するWHERE条件とパラメータ"""
+    text_columns = {'all': ['sku', 'name'], 'name': ['name'], 'sku': ['sku'], 'price': []}[field]
+    conditions, params = [], []
+    if text_columns:
+        if len(query) >= MIN_FTS_QUERY_LENGTH and has_fts(cursor):
+            conditions.append("p.id IN (SELECT rowid FROM products_fts WHERE products_fts MATCH ?)")
+            params.append(_match_expression(query, text_columns))
+        else:
+            pattern = '%' + query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            conditions.extend(f"p.{column} LIKE ? ESCAPE '\\'" for column in text_columns)
+            params.extend([pattern] * len(text_columns))
+    if field in ('all', 'price') and query.isdigit():
+        conditions.append("p.price = ?")
+        params.append(int(query))
+    if not conditions:
+        return "0", []
+    return "(" + " OR ".join(conditions) + ")", params
+
+
+def search(cursor, query=None, field='all', sort='name', order='asc', limit=None, after=None, columnar=False):
+    """商品を検索・並べ替えして返す
+
+    limit を指定するとキーセット方式でページングし、戻り値の next_cursor を
+    次の呼び出しの after に渡すと続きを取得できる。戻り値は (商品のリスト, next_cursor)。
+    columnar=True なら商品のリストの代わりに列形式（{'columns': ..., 'rows': ...}）で返す。
+    """
+    descending = order == 'desc'
+    conditions, params = [], []
+    if query:
+        condition, condition_params = _search_conditions(cursor, query, field)
+        conditions.append(condition)
+        params.extend(condition_params)
+    if after:
+        value, row_id = decode_cursor(after)
+        conditions.append(f"(p.{sort}, p.id) {'<' if descending else '>'} (?, ?)")
+        params.extend([value, row_id])
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    direction = 'DESC' if descending else 'ASC'
+    sql = f"""
+        SELECT p.id, p.sku, p.name, p.price, p.quantity, p.reorder_point
+        FROM products p
+        {where}
+        ORDER BY p.{sort} {direction}, p.id {direction}
+    """
+    if limit is not None:
+        limit = max(1, min(int(limit), MAX_SEARCH_LIMIT))
+        sql += " LIMIT ?"
+        params.append(limit + 1)
+    cursor.execute(sql, params)
+    rows = cursor.fetchall()
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][PRODUCT_COLUMNS.index(sort)], rows[-1][0])
+    if columnar:
+        return responses.columns(PRODUCT_COLUMNS, rows), next_cursor
+    return [dict(zip(PRODUCT_COLUMNS, row)) for row in rows], next_cursor
+
+
+def validate_product(data):
+    """商品登録の入力を検証する
+
+    戻り値は ((sku, name, price, quantity), None) または (None, エラーメッセージ)。
+    """
+    sku = str(data.get('sku') or '').strip()
+    name = str(data.get('name') or '').strip()
+    price = data.get('price')
+    quantity = data.get('quantity')
+
+    # 必須項目チェック
+    if not sku:
+        return None, 'SKUを入力してください'
+    if not name:
+        return None, '商品名を入力してください'
+    if price is None or price == '':
+        return None, '価格を入力してください'
+    if quantity is None or quantity == '':
+        return None, '数量を入力してください'
+
+    # 価格と数量の妥当性チェック
+    try:
+        price = int(price)
+        quantity = int(quantity)
+    except (ValueError, TypeError):
+        return None, '価格と数量は数値で入力してください'
+    if price <= 0:
+        return None, '価格は0より大きい値を入力してください'
+    if quantity < 0:
+        return None, '数量は0以上の値を入力してください'
+    return (sku, name, price, quantity), None
+
+
+def iter_rows(stream, fmt):
+    """バイナリストリームを1行ずつ読み、(行番号, dict または None, エラー) を返す"""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        for number, row in enumerate(reader, start=1):
+            yield number, {CSV_HEADER_ALIASES.get(k, k): v for k, v in row.items() if k is not None}, None
+    else:
+        for number, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                yield number, None, 'JSONとして解析できません'
+                continue
+            if not isinstance(row, dict):
+                yield number, None, 'JSONオブジェクトではありません'
+                continue
+            yield number, row, None
+
+
+def import_products(conn, rows, chunk_size=IMPORT_CHUNK_SIZE):
+    """iter_rows の出力を検証し、SKUで上書き登録（upsert）する
+
+    chunk_size 行ごとに1トランザクションで executemany する。不合格の行は
+    スキップしてレポートに記録し、ファイル全体は中断しない。
+    """
+    started = time.perf_counter()
+    report = {'processed': 0, 'imported': 0, 'rejected_count': 0, 'rejected': []}
+
+    def flush(chunk):
+        with transaction(conn, immediate=True):
+            conn.executemany(UPSERT_SQL, chunk)
+        report['imported'] += len(chunk)
+
+    chunk = []
+    for number, row, error in rows:
+        report['processed'] += 1
+        values = None
+        if error is None:
+            values, error = validate_product(row)
+        if error:
+            report['rejected_count'] += 1
+            if len(report['rejected']) < MAX_REPORTED_REJECTS:
+                report['rejected'].append({'row': number, 'sku': (row or {}).get('sku'), 'message': error})
+            continue
+        chunk.append(values)
+        if len(chunk) >= chunk_size:
+            flush(chunk)
+            chunk = []
+    if chunk:
+        flush(chunk)
+
+    elapsed = time.perf_counter() - started
+    report['elapsed_seconds'] = round(elapsed, 3)
+    report['rows_per_sec'] = round(report['processed'] / elapsed, 1) if elapsed > 0 else None
+    return report
@@ -0,0 +1,163 @@
+"""販売速度にもとづく発注点と在庫僅少の商品
+
+在庫が商品ごとの発注点（products.reorder_point）を下回った商品を在庫僅少とする。
+部分インデックス idx_products_low_stock（WHERE quantity < reorder_point）には在庫僅少の商品しか
+入らないので、商品が何万件あっても at_risk は在庫僅少の商品だけを読む。
+ダッシュボードの在庫僅少数（stats.py）も同じ条件でトリガーが更新する。
+
+発注点は定期ジョブ（refresh）が売上の日次ロールアップ（sales_daily）から計算し直す。
+
+- 販売速度 = 直近 REORDER_VELOCITY_DAYS 日の販売数量 / REORDER_VELOCITY_DAYS（1日あたり）
+- 発注点 = max(LOW_STOCK_THRESHOLD, 販売速度 × (REORDER_LEAD_TIME_DAYS + REORDER_SAFETY_DAYS) の切り上げ)
+- reorder_point_manual を設定した商品はその値を発注点にする
+
+sales_daily は商品×日で1行なので、集計する行数は売上履歴の件数によらず商品数×日数で頭打ちになる。
+在庫日数（在庫 / 販売速度）は在庫が変わるたびに変わるので、保存せず at_risk で現在の在庫から求める。
+"""
+import logging
+import threading
+import time
+from datetime import date, timedelta
+
+import config
+from db import file_lock, get_db, get_db_path, transaction
+from stats import LOW_STOCK_THRESHOLD
+
+logger = logging.getLogger(__name__)
+
+AT_RISK_LIMIT = 200
+MAX_AT_RISK_LIMIT = 1000
+
+AT_RISK_COLUMNS = ('id', 'sku', 'name', 'quantity', 'reorder_point', 'units_per_day', 'days_of_cover',
+                   'suggested_order')
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def _automatic_point():
+    """販売速度から求める発注点のSQL式（SQLの数学関数はビルドによってないため、切り上げは CAST で行う）"""
+    cover = f"units_per_day * {config.get('REORDER_LEAD_TIME_DAYS') + config.get('REORDER_SAFETY_DAYS')}"
+    return f"MAX({LOW_STOCK_THRESHOLD}, CAST({cover} AS INTEGER) + ({cover} > CAST({cover} AS INTEGER)))"
+
+
+def refresh(cursor, as_of=None):
+    """販売速度と自動の発注点を計算し直し、件数を返す（トランザクション内で呼ぶこと）
+
+    as_of（既定は今日）までの REORDER_VELOCITY_DAYS 日を集計する。発注点は変わった商品だけ更新するので、
+    在庫僅少数のトリガーが動くのもその商品だけになる。
+    """
+    as_of = as_of or date.today()
+    days = config.get('REORDER_VELOCITY_DAYS')
+    window = {'since': (as_of - timedelta(days=days - 1)).isoformat(), 'until': as_of.isoformat(), 'days': days}
+    cursor.execute("DELETE FROM product_velocity")
+    cursor.execute("""
+        INSERT INTO product_velocity (product_id, units_per_day)
+        SELECT p.id, COALESCE(d.units, 0) * 1.0 / :days
+        FROM products p
+        LEFT JOIN (
+            SELECT product_id, SUM(quantity) AS units
+            FROM sales_daily
+            WHERE day BETWEEN :since AND :until
+            GROUP BY product_id
+        ) d ON d.product_id = p.id
+    """, window)
+    products_count = cursor.rowcount
+    cursor.execute(f"""
+        UPDATE products SET reorder_point = computed.point
+        FROM (
+            SELECT p.id, COALESCE(p.reorder_point_manual, {_automatic_point()}) AS point
+            FROM products p JOIN product_velocity v ON v.product_id = p.id
+        ) computed
+        WHERE products.id = computed.id AND products.reorder_point != computed.point
+    """)
+    return {'products': products_count, 'changed': cursor.rowcount, 'since': window['since'],
+            'until': window['until']}
+
+
+def set_manual_point(cursor, product_id, point):
+    """商品の発注点を手動で設定する（None で自動に戻す）。商品がなければ False"""
+    cursor.execute(f"""
+        UPDATE products SET
+            reorder_point_manual = :point,
+            reorder_point = COALESCE(:point, (
+                SELECT {_automatic_point()} FROM product_velocity WHERE product_id = products.id
+            ), {LOW_STOCK_THRESHOLD})
+        WHERE id = :id
+    """, {'point': point, 'id': product_id})
+    return cursor.rowcount > 0
+
+
+def at_risk(cursor, limit=AT_RISK_LIMIT):
+    """在庫僅少（在庫 < 発注点）の商品を在庫日数の短い順に返す
+
+    販売実績のない商品は在庫日数を None とし、最後に在庫の少ない順に並べる。
+    """
+    cursor.execute("""
+        SELECT p.id, p.sku, p.name, p.quantity, p.reorder_point, COALESCE(v.units_per_day, 0) AS units_per_day
+        FROM products p
+        LEFT JOIN product_velocity v ON v.product_id = p.id
+        WHERE p.quantity < p.reorder_point
+        ORDER BY CASE WHEN units_per_day > 0 THEN p.quantity / units_per_day END NULLS LAST, p.quantity, p.id
+        LIMIT ?
+    """, (limit,))
+    cycle_days = config.get('REORDER_CYCLE_DAYS')
+    result = []
+    for product_id, sku, name, quantity, point, units_per_day in cursor.fetchall():
+        order_up_to = point + _ceil(units_per_day * cycle_days)
+        result.append((product_id, sku, name, quantity, point, round(units_per_day, 2),
+                       round(quantity / units_per_day, 1) if units_per_day > 0 else None,
+                       max(order_up_to - quantity, 0)))
+    return result
+
+
+def _ceil(value):
+    return -int(-value // 1)
+
+
+def last_refresh_time():
+    """最後に販売速度を計算した時刻（UNIX時刻。まだなければ0）"""
+    cursor = get_db().execute("SELECT CAST(strftime('%s', MAX(computed_at)) AS INTEGER) FROM product_velocity")
+    return cursor.fetchone()[0] or 0
+
+
+def run(as_of=None):
+    """トランザクションを開始して refresh を実行し、結果をログに残す"""
+    started = time.perf_counter()
+    conn = get_db()
+    with transaction(conn, immediate=True):
+        result = refresh(conn.cursor(), as_of)
+    result['duration_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    logger.info("発注点を更新しました", extra=result)
+    return result
+
+
+def _run_scheduler(app, interval):
+    # 設定（REORDER_*・データベースのパス）は起動したアプリのものを使う
+    with app.app_context():
+        lock_path = get_db_path() + '-reorder-lock'
+        # 商品がなければ product_velocity は空のままなので、このプロセスで最後に実行した時刻も見る
+        last_attempt = 0
+        while True:
+            try:
+                # 複数のワーカーで動いていても、最後の計算が新しければ何もしない
+                wait = max(last_refresh_time(), last_attempt) + interval - time.time()
+                if wait > 0:
+                    time.sleep(wait)
+                    continue
+                last_attempt = time.time()
+                with file_lock(lock_path):
+                    if last_refresh_time() + interval <= time.time():
+                        run()
+            except Exception:
+                logger.exception("発注点の定期更新に失敗しました")
+                time.sleep(interval)
+
+
+def start_scheduler(app, interval):
+    """interval 秒ごとに販売速度と発注点を計算し直すスレッドを起動する（プロセスごとに1つ）"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None or not _scheduler.is_alive():
+            _scheduler = threading.Thread(target=_run_scheduler, args=(app, interval), name='reorder', daemon=True)
+            _scheduler.start()
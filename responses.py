@@ -0,0 +1,87 @@
+"""JSONレスポンスのエンコードと圧縮
+
+JSONは orjson があればそれで、なければ標準の json でエンコードする。どちらも日本語を \\uXXXX に
+エスケープせず（UTF-8で1文字3バイト。エスケープすると6バイト）、キーの並べ替えもしない。
+
+COMPRESS_MIN_BYTES 以上のレスポンスは Accept-Encoding に応じて brotli（brotli があれば）か
+gzip で圧縮する（圧縮レベルは設定の GZIP_LEVEL / BROTLI_QUALITY）。
+ストリーミングのレスポンス（CSVエクスポート・SSE・静的ファイル）は圧縮しない。
+
+大量の行を返すAPIは ?format=columns を付けると {"columns": [...], "rows": [[...], ...]} の
+列形式で返す（行ごとにキー名を繰り返さず、サーバー側で行を辞書にする処理も省ける）。
+"""
+import gzip
+
+from flask.json.provider import DefaultJSONProvider
+
+import config
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = ('application/json', 'text/html', 'text/plain', 'text/css', 'text/javascript',
+                      'application/javascript')
+FORMATS = ('objects', 'columns')
+
+# datetime は Flask と同じ形式（HTTP日付）にするため default に渡す
+ORJSON_OPTIONS = (orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME) if orjson else 0
+
+
+class JSONProvider(DefaultJSONProvider):
+    """orjson があれば使うJSONプロバイダー（app.json_provider_class に設定する）"""
+
+    ensure_ascii = False
+    sort_keys = False
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=ORJSON_OPTIONS).decode('utf-8')
+
+    def response(self, *args, **kwargs):
+        # デバッグ時の整形出力は標準の処理に任せる
+        if orjson is None or self.compact is False or (self.compact is None and self._app.debug):
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=ORJSON_OPTIONS | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def columns(names, rows):
+    """行（タプル）のリストを列形式の辞書にする"""
+    return {'columns': list(names), 'rows': rows}
+
+
+def encodings():
+    """対応している圧縮方式（優先順）"""
+    return ('br', 'gzip') if brotli else ('gzip',)
+
+
+def compress(response, accept_encodings, min_bytes):
+    """Accept-Encoding に応じてレスポンスの本文を圧縮する（対象外ならそのまま返す）"""
+    if response.is_streamed or response.mimetype not in COMPRESSIBLE_TYPES:
+        return response
+    # 同じURLでも Accept-Encoding によって本文が変わることをキャッシュに伝える
+    response.vary.add('Accept-Encoding')
+    if response.status_code != 200 or 'Content-Encoding' in response.headers:
+        return response
+    encoding = accept_encodings.best_match(encodings())
+    if encoding is None:
+        return response
+    data = response.get_data()
+    if len(data) < min_bytes:
+        return response
+    if encoding == 'br':
+        data = brotli.compress(data, quality=config.get('BROTLI_QUALITY'))
+    else:
+        data = gzip.compress(data, compresslevel=config.get('GZIP_LEVEL'), mtime=0)
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    return response
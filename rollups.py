@@ -0,0 +1,104 @@
+"""売上の日次・月次ロールアップ
+
+sales_history への書き込み時にトリガー（migrations.py で作成）で商品×日、商品×月の集計行を更新する。
+分析グラフはこの集計テーブルだけを読むため、履歴が何百万行あっても
+読む行数は期間×商品数で頭打ちになる。
+アーカイブへ移した年（archive.py）の集計行は残し、再構築の対象にしない。
+"""
+from archive import archived_years
+
+BUCKETS = ('day', 'month')
+
+
+def backfill(cursor):
+    """既存の sales_history からロールアップを作り直す（トランザクション内で呼ぶこと）
+
+    アーカイブへ移した年は本体に履歴が残っていないので、集計行をそのまま残す。
+    """
+    years = ', '.join(str(year) for year in archived_years(cursor))
+
+    def live(column):
+        return f"WHERE CAST(substr({column}, 1, 4) AS INTEGER) NOT IN ({years})" if years else ""
+
+    cursor.execute(f"DELETE FROM sales_daily {live('day')}")
+    cursor.execute(f"DELETE FROM sales_monthly {live('month')}")
+    cursor.execute(f"""
+        INSERT INTO sales_daily (product_id, day, quantity, amount, sale_count)
+        SELECT product_id, date(created_at), SUM(quantity), SUM(total_amount), COUNT(*)
+        FROM sales_history
+        {live('created_at')}
+        GROUP BY product_id, date(created_at)
+    """)
+    days = cursor.rowcount
+    cursor.execute(f"""
+        INSERT INTO sales_monthly (product_id, month, quantity, amount, sale_count)
+        SELECT product_id, substr(day, 1, 7), SUM(quantity), SUM(amount), SUM(sale_count)
+        FROM sales_daily
+        {live('day')}
+        GROUP BY product_id, substr(day, 1, 7)
+    """)
+    return {'daily_rows': days, 'monthly_rows': cursor.rowcount}
+
+
+def _source(bucket, start, end):
+    """集計元テーブルと期間列を決める
+
+    月次でも期間が月の途中で区切られている場合は日次テーブルから集計する。
+    """
+    if bucket == 'month':
+        aligned = all(bound is None or bound.endswith('-01') for bound in (start, end))
+        if aligned:
+            return 'sales_monthly', 'month', 'month', [b[:7] if b else None for b in (start, end)]
+        return 'sales_daily', 'day', "substr(day, 1, 7)", [start, end]
+    return 'sales_daily', 'day', 'day', [start, end]
+
+
+def timeseries(cursor, bucket='month', start=None, end=None, product_id=None):
+    """期間ごとの売上数量・金額（start以上end未満、日付は 'YYYY-MM-DD'）"""
+    table, column, period, (low, high) = _source(bucket, start, end)
+    conditions, params = [], []
+    if low:
+        conditions.append(f"{column} >= ?")
+        params.append(low)
+    if high:
+        conditions.append(f"{column} < ?")
+        params.append(high)
+    if product_id is not None:
+        conditions.append("product_id = ?")
+        params.append(product_id)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    cursor.execute(f"""
+        SELECT {period} AS period, SUM(quantity), SUM(amount)
+        FROM {table}
+        {where}
+        GROUP BY period
+        ORDER BY period
+    """, params)
+    return [{'period': row[0], 'quantity': row[1], 'sales': row[2]} for row in cursor.fetchall()]
+
+
+def product_totals(cursor, bucket='month', start=None, end=None):
+    """期間内の商品別売上合計（売上の多い順）"""
+    table, column, _, (low, high) = _source(bucket, start, end)
+    conditions, params = [], []
+    if low:
+        conditions.append(f"r.{column} >= ?")
+        params.append(low)
+    if high:
+        conditions.append(f"r.{column} < ?")
+        params.append(high)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    cursor.execute(f"""
+        SELECT r.product_id, p.name, SUM(r.quantity), SUM(r.amount) AS sales
+        FROM {table} r
+        LEFT JOIN products p ON p.id = r.product_id
+        {where}
+        GROUP BY r.product_id
+        ORDER BY sales DESC
+    """, params)
+    return [{
+        'product_id': row[0],
+        'product': row[1],
+        'quantity': row[2],
+        'sales': row[3]
+    } for row in cursor.fetchall()]
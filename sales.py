@@ -0,0 +1,158 @@
+"""売上履歴の検索
+
+期間指定とキーセット（カーソル）方式のページングで sales_history を読む。
+created_at と (product_id, created_at) のインデックスを前提にしている。
+アーカイブへ移した年（archive.py）と期間が重なる場合は、そのファイルの sales_history も
+UNION ALL で読む（各テーブルをインデックス順に読んでマージするので、LIMIT 付きの検索は先頭だけ読む）。
+"""
+import base64
+from datetime import datetime, timedelta
+
+import archive
+import inventory
+import responses
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+# 列形式で返すときの列（SELECT の順）
+HISTORY_COLUMNS = ('id', 'date', 'product_name', 'quantity', 'price', 'total')
+
+
+def apply_sale(conn, product_id, quantity, price):
+    """在庫を引き当てて売上を登録する（トランザクション内で呼ぶこと）
+
+    戻り値はエラーメッセージ（成功時はNone）。在庫不足の場合は何も書き込まない。
+    """
+    error = inventory.reserve_stock(conn, product_id, quantity)
+    if error:
+        return error
+    conn.execute("INSERT INTO sales_history (product_id, quantity, unit_price, total_amount) VALUES (?, ?, ?, ?)",
+                 (product_id, quantity, price, quantity * price))
+    return None
+
+
+def parse_date_range(start_date, end_date):
+    """'YYYY-MM-DD' の開始日・終了日を created_at と比較する半開区間に変換する
+
+    終了日はその日の終わりまでを含む。指定がなければ None を返す。
+    不正な形式の場合は ValueError を送出する。
+    """
+    start = end = None
+    if start_date:
+        start = datetime.strptime(start_date, '%Y-%m-%d').strftime('%Y-%m-%d')
+    if end_date:
+        end = (datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+    if start and end and start >= end:
+        raise ValueError('開始日は終了日以前の日付を指定してください')
+    return start, end
+
+
+def encode_cursor(created_at, row_id):
+    return base64.urlsafe_b64encode(f"{created_at}|{row_id}".encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(token):
+    try:
+        created_at, row_id = base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8').rsplit('|', 1)
+        return created_at, int(row_id)
+    except (ValueError, UnicodeError):
+        raise ValueError('カーソルが不正です')
+
+
+def _range_conditions(start, end):
+    conditions, params = [], []
+    if start:
+        conditions.append("created_at >= ?")
+        params.append(start)
+    if end:
+        conditions.append("created_at < ?")
+        params.append(end)
+    return conditions, params
+
+
+def _union(cursor, start, end, select, conditions=(), params=(), suffix=''):
+    """期間と重なる売上履歴のテーブルごとの SELECT を UNION ALL でつないだSQLとパラメータ
+
+    select は "SELECT ... FROM {table}" の形で書き、各テーブルに conditions（と期間）と suffix を付ける。
+    """
+    range_conditions, range_params = _range_conditions(start, end)
+    conditions = range_conditions + list(conditions)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    tables = archive.sales_tables(cursor.connection, start, end)
+    sql = '\n UNION ALL\n'.join(f"{select.format(table=table)} {where} {suffix}" for table in tables)
+    return sql, (range_params + list(params)) * len(tables)
+
+
+def product_totals(cursor, start=None, end=None):
+    """期間内の商品別売上合計（売上の多い順）
+
+    product_id で集計してから商品名を引く（同名の商品や改名した商品が混ざらない）。
+    """
+    # テーブル（本体・アーカイブの年）ごとに集計してから合算する
+    source, params = _union(cursor, start, end, "SELECT product_id, SUM(total_amount) AS sales FROM {table}",
+                            suffix="GROUP BY product_id")
+    cursor.execute(f"""
+        SELECT t.product_id, p.name, t.sales
+        FROM (
+            SELECT product_id, SUM(sales) AS sales
+            FROM ({source})
+            GROUP BY product_id
+        ) t
+        LEFT JOIN products p ON p.id = t.product_id
+        ORDER BY t.sales DESC
+    """, params)
+    return [{'product_id': row[0], 'product': row[1], 'sales': row[2]} for row in cursor.fetchall()]
+
+
+def history_rows(cursor, start=None, end=None):
+    """期間内の売上履歴を新しい順に返すカーソルを実行する（全件ストリーミング用）
+
+    結果は fetchmany で少しずつ読み出すこと。
+    列は (created_at, 商品名, quantity, unit_price, total_amount)。
+    """
+    source, params = _union(cursor, start, end, f"SELECT {archive.COLUMNS} FROM {{table}}")
+    cursor.execute(f"""
+        SELECT s.created_at, p.name, s.quantity, s.unit_price, s.total_amount
+        FROM ({source}) s
+        LEFT JOIN products p ON p.id = s.product_id
+        ORDER BY s.created_at DESC, s.id DESC
+    """, params)
+    return cursor
+
+
+def history_page(cursor, start=None, end=None, limit=DEFAULT_PAGE_SIZE, after=None, columnar=False):
+    """期間内の売上履歴を新しい順に1ページ分返す
+
+    after には前ページの next_cursor を渡す。戻り値は (行のリスト, 次ページのカーソル)。
+    columnar=True なら行のリストの代わりに列形式（HISTORY_COLUMNS。id を含む）で返す。
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    conditions, params = [], []
+    if after:
+        conditions.append("(created_at, id) < (?, ?)")
+        params.extend(decode_cursor(after))
+    source, params = _union(cursor, start, end, f"SELECT {archive.COLUMNS} FROM {{table}}", conditions, params)
+    # 商品名は表示する行の分だけ products から引く
+    cursor.execute(f"""
+        SELECT s.id, s.created_at, p.name, s.quantity, s.unit_price, s.total_amount
+        FROM ({source} ORDER BY created_at DESC, id DESC LIMIT ?) s
+        LEFT JOIN products p ON p.id = s.product_id
+        ORDER BY s.created_at DESC, s.id DESC
+    """, params + [limit + 1])
+    rows = cursor.fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][1], rows[-1][0])
+
+    if columnar:
+        return responses.columns(HISTORY_COLUMNS, rows), next_cursor
+    history = [{
+        'date': row[1],
+        'product_name': row[2],
+        'quantity': row[3],
+        'price': row[4],
+        'total': row[5]
+    } for row in rows]
+    return history, next_cursor
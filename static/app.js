@@ -6,9 +6,61 @@ let appData = {
     charts: {},
     autoRefreshInterval: null,
     autoRefreshEnabled: false,
-    filteredProducts: [] // 検索結果を保存
+    eventSource: null, // /api/events（Server-Sent Events）
+    productList: null, // 商品一覧の検索条件と次ページのカーソル
+    productObserver: null, // 一覧の末尾が見えたら次ページを読み込む
+    searchTimer: null,
+    optionTimers: {}, // 商品セレクトボックスごとの検索の待ち
+    etagCache: {} // URLごとの { etag, data, nextCursor }
 };
 
+// 商品一覧の1ページの件数と、商品セレクトボックスの選択肢の件数
+const PRODUCT_PAGE_SIZE = 100;
+const PRODUCT_OPTION_LIMIT = 50;
+const PRODUCT_SELECTS = ['inboundProduct', 'outboundProduct', 'salesProduct'];
+
+// ETag付きGET（変更がなければ304で前回のデータを再利用）。次ページのカーソル（X-Next-Cursor）も返す
+async function fetchPage(url) {
+    const cached = appData.etagCache[url];
+    const headers = cached ? { 'If-None-Match': cached.etag } : {};
+    
+    // ブラウザのHTTPキャッシュではなく、ここで保持したデータを使う
+    const response = await fetch(url, { headers, cache: 'no-store' });
+    if (response.status === 304 && cached) {
+        return { data: cached.data, nextCursor: cached.nextCursor };
+    }
+    if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+    }
+    
+    const data = await response.json();
+    const nextCursor = response.headers.get('X-Next-Cursor');
+    const etag = response.headers.get('ETag');
+    if (etag) {
+        appData.etagCache[url] = { etag, data, nextCursor };
+    }
+    return { data, nextCursor };
+}
+
+async function fetchJSON(url) {
+    return (await fetchPage(url)).data;
+}
+
+// 列形式（?format=columns の {columns, rows}）を行ごとのオブジェクトの配列にする
+function fromColumns(data) {
+    if (!data || Array.isArray(data)) {
+        return data || [];
+    }
+    const { columns, rows } = data;
+    return rows.map(row => {
+        const item = {};
+        columns.forEach((column, index) => {
+            item[column] = row[index];
+        });
+        return item;
+    });
+}
+
 // ページ表示制御
 function showPage(pageName, event) {
     // すべてのページを非表示
@@ -62,7 +114,7 @@ function initializeTooltips() {
     });
 }
 
-// 検索機能
+// 検索機能（入力が落ち着いてからサーバー側で検索）
 async function searchProducts() {
     // ゲストユーザーチェック
     const isGuest = await showGuestWarning();
@@ -70,29 +122,12 @@ async function searchProducts() {
         return;
     }
     
-    const searchTerm = document.getElementById('productSearch').value.toLowerCase();
-    const searchCategory = document.getElementById('searchCategory').value;
-    
-    if (!searchTerm) {
-        appData.filteredProducts = appData.products;
-    } else {
-        appData.filteredProducts = appData.products.filter(product => {
-            switch(searchCategory) {
-                case 'name':
-                    return product.name && product.name.toLowerCase().includes(searchTerm);
-                case 'sku':
-                    return product.sku && product.sku.toLowerCase().includes(searchTerm);
-                case 'price':
-                    return product.price && product.price.toString().includes(searchTerm);
-                default:
-                    return (product.name && product.name.toLowerCase().includes(searchTerm)) ||
-                           (product.sku && product.sku.toLowerCase().includes(searchTerm)) ||
-                           (product.price && product.price.toString().includes(searchTerm));
-            }
-        });
-    }
-    
-    displayProducts(appData.filteredProducts);
+    clearTimeout(appData.searchTimer);
+    appData.searchTimer = setTimeout(runProductSearch, 250);
+}
+
+async function runProductSearch() {
+    await updateProductList();
 }
 
 // 検索クリア
@@ -105,17 +140,18 @@ async function clearSearch() {
     
     document.getElementById('productSearch').value = '';
     document.getElementById('searchCategory').value = 'all';
-    appData.filteredProducts = appData.products;
-    displayProducts(appData.products);
+    await updateProductList();
 }
 
-// 商品表示
-function displayProducts(products) {
+// 商品表示（append なら一覧の末尾に追加する）
+function displayProducts(products, append = false) {
     const tbody = document.getElementById('productTableBody');
     if (tbody) {
-        tbody.innerHTML = '';
+        if (!append) {
+            tbody.innerHTML = '';
+        }
         
-        if (products.length === 0) {
+        if (products.length === 0 && !append) {
             tbody.innerHTML = `
                 <tr>
                     <td colspan="5" class="text-center text-muted">
@@ -127,6 +163,9 @@ function displayProducts(products) {
         }
         
         products.forEach(product => {
+            // 発注点未満は在庫不足、発注点の5倍未満は在庫注意
+            const level = product.quantity < product.reorder_point ? ['bg-danger', '在庫不足']
+                : product.quantity < product.reorder_point * 5 ? ['bg-warning', '在庫注意'] : ['bg-success', '在庫充足'];
             const row = document.createElement('tr');
             row.innerHTML = `
                 <td>
@@ -145,9 +184,9 @@ function displayProducts(products) {
                     </span>
                 </td>
                 <td>
-                    <span class="badge ${product.quantity < 10 ? 'bg-danger' : product.quantity < 50 ? 'bg-warning' : 'bg-success'}" 
+                    <span class="badge ${level[0]}" 
                           data-bs-toggle="tooltip" data-bs-placement="top" 
-                          title="${product.quantity < 10 ? '在庫不足' : product.quantity < 50 ? '在庫注意' : '在庫充足'}">
+                          title="${level[1]}（発注点: ${product.reorder_point}点）">
                         ${product.quantity || 0}点
                     </span>
                 </td>
@@ -192,32 +231,10 @@ async function logout() {
 // ダッシュボード更新
 async function updateDashboard() {
     try {
-        const response = await fetch('/api/dashboard');
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
-        }
-        const data = await response.json();
+        const data = await fetchJSON('/api/dashboard');
         
         // KPI更新
-        const totalProductsEl = document.getElementById('totalProducts');
-        const totalStockEl = document.getElementById('totalStock');
-        const lowStockCountEl = document.getElementById('lowStockCount');
-        const totalSalesEl = document.getElementById('totalSales');
-        
-        if (totalProductsEl) totalProductsEl.textContent = data.total_products || 0;
-        if (totalStockEl) totalStockEl.textContent = (data.total_stock || 0).toLocaleString();
-        if (lowStockCountEl) lowStockCountEl.textContent = data.low_stock_count || 0;
-        if (totalSalesEl) totalSalesEl.textContent = `¥${(data.total_sales || 0).toLocaleString()}`;
-        
-        // 在庫不足アラート
-        const lowStockAlert = document.getElementById('lowStockAlert');
-        if (lowStockAlert) {
-            if (data.low_stock_count > 0) {
-                lowStockAlert.classList.remove('hidden');
-            } else {
-                lowStockAlert.classList.add('hidden');
-            }
-        }
+        renderKpis(data);
         
         // 売上チャート更新
         updateSalesChart(data.sales_data || []);
@@ -230,19 +247,78 @@ async function updateDashboard() {
     }
 }
 
+// KPI表示
+function renderKpis(data) {
+    const totalProductsEl = document.getElementById('totalProducts');
+    const totalStockEl = document.getElementById('totalStock');
+    const lowStockCountEl = document.getElementById('lowStockCount');
+    const totalSalesEl = document.getElementById('totalSales');
+    
+    if (totalProductsEl) totalProductsEl.textContent = data.total_products || 0;
+    if (totalStockEl) totalStockEl.textContent = (data.total_stock || 0).toLocaleString();
+    if (lowStockCountEl) lowStockCountEl.textContent = data.low_stock_count || 0;
+    if (totalSalesEl) totalSalesEl.textContent = `¥${(data.total_sales || 0).toLocaleString()}`;
+    
+    // 在庫不足アラート
+    const lowStockAlert = document.getElementById('lowStockAlert');
+    if (lowStockAlert) {
+        if (data.low_stock_count > 0) {
+            lowStockAlert.classList.remove('hidden');
+        } else {
+            lowStockAlert.classList.add('hidden');
+        }
+    }
+}
+
+// 商品一覧（検索欄に入力があればその検索結果）を先頭のページから読み込み直す
 async function updateProductList() {
+    const searchInput = document.getElementById('productSearch');
+    const searchTerm = searchInput ? searchInput.value.trim() : '';
+    const params = new URLSearchParams({ format: 'columns', limit: PRODUCT_PAGE_SIZE });
+    if (searchTerm) {
+        params.set('q', searchTerm);
+        params.set('field', document.getElementById('searchCategory').value);
+    }
+    appData.productList = { params: params.toString(), cursor: null, done: false, loading: false };
+    appData.products = [];
+    await loadMoreProducts();
+}
+
+// 商品一覧の次のページを読み込んで末尾に追加する（全商品を一度に取得しない）
+async function loadMoreProducts() {
+    const list = appData.productList;
+    if (!list || list.loading || list.done) {
+        return;
+    }
+    list.loading = true;
     try {
-        const response = await fetch('/api/products');
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
+        const first = list.cursor === null;
+        const cursor = first ? '' : `&cursor=${encodeURIComponent(list.cursor)}`;
+        const { data, nextCursor } = await fetchPage(`/api/products?${list.params}${cursor}`);
+        
+        // 読み込み中に検索条件が変わっていたら古い結果は表示しない
+        if (appData.productList !== list) {
+            return;
         }
-        const products = await response.json();
-        appData.products = products;
-        appData.filteredProducts = products;
+        const products = fromColumns(data);
+        appData.products = appData.products.concat(products);
+        list.cursor = nextCursor;
+        list.done = !nextCursor;
+        displayProducts(products, !first);
         
-        displayProducts(products);
+        const more = document.getElementById('productListMore');
+        if (more) {
+            more.classList.toggle('hidden', list.done);
+            // 末尾がまだ見えていれば続けて読み込む（監視し直すと現在の状態で通知される）
+            if (appData.productObserver && !list.done) {
+                appData.productObserver.unobserve(more);
+                appData.productObserver.observe(more);
+            }
+        }
     } catch (error) {
         console.error('商品一覧更新エラー:', error);
+    } finally {
+        list.loading = false;
     }
 }
 
@@ -260,40 +336,83 @@ function updateSalesPage() {
 // 分析ページ更新
 async function updateAnalysisPage() {
     try {
-        const response = await fetch('/api/sales-analysis');
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
-        }
-        const data = await response.json();
+        const data = await fetchJSON('/api/sales-analysis?format=columns');
         
         // 分析チャート更新
-        updateMonthlySalesChart(data.chart_data || []);
-        updateProductSalesChart(data.chart_data || []);
+        await updateAnalysisCharts();
         
         // 分析テーブル更新
-        updateAnalysisTable(data.sales_history || []);
+        updateAnalysisTable(fromColumns(data.sales_history));
         
     } catch (error) {
         console.error('分析ページ更新エラー:', error);
     }
 }
 
-// 商品セレクトボックス更新
+// 分析チャート更新（集計済みロールアップから取得）
+async function updateAnalysisCharts(startDate, endDate) {
+    let url = '/api/sales-analysis/timeseries?bucket=month';
+    if (startDate && endDate) {
+        url += `&start_date=${startDate}&end_date=${endDate}`;
+    }
+    
+    const data = await fetchJSON(url);
+    
+    updateMonthlySalesChart(data.series || []);
+    updateProductSalesChart(data.products || []);
+}
+
+// 商品セレクトボックス更新（全商品ではなく、検索欄の語でサーバー側で検索した先頭の商品を選択肢にする）
 function updateProductSelects() {
-    const selects = ['inboundProduct', 'outboundProduct', 'salesProduct'];
+    PRODUCT_SELECTS.forEach(selectId => fillProductOptions(selectId));
+}
+
+// 商品セレクトボックスの検索欄の入力（入力が落ち着いてから検索）
+function searchProductOptions(selectId) {
+    clearTimeout(appData.optionTimers[selectId]);
+    appData.optionTimers[selectId] = setTimeout(() => fillProductOptions(selectId), 250);
+}
+
+async function fillProductOptions(selectId) {
+    const select = document.getElementById(selectId);
+    if (!select) {
+        return;
+    }
+    const searchInput = document.getElementById(`${selectId}Search`);
+    const searchTerm = searchInput ? searchInput.value.trim() : '';
+    const params = new URLSearchParams({ format: 'columns', limit: PRODUCT_OPTION_LIMIT });
+    if (searchTerm) {
+        params.set('q', searchTerm);
+    }
     
-    selects.forEach(selectId => {
-        const select = document.getElementById(selectId);
-        if (select) {
-            select.innerHTML = '<option value="">商品を選択</option>';
-            appData.products.forEach(product => {
-                const option = document.createElement('option');
-                option.value = product.id;
-                option.textContent = `${product.sku} - ${product.name}`;
-                select.appendChild(option);
-            });
+    try {
+        const { data, nextCursor } = await fetchPage(`/api/products?${params.toString()}`);
+        if (searchInput && searchInput.value.trim() !== searchTerm) {
+            return;
         }
-    });
+        const selected = select.value;
+        select.innerHTML = '<option value="">商品を選択</option>';
+        fromColumns(data).forEach(product => {
+            const option = document.createElement('option');
+            option.value = product.id;
+            option.dataset.price = product.price;
+            option.textContent = `${product.sku} - ${product.name}`;
+            select.appendChild(option);
+        });
+        if (nextCursor) {
+            const option = document.createElement('option');
+            option.disabled = true;
+            option.textContent = `（先頭${PRODUCT_OPTION_LIMIT}件。SKU・商品名で検索して絞り込んでください）`;
+            select.appendChild(option);
+        }
+        // 選択中の商品が選択肢に残っていれば選択を保つ
+        select.value = selected;
+        if (select.value !== selected) {
+            select.value = '';
+        }
+    } catch (error) {
+        console.error('商品選択肢の取得エラー:', error);
+    }
 }
 
 // 売上チャート更新
@@ -347,7 +466,7 @@ function updateMonthlySalesChart(chartData) {
         appData.charts.monthlySalesChart.destroy();
     }
     
-    const labels = chartData.map(item => item.product || '');
+    const labels = chartData.map(item => item.period || '');
     const data = chartData.map(item => item.sales || 0);
     
     appData.charts.monthlySalesChart = new Chart(ctx, {
@@ -422,13 +541,8 @@ function updateProductSalesChart(chartData) {
 // 在庫僅少商品テーブル更新
 async function updateLowStockTable() {
     try {
-        const response = await fetch('/api/products');
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
-        }
-        const products = await response.json();
-        
-        const lowStockProducts = products.filter(product => product.quantity < 10);
+        // 在庫僅少の商品だけを在庫日数の短い順に取得する
+        const lowStockProducts = fromColumns(await fetchJSON('/api/inventory/at-risk?format=columns'));
         const lowStockTable = document.getElementById('lowStockTable');
         
         if (lowStockTable) {
@@ -436,10 +550,12 @@ async function updateLowStockTable() {
                 lowStockTable.innerHTML = '<p class="text-muted">在庫不足の商品はありません</p>';
             } else {
                 let tableHTML = '<table class="table table-sm">';
-                tableHTML += '<thead><tr><th>商品名</th><th>在庫数</th></tr></thead><tbody>';
+                tableHTML += '<thead><tr><th>商品名</th><th>在庫数</th><th>発注点</th><th>在庫日数</th><th>推奨発注数</th></tr></thead><tbody>';
                 
                 lowStockProducts.forEach(product => {
-                    tableHTML += `<tr><td>${product.name}</td><td>${product.quantity}点</td></tr>`;
+                    const cover = product.days_of_cover === null ? '-' : `${product.days_of_cover}日`;
+                    tableHTML += `<tr><td>${product.name}</td><td>${product.quantity}点</td><td>${product.reorder_point}点</td>`
+                        + `<td>${cover}</td><td>${product.suggested_order}点</td></tr>`;
                 });
                 
                 tableHTML += '</tbody></table>';
@@ -454,17 +570,13 @@ async function updateLowStockTable() {
 // 売上履歴更新
 async function updateSalesHistory() {
     try {
-        const response = await fetch('/api/sales-analysis');
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
-        }
-        const data = await response.json();
+        const data = await fetchJSON('/api/sales-analysis?format=columns');
         
         const tbody = document.getElementById('salesHistoryTable');
         if (tbody) {
             tbody.innerHTML = '';
             
-            const salesHistory = data.sales_history || [];
+            const salesHistory = fromColumns(data.sales_history);
             salesHistory.forEach(sale => {
                 const row = document.createElement('tr');
                 row.innerHTML = `
@@ -790,12 +902,10 @@ function updateSalesPrice() {
     const productSelect = document.getElementById('salesProduct');
     const priceInput = document.getElementById('salesPrice');
     
-    if (productSelect.value) {
-        const selectedProduct = appData.products.find(p => p.id == productSelect.value);
-        if (selectedProduct) {
-            priceInput.value = selectedProduct.price;
-            calculateTotal();
-        }
+    const selectedOption = productSelect.selectedOptions[0];
+    if (productSelect.value && selectedOption) {
+        priceInput.value = selectedOption.dataset.price;
+        calculateTotal();
     }
 }
 
@@ -808,12 +918,41 @@ function calculateTotal() {
     document.getElementById('salesTotal').value = `¥${total.toLocaleString()}`;
 }
 
+// サーバーからの更新通知（Server-Sent Events）を受け取る
+function connectEvents() {
+    const source = new EventSource('/api/events');
+    
+    source.addEventListener('kpi', (event) => {
+        renderKpis(JSON.parse(event.data));
+    });
+    source.addEventListener('low_stock', () => {
+        updateLowStockTable();
+    });
+    source.addEventListener('resync', () => {
+        // 通知を取りこぼしたので全体を取り直す
+        updateDashboard();
+    });
+    source.addEventListener('error', () => {
+        // 接続数の上限（503）などでブラウザが再接続しない場合は30秒間隔の取得に切り替える
+        if (source.readyState === EventSource.CLOSED && appData.eventSource === source) {
+            appData.eventSource = null;
+            appData.autoRefreshInterval = setInterval(updateDashboard, 30000);
+        }
+    });
+    
+    return source;
+}
+
 // 自動更新切り替え
 function toggleAutoRefresh() {
     const button = document.getElementById('autoRefreshText');
     
     if (appData.autoRefreshEnabled) {
         // 自動更新を停止
+        if (appData.eventSource) {
+            appData.eventSource.close();
+            appData.eventSource = null;
+        }
         if (appData.autoRefreshInterval) {
             clearInterval(appData.autoRefreshInterval);
             appData.autoRefreshInterval = null;
@@ -821,60 +960,71 @@ function toggleAutoRefresh() {
         appData.autoRefreshEnabled = false;
         button.textContent = '自動更新OFF';
     } else {
-        // 自動更新を開始（30秒間隔）
-        appData.autoRefreshInterval = setInterval(updateDashboard, 30000);
+        if (window.EventSource) {
+            // 変更があったときだけサーバーから通知を受ける
+            appData.eventSource = connectEvents();
+        } else {
+            // EventSource非対応のブラウザでは30秒間隔で取得する
+            appData.autoRefreshInterval = setInterval(updateDashboard, 30000);
+        }
         appData.autoRefreshEnabled = true;
         button.textContent = '自動更新ON';
     }
 }
 
-// データエクスポート
+// データエクスポート（サーバー側でCSVを生成してダウンロード）
 function exportData() {
     const startDate = document.getElementById('startDate').value;
     const endDate = document.getElementById('endDate').value;
     
-    // CSVデータを作成
-    let csvContent = "日付,商品名,数量,単価,売上\n";
+    const params = new URLSearchParams();
+    if (startDate) params.set('start_date', startDate);
+    if (endDate) params.set('end_date', endDate);
     
-    // 実際のデータを取得してCSVに追加
-    fetch('/api/sales-analysis')
-        .then(response => response.json())
-        .then(data => {
-            data.sales_history.forEach(sale => {
-                csvContent += `${sale.date},${sale.product_name},${sale.quantity},${sale.price},${sale.total}\n`;
-            });
-            
-            // CSVファイルをダウンロード
-            const blob = new Blob([csvContent], { type: 'text/csv;charset=utf-8;' });
-            const link = document.createElement('a');
-            link.href = URL.createObjectURL(blob);
-            link.download = `売上データ_${startDate}_${endDate}.csv`;
-            link.click();
-        });
+    window.location.href = `/api/export/sales?${params.toString()}`;
 }
 
 // 商品エクスポート
 function exportProducts() {
-    let csvContent = "SKU,商品名,価格,在庫数\n";
-    
-    appData.products.forEach(product => {
-        csvContent += `${product.sku},${product.name},${product.price},${product.quantity}\n`;
-    });
-    
-    const blob = new Blob([csvContent], { type: 'text/csv;charset=utf-8;' });
-    const link = document.createElement('a');
-    link.href = URL.createObjectURL(blob);
-    link.download = `商品一覧_${new Date().toISOString().split('T')[0]}.csv`;
-    link.click();
+    window.location.href = '/api/export/products';
 }
 
 // 一括在庫更新
-function bulkUpdateStock() {
+async function bulkUpdateStock() {
     const newStock = prompt('一括で設定する在庫数を入力してください:');
     if (newStock && !isNaN(newStock)) {
-        if (confirm(`すべての商品の在庫数を${newStock}に設定しますか？`)) {
-            // 実際の実装では、APIエンドポイントを作成して一括更新を行う
-            alert('一括在庫更新機能は現在開発中です');
+        const target = parseInt(newStock);
+        if (target < 0) {
+            alert('在庫数は0以上の数値を入力してください');
+            return;
+        }
+        if (confirm(`すべての商品の在庫数を${target}に設定しますか？`)) {
+            // 画面の在庫数から差分を求めず、サーバー側で1回の更新として設定する
+            try {
+                const response = await fetch('/api/inventory/set-all', {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json',
+                    },
+                    body: JSON.stringify({ quantity: target })
+                });
+                
+                if (!response.ok) {
+                    throw new Error(`HTTP error! status: ${response.status}`);
+                }
+                
+                const result = await response.json();
+                if (result.success) {
+                    alert(result.message);
+                    updateProductList();
+                    updateDashboard();
+                } else {
+                    alert('一括在庫更新に失敗しました: ' + result.message);
+                }
+            } catch (error) {
+                console.error('一括在庫更新エラー:', error);
+                alert('一括在庫更新エラーが発生しました');
+            }
         }
     }
 }
@@ -885,23 +1035,18 @@ async function updateAnalysis() {
     const endDate = document.getElementById('endDate').value;
     
     try {
-        let url = '/api/sales-analysis';
+        let url = '/api/sales-analysis?format=columns';
         if (startDate && endDate) {
-            url += `?start_date=${startDate}&end_date=${endDate}`;
+            url += `&start_date=${startDate}&end_date=${endDate}`;
         }
         
-        const response = await fetch(url);
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
-        }
-        const data = await response.json();
+        const data = await fetchJSON(url);
         
         // 分析チャート更新
-        updateMonthlySalesChart(data.chart_data || []);
-        updateProductSalesChart(data.chart_data || []);
+        await updateAnalysisCharts(startDate, endDate);
         
         // 分析テーブル更新
-        updateAnalysisTable(data.sales_history || []);
+        updateAnalysisTable(fromColumns(data.sales_history));
         
     } catch (error) {
         console.error('分析更新エラー:', error);
@@ -984,6 +1129,17 @@ async function initializeApp() {
             searchCategory.addEventListener('change', searchProducts);
         }
         
+        // 商品一覧の末尾（「さらに表示」）が見えたら次のページを読み込む
+        const productListMore = document.getElementById('productListMore');
+        if (productListMore && window.IntersectionObserver) {
+            appData.productObserver = new IntersectionObserver(entries => {
+                if (entries.some(entry => entry.isIntersecting)) {
+                    loadMoreProducts();
+                }
+            });
+            appData.productObserver.observe(productListMore);
+        }
+        
         // ツールチップ初期化
         initializeTooltips();
         
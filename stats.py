@@ -0,0 +1,61 @@
+"""ダッシュボード集計値（KPI）の保持
+
+商品数・総在庫・在庫僅少数・累計売上を dashboard_stats テーブルの1行に保持する。
+値はトリガー（migrations.py で作成）で更新するため、商品・在庫・売上の書き込みと同じトランザクションで
+確定し、ダッシュボードは1行読むだけで済む。
+在庫僅少は商品ごとの発注点（products.reorder_point。reorder.py を参照）未満の商品。
+累計売上にはアーカイブへ移した売上（archive.py）も含む。
+"""
+from archive import archived_amount
+
+# 発注点の既定値（販売実績のない商品や、自動計算した発注点の下限に使う）
+LOW_STOCK_THRESHOLD = 10
+
+STATS_COLUMNS = ('total_products', 'total_stock', 'low_stock_count', 'total_sales')
+
+
+def compute_stats(cursor):
+    """元テーブルを全件集計してKPIを求める（再構築・検証用）"""
+    cursor.execute("""
+        SELECT COUNT(*), COALESCE(SUM(quantity), 0), COALESCE(SUM(quantity < reorder_point), 0)
+        FROM products
+    """)
+    total_products, total_stock, low_stock_count = cursor.fetchone()
+    cursor.execute("SELECT COALESCE(SUM(total_amount), 0) FROM sales_history")
+    total_sales = cursor.fetchone()[0] + archived_amount(cursor)
+    return {
+        'total_products': total_products,
+        'total_stock': total_stock,
+        'low_stock_count': low_stock_count,
+        'total_sales': total_sales
+    }
+
+
+def read_stats(cursor):
+    """保持しているKPIを返す（未作成ならNone）"""
+    cursor.execute(f"SELECT {', '.join(STATS_COLUMNS)} FROM dashboard_stats WHERE id = 1")
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return dict(zip(STATS_COLUMNS, row))
+
+
+def rebuild_stats(cursor):
+    """元テーブルから集計し直して保持値を置き換える（トランザクション内で呼ぶこと）"""
+    stats = compute_stats(cursor)
+    cursor.execute(f"""
+        INSERT OR REPLACE INTO dashboard_stats (id, {', '.join(STATS_COLUMNS)})
+        VALUES (1, ?, ?, ?, ?)
+    """, tuple(stats[column] for column in STATS_COLUMNS))
+    return stats
+
+
+def verify_stats(cursor):
+    """保持値と元テーブルの集計を比較し、差分のある項目を返す"""
+    stored = read_stats(cursor) or {}
+    actual = compute_stats(cursor)
+    return {
+        column: {'stored': stored.get(column), 'actual': actual[column]}
+        for column in STATS_COLUMNS
+        if stored.get(column) != actual[column]
+    }
@@ -0,0 +1,49 @@
+"""テスト用のアプリケーションとデータベース
+
+テストごとに一時ディレクトリのデータベースを migrations で作成する。
+定期実行（バックアップ・発注点）は止め、パスワードのハッシュは低いコストで作る。
+"""
+import pytest
+
+import db
+import migrations
+from app import create_app, init_database
+
+PASSWORD = 'Test@2024!'
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({
+        'DATABASE_PATH': str(tmp_path / 'test.db'),
+        'BACKUP_DIR': str(tmp_path / 'backups'),
+        'ARCHIVE_DIR': str(tmp_path / 'archive'),
+        'INIT_DATABASE': False,
+        'DEFAULT_PASSWORD': PASSWORD,
+        'BACKUP_INTERVAL': 0,
+        'REORDER_INTERVAL': 0,
+        'BCRYPT_ROUNDS': 4,
+        'PASSWORD_WORKERS': 0,
+        'LOG_LEVEL': 'WARNING',
+    })
+    with app.app_context():
+        yield app
+        db.close_db()
+
+
+@pytest.fixture
+def conn(app):
+    """マイグレーションを適用した（初期データのない）データベースへの接続"""
+    conn = db.get_db()
+    migrations.migrate(conn)
+    return conn
+
+
+@pytest.fixture
+def client(app):
+    """初期データを投入し、admin でログイン済みのテストクライアント"""
+    init_database(PASSWORD)
+    client = app.test_client()
+    response = client.post('/api/login', json={'username': 'admin', 'password': PASSWORD})
+    assert response.status_code == 200
+    return client
@@ -0,0 +1,114 @@
+"""売上履歴のアーカイブ（archive.py）の移動中の検索・中断した移動の再開・欠けたファイル・バックアップ"""
+import os
+import sqlite3
+import threading
+from datetime import date
+
+import pytest
+
+from db import file_lock, get_db_path, transaction
+import archive
+import backup
+import sales
+
+
+class Interrupted(Exception):
+    pass
+
+
+def add_sales(conn, year, count):
+    with transaction(conn, immediate=True):
+        product_id = conn.execute("INSERT INTO products (sku, name, price, quantity) VALUES ('A1', '商品A', 100, 0)"
+                                  ).lastrowid
+        for day in range(1, count + 1):
+            conn.execute("INSERT INTO sales_history (product_id, quantity, unit_price, total_amount, created_at) "
+                         "VALUES (?, 1, 100, 100, ?)", (product_id, f"{year}-03-{day:02d} 10:00:00"))
+
+
+def history_ids(conn, year):
+    rows, _ = sales.history_page(conn.cursor(), f"{year}-01-01", f"{year + 1}-01-01", limit=100)
+    return sorted(row['date'] for row in rows)
+
+
+def interrupt(year, moved):
+    raise Interrupted()
+
+
+def test_interrupted_move_is_not_read_twice(conn):
+    add_sales(conn, 2020, 3)
+    expected = history_ids(conn, 2020)
+    with pytest.raises(Interrupted):
+        archive.archive_year(2020, chunk_size=2, progress=interrupt)
+    # 次のチャンクをアーカイブへコピーして、本体から削除する前の状態にする
+    path = archive.partitions(conn)[0][1]
+    target = sqlite3.connect(path)
+    target.execute("ATTACH DATABASE ? AS hot", (get_db_path(),))
+    target.execute(f"INSERT INTO sales_history SELECT {archive.COLUMNS} FROM hot.sales_history")
+    target.commit()
+    target.close()
+    assert conn.execute("SELECT COUNT(*) FROM sales_history").fetchone()[0] == 1
+    assert history_ids(conn, 2020) == expected
+
+    archive.archive_year(2020, chunk_size=2)
+    assert conn.execute("SELECT state, rows FROM sales_partitions").fetchone() == ('archived', 3)
+    assert history_ids(conn, 2020) == expected
+
+
+def test_moving_year_excludes_only_the_chunk_in_flight(conn):
+    add_sales(conn, 2020, 5)
+    with pytest.raises(Interrupted):
+        archive.archive_year(2020, chunk_size=2, progress=interrupt)
+    assert conn.execute("SELECT moved_until FROM sales_partitions").fetchone() == ('2020-03-02 10:00:00',)
+
+    main = archive.sales_tables(conn, '2020-01-01', '2021-01-01')[0]
+    assert "created_at >= '2020-03-02 10:00:00'" in main
+    # アーカイブ全体ではなく、created_at のインデックスで移動中のチャンクだけを読む
+    plan = ' '.join(row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN SELECT COUNT(*) FROM {main}"))
+    assert 'SEARCH sales_2020.sales_history USING COVERING INDEX idx_sales_history_created_at' in plan
+
+
+def test_interrupted_move_is_resumed(app, conn):
+    add_sales(conn, 2020, 3)
+    expected = history_ids(conn, 2020)
+    with pytest.raises(Interrupted):
+        archive.archive_year(2020, chunk_size=2, progress=interrupt)
+    # ほかのプロセスが移動中なら待たずに戻る
+    with file_lock(get_db_path() + '-archive-lock'):
+        assert archive.resume_moves() == []
+
+    archive.start_resume(app, conn)
+    for thread in threading.enumerate():
+        if thread.name == 'archive-resume':
+            thread.join()
+    assert conn.execute("SELECT state, rows FROM sales_partitions").fetchone() == ('archived', 3)
+    assert history_ids(conn, 2020) == expected
+
+
+def test_missing_archive_file_is_skipped(conn):
+    add_sales(conn, 2020, 2)
+    result = archive.archive_year(2020)
+    os.remove(result['path'])
+    assert history_ids(conn, 2020) == []
+
+
+def test_before_must_be_earlier_than_this_year(app, conn):
+    with pytest.raises(ValueError):
+        archive.closed_years(conn, date.today().year)
+    result = app.test_cli_runner().invoke(args=['archive-sales', '--before', str(date.today().year)])
+    assert result.exit_code != 0
+    assert '今年' in result.output
+
+
+def test_snapshot_saves_and_restores_archives(app, conn):
+    add_sales(conn, 2020, 2)
+    expected = history_ids(conn, 2020)
+    path = archive.archive_year(2020)['path']
+    snapshot = backup.create_snapshot()
+    assert snapshot['archives'] == [os.path.join(app.config['BACKUP_DIR'], 'archive', os.path.basename(path))]
+    # 移動済みの年は2回目以降コピーしない
+    assert backup.create_snapshot()['archives'] == []
+
+    os.remove(path)
+    result = backup.restore_snapshot(snapshot['path'])
+    assert result['archives'] == [path]
+    assert history_ids(conn, 2020) == expected
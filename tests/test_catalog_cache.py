@@ -0,0 +1,36 @@
+"""商品カタログのキャッシュ（catalog.py）の件数・バイト数の上限"""
+import catalog
+
+
+def test_evicts_by_approximate_size(app):
+    app.config.update(TEST_CACHE_ENTRIES=100, TEST_CACHE_BYTES=catalog.approximate_size('x' * 1000) * 3)
+    cache = catalog.LRUCache('test', 'TEST_CACHE_ENTRIES', 'TEST_CACHE_BYTES')
+    for key in range(5):
+        cache.get(key, lambda: 'x' * 1000)
+    assert len(cache) == 3
+    assert cache.bytes <= app.config['TEST_CACHE_BYTES']
+    # 古いものから捨てる
+    loaded = []
+    cache.get(0, lambda: loaded.append(0) or 'x' * 1000)
+    assert loaded == [0]
+
+
+def test_does_not_store_values_over_the_limit(app):
+    app.config.update(TEST_CACHE_ENTRIES=100, TEST_CACHE_BYTES=100)
+    cache = catalog.LRUCache('test', 'TEST_CACHE_ENTRIES', 'TEST_CACHE_BYTES')
+    cache.get('large', lambda: ['x' * 1000])
+    assert len(cache) == 0
+    assert cache.bytes == 0
+    # 同じバージョンの間は測り直さずに読み込む
+    loaded = []
+    assert cache.get('large', lambda: loaded.append(1) or ['x' * 1000]) == ['x' * 1000]
+    assert loaded == [1]
+
+
+def test_unlimited_list_is_cached_within_the_byte_limit(app, client):
+    assert client.get('/api/products?format=columns').status_code == 200
+    assert len(catalog.searches) == 1
+    assert 0 < catalog.searches.bytes <= app.config['CATALOG_CACHE_SEARCH_BYTES']
+    app.config['CATALOG_CACHE_SEARCH_BYTES'] = 100
+    assert client.get('/api/products').status_code == 200
+    assert len(catalog.searches) == 1
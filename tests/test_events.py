@@ -0,0 +1,32 @@
+"""Server-Sent Events（/api/events）の接続数の上限"""
+from config import load_config
+import events
+
+
+def test_default_cap_depends_on_worker_class():
+    # gevent（既定）: 同時接続数の9割
+    assert load_config({})['SSE_MAX_SUBSCRIBERS'] == 1800
+    assert load_config({'GUNICORN_WORKER_CONNECTIONS': '1000'})['SSE_MAX_SUBSCRIBERS'] == 900
+    # gthread: スレッド数の半分
+    assert load_config({'GUNICORN_WORKER_CLASS': 'gthread', 'GUNICORN_THREADS': '64'})['SSE_MAX_SUBSCRIBERS'] == 32
+    assert load_config({'GUNICORN_WORKER_CLASS': 'gthread', 'GUNICORN_THREADS': '1'})['SSE_MAX_SUBSCRIBERS'] == 1
+    assert load_config({'SSE_MAX_SUBSCRIBERS': '500'})['SSE_MAX_SUBSCRIBERS'] == 500
+
+
+def test_streams_over_cap_get_503(app, client):
+    app.config['SSE_MAX_SUBSCRIBERS'] = 2
+    streams = [client.get('/api/events', buffered=False) for _ in range(2)]
+    try:
+        assert [stream.status_code for stream in streams] == [200, 200]
+        assert events.broadcaster.subscriber_count() == 2
+        rejected = client.get('/api/events')
+        assert rejected.status_code == 503
+        assert rejected.headers['Retry-After'] == '30'
+    finally:
+        # 同じスレッドで開いたストリームはコンテキストが入れ子になるので、後に開いたものから閉じる
+        for stream in reversed(streams):
+            stream.close()
+    assert events.broadcaster.subscriber_count() == 0
+    stream = client.get('/api/events', buffered=False)
+    assert stream.status_code == 200
+    stream.close()
@@ -0,0 +1,31 @@
+"""売上CSVエクスポート（/api/export/sales）の行の順序"""
+from db import get_db, transaction
+
+DATES = ['2024-01-01 10:29:06', '2024-03-15 09:00:00', '2024-02-10 12:00:00', '2024-03-15 09:00:00']
+
+
+def add_sales(conn):
+    with transaction(conn, immediate=True):
+        # 商品ごとにまとまって読まれると順序が崩れるよう、商品を交互にする
+        products = [conn.execute("INSERT INTO products (sku, name, price, quantity) VALUES (?, ?, 100, 0)",
+                                 (f"EXP{i}", f"商品{i}")).lastrowid for i in range(2)]
+        for i, created_at in enumerate(DATES):
+            conn.execute("INSERT INTO sales_history (product_id, quantity, unit_price, total_amount, created_at) "
+                         "VALUES (?, ?, 100, 100, ?)", (products[i % 2], i + 1, created_at))
+
+
+def exported(client, query=''):
+    response = client.get(f'/api/export/sales{query}')
+    assert response.status_code == 200
+    lines = response.get_data(as_text=True).strip().split('\n')[1:]
+    return [(line.split(',')[0], int(line.split(',')[2])) for line in lines]
+
+
+def test_export_is_newest_first(client):
+    add_sales(get_db())
+    # 同じ時刻の行は id の大きい（後に登録した）方が先
+    expected = [('2024-03-15 09:00:00', 4), ('2024-03-15 09:00:00', 2), ('2024-02-10 12:00:00', 3),
+                ('2024-01-01 10:29:06', 1)]
+    rows = exported(client)
+    assert [row for row in rows if row[0].startswith('2024-0')] == expected
+    assert exported(client, '?start_date=2024-01-01&end_date=2024-03-31') == expected
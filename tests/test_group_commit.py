@@ -0,0 +1,39 @@
+"""グループコミット（writer.py）の期限: 期限を過ぎた操作は実行しない"""
+import threading
+import time
+
+import pytest
+
+import writer
+
+
+def test_expired_operation_is_not_written(app, conn):
+    app.config.update(GROUP_COMMIT=True, GROUP_COMMIT_TIMEOUT=0.05)
+    started, called = threading.Event(), []
+
+    def slow(conn):
+        started.set()
+        time.sleep(0.3)
+        return 'slow'
+
+    def record(conn):
+        called.append(True)
+        return 'recorded'
+
+    def run_slow():
+        with app.app_context():
+            results.append(writer.execute(slow))
+
+    results = []
+    thread = threading.Thread(target=run_slow)
+    thread.start()
+    started.wait()
+    # 書き込みスレッドが前の操作を実行している間に期限が過ぎる
+    with pytest.raises(writer.DeadlineExceeded):
+        writer.execute(record)
+    thread.join()
+    assert results == ['slow']
+    assert called == []
+
+    assert writer.execute(record) == 'recorded'
+    assert called == [True]
@@ -0,0 +1,78 @@
+"""在庫の一括更新（inventory.apply_batch / set_all）が全件成功か全件失敗になること"""
+from db import transaction
+import inventory
+
+
+def add_products(conn, quantities):
+    with transaction(conn, immediate=True):
+        conn.executemany("INSERT INTO products (sku, name, price, quantity) VALUES (?, ?, 100, ?)",
+                         [(f"TEST{i:03d}", f"テスト商品{i}", quantity) for i, quantity in enumerate(quantities)])
+    return [row[0] for row in conn.execute("SELECT id FROM products ORDER BY id")]
+
+
+def quantities(conn):
+    return [row[0] for row in conn.execute("SELECT quantity FROM products ORDER BY id")]
+
+
+def test_batch_applies_all_lines(conn):
+    first, second = add_products(conn, [10, 5])
+    success, results = inventory.apply_batch(conn, [
+        {'product_id': first, 'delta': -4},
+        {'sku': 'TEST001', 'delta': 3},
+        {'product_id': first, 'delta': 1},
+    ])
+    assert success
+    assert [result['status'] for result in results] == ['ok', 'ok', 'ok']
+    assert quantities(conn) == [7, 8]
+
+
+def test_batch_shortage_applies_nothing(conn):
+    first, second = add_products(conn, [10, 1])
+    success, results = inventory.apply_batch(conn, [
+        {'product_id': first, 'delta': -4},
+        {'product_id': second, 'delta': -2},
+    ])
+    assert not success
+    assert [result['status'] for result in results] == ['skipped', 'error']
+    assert quantities(conn) == [10, 1]
+
+
+def test_batch_invalid_line_applies_nothing(conn):
+    first, = add_products(conn, [10])
+    success, results = inventory.apply_batch(conn, [
+        {'product_id': first, 'delta': 5},
+        {'product_id': 999, 'delta': 1},
+        {'product_id': first},
+    ])
+    assert not success
+    assert [result['status'] for result in results] == ['skipped', 'error', 'error']
+    assert quantities(conn) == [10]
+
+
+def test_set_quantity_uses_current_stock(conn):
+    first, second = add_products(conn, [10, 5])
+    # 画面に表示していた在庫数と関係なく、トランザクション内の在庫から増減を求める
+    with transaction(conn, immediate=True):
+        conn.execute("UPDATE products SET quantity = 2 WHERE id = ?", (first,))
+    success, results = inventory.apply_batch(conn, [
+        {'product_id': first, 'quantity': 20},
+        {'product_id': second, 'quantity': 0},
+        {'product_id': first, 'delta': -5},
+    ])
+    assert success
+    assert [result['delta'] for result in results] == [18, -5, -5]
+    assert quantities(conn) == [15, 0]
+
+
+def test_set_quantity_rejects_negative(conn):
+    first, = add_products(conn, [10])
+    success, results = inventory.apply_batch(conn, [{'product_id': first, 'quantity': -1}])
+    assert not success
+    assert quantities(conn) == [10]
+
+
+def test_set_all_over_batch_limit(client, conn):
+    add_products(conn, [i % 7 for i in range(inventory.MAX_BATCH_LINES + 1)])
+    response = client.post('/api/inventory/set-all', json={'quantity': 3})
+    assert response.get_json()['success']
+    assert set(quantities(conn)) == {3}
@@ -0,0 +1,31 @@
+"""ログイン試行の制限（auth.py）が本体のデータベースに書き込まないこと"""
+import os
+
+from conftest import PASSWORD
+import auth
+from db import data_version, get_db_path
+
+
+def login(client, password):
+    return client.post('/api/login', json={'username': 'admin', 'password': password})
+
+
+def test_failures_lock_out_without_touching_main_database(app, client):
+    version = data_version()
+    for _ in range(app.config['LOGIN_MAX_FAILURES_PER_USER']):
+        assert not login(client, 'wrong').get_json()['success']
+    assert data_version() == version
+    assert os.path.exists(auth.throttle_path())
+    assert auth.throttle_path() != get_db_path()
+
+    response = login(client, 'wrong')
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) > 0
+
+
+def test_success_clears_user_failures(app, client):
+    for _ in range(app.config['LOGIN_MAX_FAILURES_PER_USER'] - 1):
+        login(client, 'wrong')
+    assert login(client, PASSWORD).get_json()['success']
+    assert login(client, 'wrong').status_code == 200
+    assert auth.locked_for('admin', '127.0.0.1') == 0
@@ -0,0 +1,152 @@
+"""マイグレーションの適用（新規作成と、適用済みのデータベースの更新）"""
+import pytest
+
+from db import connect, transaction
+import migrations
+import stats
+
+
+def schema(conn):
+    """sqlite_master の定義（空白を正規化したもの）"""
+    return {(kind, name): ' '.join(sql.split()) for kind, name, sql in conn.execute(
+        "SELECT type, name, sql FROM sqlite_master WHERE sql IS NOT NULL")}
+
+
+def columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def test_initial_schema_is_frozen(app, tmp_path):
+    # 1番だけ適用したデータベースは出荷時の定義のまま（以降の変更は2番以降にある）
+    initial = connect(str(tmp_path / 'initial.db'))
+    migrations.migrate(initial, target=1)
+    assert migrations.current_version(initial) == 1
+    assert 'product_name' in columns(initial, 'sales_history')
+    assert 'reorder_point' not in columns(initial, 'products')
+    definitions = schema(initial)
+    assert ('table', 'sales_partitions') not in definitions
+    assert ('table', 'product_velocity') not in definitions
+    assert '(COALESCE(NEW.quantity, 0) < 10)' in definitions[('trigger', 'trg_stats_products_insert')]
+    assert 'WHEN' not in definitions[('trigger', 'trg_stats_sales_delete')]
+    initial.close()
+
+
+def test_upgrade_from_initial_schema_keeps_data(app, tmp_path):
+    upgraded = connect(str(tmp_path / 'upgraded.db'))
+    migrations.migrate(upgraded, target=1)
+    with transaction(upgraded, immediate=True):
+        upgraded.executemany("INSERT INTO products (sku, name, price, quantity) VALUES (?, ?, 100, ?)",
+                             [('LOW001', '在庫僅少の商品', 5), ('OK002', '在庫十分な商品', 50)])
+        upgraded.executemany(
+            "INSERT INTO sales_history (product_id, product_name, quantity, unit_price, total_amount, created_at) "
+            "VALUES (?, ?, ?, 100, ?, ?)",
+            [(1, '在庫僅少の商品', 2, 200, '2023-05-01 10:00:00'), (2, '在庫十分な商品', 3, 300, '2024-06-01 10:00:00')])
+    assert stats.read_stats(upgraded.cursor())['low_stock_count'] == 1
+
+    applied = migrations.migrate(upgraded)
+    assert [item['version'] for item in applied] == [item.version for item in migrations.MIGRATIONS[1:]]
+    assert 'product_name' not in columns(upgraded, 'sales_history')
+    assert upgraded.execute("SELECT reorder_point FROM products ORDER BY id").fetchall() == [(10,), (10,)]
+    assert stats.verify_stats(upgraded.cursor()) == {}
+    assert upgraded.execute("SELECT SUM(amount) FROM sales_monthly").fetchone()[0] == 500
+
+    # 発注点を使う在庫僅少のトリガー
+    with transaction(upgraded, immediate=True):
+        upgraded.execute("UPDATE products SET reorder_point = 60 WHERE id = 2")
+    assert stats.read_stats(upgraded.cursor())['low_stock_count'] == 2
+    # アーカイブへ移した年の行の削除では累計売上を減らさない
+    with transaction(upgraded, immediate=True):
+        upgraded.execute("INSERT INTO sales_partitions (year, file) VALUES (2023, 'test-sales-2023.db')")
+        upgraded.execute("DELETE FROM sales_history WHERE created_at < '2024-01-01'")
+    assert stats.read_stats(upgraded.cursor())['total_sales'] == 500
+    upgraded.close()
+
+
+def test_upgraded_schema_matches_new_database(conn, tmp_path):
+    upgraded = connect(str(tmp_path / 'upgraded.db'))
+    for version in range(1, migrations.MIGRATIONS[-1].version + 1):
+        migrations.migrate(upgraded, target=version)
+    assert schema(upgraded) == schema(conn)
+    assert migrations.pending(upgraded) == []
+    assert migrations.migrate(upgraded) == []
+    upgraded.close()
+
+
+def test_drop_column_copies_in_chunks_while_other_connections_write(app, tmp_path, monkeypatch):
+    path = str(tmp_path / 'chunked.db')
+    upgraded = connect(path)
+    migrations.migrate(upgraded, target=1)
+    with transaction(upgraded, immediate=True):
+        upgraded.execute("INSERT INTO products (sku, name, price, quantity) VALUES ('A001', '商品A', 100, 5)")
+        upgraded.executemany(
+            "INSERT INTO sales_history (product_id, product_name, quantity, unit_price, total_amount) "
+            "VALUES (1, '商品A', 1, 100, ?)", [(amount,) for amount in range(1, 101)])
+        upgraded.execute("DELETE FROM sales_history WHERE id = 100")
+    app.config.update(MIGRATION_CHUNK_SIZE=10, MIGRATION_CHUNK_PAUSE=0)
+
+    # コピーのチャンクの合間に別の接続から追加・変更・削除する（書き込みロックは保持されていない）
+    other = connect(path)
+    writes = []
+
+    def write_between_chunks(seconds):
+        if 'product_name' not in columns(other, 'sales_history'):
+            return  # 入れ替え後は元のテーブルの行をチャンクごとに削除している
+        writes.append(seconds)
+        with transaction(other, immediate=True):
+            other.execute("INSERT INTO sales_history (product_id, product_name, quantity, unit_price, total_amount) "
+                          "VALUES (1, '商品A', 1, 100, 1000)")
+            other.execute("UPDATE sales_history SET total_amount = total_amount * 10 WHERE id = ?", (len(writes),))
+            other.execute("DELETE FROM sales_history WHERE id = ?", (50 + len(writes),))
+
+    monkeypatch.setattr(migrations.time, 'sleep', write_between_chunks)
+    migrations.migrate(upgraded, target=2)
+    expected = other.execute("SELECT id, total_amount FROM sales_history ORDER BY id").fetchall()
+    other.close()
+
+    assert len(writes) == 10
+    assert 'product_name' not in columns(upgraded, 'sales_history')
+    assert upgraded.execute("SELECT id, total_amount FROM sales_history ORDER BY id").fetchall() == expected
+    assert upgraded.execute("SELECT SUM(total_amount) FROM sales_history").fetchone()[0] == \
+        upgraded.execute("SELECT total_sales FROM dashboard_stats").fetchone()[0]
+    # 削除済みの番号は再利用しない
+    with transaction(upgraded, immediate=True):
+        upgraded.execute("INSERT INTO sales_history (product_id, quantity, unit_price, total_amount) "
+                         "VALUES (1, 1, 100, 100)")
+    assert upgraded.execute("SELECT MAX(id) FROM sales_history").fetchone()[0] == 111
+    assert not upgraded.execute("SELECT name FROM sqlite_master WHERE name GLOB '_re*'").fetchall()
+    upgraded.close()
+
+
+def test_interrupted_drop_column_resumes(app, tmp_path, monkeypatch):
+    upgraded = connect(str(tmp_path / 'resumed.db'))
+    migrations.migrate(upgraded, target=1)
+    with transaction(upgraded, immediate=True):
+        upgraded.executemany(
+            "INSERT INTO sales_history (product_id, product_name, quantity, unit_price, total_amount) "
+            "VALUES (1, '商品A', 1, 100, ?)", [(amount,) for amount in range(1, 51)])
+    app.config.update(MIGRATION_CHUNK_SIZE=10, MIGRATION_CHUNK_PAUSE=0)
+
+    interrupted = []
+
+    def interrupt(seconds):
+        # 1回目はコピー中、2回目は入れ替えた後に中断する
+        if not interrupted or 'product_name' not in columns(upgraded, 'sales_history'):
+            interrupted.append(seconds)
+            raise KeyboardInterrupt
+
+    # コピー中と、入れ替えた元のテーブルの削除中に中断しても、次回続きから実行する
+    monkeypatch.setattr(migrations.time, 'sleep', interrupt)
+    with pytest.raises(KeyboardInterrupt):
+        migrations.migrate(upgraded, target=2)
+    assert 'product_name' in columns(upgraded, 'sales_history')
+    with pytest.raises(KeyboardInterrupt):
+        migrations.migrate(upgraded, target=2)
+    assert 'product_name' not in columns(upgraded, 'sales_history')
+    assert migrations.current_version(upgraded) == 1
+    monkeypatch.undo()
+
+    migrations.migrate(upgraded, target=2)
+    assert migrations.current_version(upgraded) == 2
+    assert upgraded.execute("SELECT COUNT(*), SUM(total_amount) FROM sales_history").fetchone() == (50, 1275)
+    assert not upgraded.execute("SELECT name FROM sqlite_master WHERE name GLOB '_re*'").fetchall()
+    upgraded.close()
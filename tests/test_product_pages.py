@@ -0,0 +1,24 @@
+"""商品一覧のページング（画面の一覧・商品セレクトボックスが使う limit と X-Next-Cursor）"""
+from urllib.parse import quote
+
+
+def ids(response):
+    data = response.get_json()
+    return [row[data['columns'].index('id')] for row in data['rows']]
+
+
+def test_pages_cover_the_full_list_once(client):
+    everything = ids(client.get('/api/products?format=columns'))
+    assert len(everything) > 3
+
+    paged, cursor = [], None
+    while True:
+        url = '/api/products?format=columns&limit=3' + (f'&cursor={quote(cursor)}' if cursor else '')
+        response = client.get(url)
+        assert response.status_code == 200
+        paged.extend(ids(response))
+        cursor = response.headers.get('X-Next-Cursor')
+        if not cursor:
+            break
+    assert paged == everything
+
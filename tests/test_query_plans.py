@@ -0,0 +1,62 @@
+"""主な検索がインデックスを使うことを EXPLAIN QUERY PLAN で確かめる"""
+import products
+import sales
+
+
+class RecordingCursor:
+    """実行したSQLとパラメータを記録するカーソル"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.statements = []
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def execute(self, sql, parameters=()):
+        self.statements.append((sql, parameters))
+        return self._cursor.execute(sql, parameters)
+
+
+def query_plan(conn, function):
+    """function(cursor) が最後に実行したSQLの実行計画（detail 列の一覧）"""
+    cursor = RecordingCursor(conn.cursor())
+    function(cursor)
+    sql, parameters = cursor.statements[-1]
+    return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, parameters)]
+
+
+def uses(plan, line):
+    return any(detail.startswith(line) for detail in plan)
+
+
+def test_history_page_searches_created_at_index(conn):
+    plan = query_plan(conn, lambda cursor: sales.history_page(cursor, '2024-01-01', '2024-02-01'))
+    assert uses(plan, 'SEARCH main.sales_history USING INDEX idx_sales_history_created_at (created_at>? AND created_at<?)')
+
+
+def test_history_page_without_range_reads_created_at_index(conn):
+    plan = query_plan(conn, lambda cursor: sales.history_page(cursor))
+    assert uses(plan, 'SCAN main.sales_history USING INDEX idx_sales_history_created_at')
+
+
+def test_product_totals_searches_created_at_index(conn):
+    plan = query_plan(conn, lambda cursor: sales.product_totals(cursor, '2024-01-01', '2024-02-01'))
+    assert uses(plan, 'SEARCH main.sales_history USING INDEX idx_sales_history_created_at (created_at>? AND created_at<?)')
+
+
+def test_search_by_price_uses_price_index(conn):
+    plan = query_plan(conn, lambda cursor: products.search(cursor, '1200', field='price'))
+    assert uses(plan, 'SEARCH p USING INDEX idx_products_price (price=?)')
+
+
+def test_sort_by_price_uses_price_index(conn):
+    plan = query_plan(conn, lambda cursor: products.search(cursor, sort='price', limit=20))
+    assert 'SCAN p USING INDEX idx_products_price' in plan
+    assert not uses(plan, 'USE TEMP B-TREE')
+
+
+def test_history_rows_reads_created_at_index_without_sorting(conn):
+    plan = query_plan(conn, lambda cursor: sales.history_rows(cursor))
+    assert uses(plan, 'SCAN main.sales_history USING INDEX idx_sales_history_created_at')
+    assert not uses(plan, 'USE TEMP B-TREE')
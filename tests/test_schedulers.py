@@ -0,0 +1,23 @@
+"""定期処理と中断したアーカイブの移動のスレッドをワーカー（最初のリクエスト）で起動するテスト"""
+import app as application
+import archive
+import backup
+import reorder
+
+
+def test_schedulers_start_on_first_request(app, client, monkeypatch):
+    started = []
+    monkeypatch.setattr(backup, 'start_scheduler', lambda app, interval: started.append(('backup', interval)))
+    monkeypatch.setattr(reorder, 'start_scheduler', lambda app, interval: started.append(('reorder', interval)))
+    monkeypatch.setattr(archive, 'start_resume', lambda app, conn: started.append(('archive', None)))
+    monkeypatch.setattr(application, '_schedulers_pid', None)
+    app.config.update(BACKUP_INTERVAL=600, REORDER_INTERVAL=3600)
+
+    # create_app（gunicorn --preload ではマスタープロセス）では起動しない
+    application.create_app({'DATABASE_PATH': app.config['DATABASE_PATH'], 'INIT_DATABASE': False,
+                            'BACKUP_INTERVAL': 600, 'REORDER_INTERVAL': 3600})
+    assert started == []
+
+    client.get('/api/products')
+    client.get('/api/products')
+    assert started == [('backup', 600), ('reorder', 3600), ('archive', None)]
@@ -0,0 +1,71 @@
+"""在庫の引当（inventory.reserve_stock）と売上登録で在庫がマイナスにならないこと"""
+import threading
+
+from db import get_db, transaction
+import inventory
+import sales
+
+
+def add_product(conn, quantity, sku='TEST001'):
+    with transaction(conn, immediate=True):
+        cursor = conn.execute("INSERT INTO products (sku, name, price, quantity) VALUES (?, 'テスト商品', 100, ?)",
+                              (sku, quantity))
+    return cursor.lastrowid
+
+
+def quantity_of(conn, product_id):
+    return conn.execute("SELECT quantity FROM products WHERE id = ?", (product_id,)).fetchone()[0]
+
+
+def test_reserve_stock_decrements_when_enough(conn):
+    product_id = add_product(conn, 5)
+    with transaction(conn, immediate=True):
+        assert inventory.reserve_stock(conn, product_id, 5) is None
+    assert quantity_of(conn, product_id) == 0
+
+
+def test_reserve_stock_rejects_shortage_without_writing(conn):
+    product_id = add_product(conn, 2)
+    with transaction(conn, immediate=True):
+        assert inventory.reserve_stock(conn, product_id, 3) == '在庫が不足しています'
+    assert quantity_of(conn, product_id) == 2
+
+
+def test_reserve_stock_unknown_product(conn):
+    with transaction(conn, immediate=True):
+        assert inventory.reserve_stock(conn, 999, 1) == '商品が見つかりません'
+
+
+def test_rejected_sale_writes_no_history(conn):
+    product_id = add_product(conn, 1)
+    with transaction(conn, immediate=True):
+        assert sales.apply_sale(conn, product_id, 2, 100) == '在庫が不足しています'
+    assert conn.execute("SELECT COUNT(*) FROM sales_history").fetchone()[0] == 0
+    assert quantity_of(conn, product_id) == 1
+
+
+def test_concurrent_sales_never_oversell(app, client):
+    # 各スレッドは自分の接続で書き込む（db.get_db はスレッドごと）
+    product_id = add_product(get_db(), 20)
+    results = []
+
+    def sell():
+        seller = app.test_client()
+        with seller.session_transaction() as sess:
+            sess['user_id'] = 1
+            sess['username'] = 'admin'
+            sess['role'] = 'admin'
+        for _ in range(10):
+            response = seller.post('/api/sales', json={'product_id': product_id, 'quantity': 1, 'price': 100})
+            results.append(response.get_json()['success'])
+
+    threads = [threading.Thread(target=sell) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    conn = get_db()
+    assert results.count(True) == 20
+    assert quantity_of(conn, product_id) == 0
+    assert conn.execute("SELECT COUNT(*) FROM sales_history WHERE product_id = ?", (product_id,)).fetchone()[0] == 20
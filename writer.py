@@ -0,0 +1,129 @@
+"""売上・入出庫の書き込み（グループコミット）
+
+GROUP_COMMIT=1 の場合、売上・入庫・出庫の書き込みはリクエストのスレッドでは行わず、
+プロセスごとに1つの書き込みスレッドに渡す。書き込みスレッドは最初の操作を受け取ってから
+GROUP_COMMIT_WINDOW_MS ミリ秒（または GROUP_COMMIT_MAX_BATCH 件）まで操作を集め、
+1つのトランザクションでまとめて適用する。BEGIN IMMEDIATE・COMMIT（同期書き込み）と
+書き込みロックの取り合いが操作ごとではなくまとまりごとになる。
+
+各操作はセーブポイントの中で実行するので、在庫不足などの結果は操作ごとに返り、
+1件の例外でほかの操作が取り消されることはない。リクエストへの応答はコミットの後なので、
+応答済みの書き込みが失われることはない（待ち時間が最大で GROUP_COMMIT_WINDOW_MS 延びる）。
+
+各操作には受け付けから GROUP_COMMIT_TIMEOUT 秒の期限がある。書き込みスレッドは期限を過ぎた操作を実行せずに
+DeadlineExceeded で失敗させるので、リクエスト側は期限を待たずに結果を待てばよく、失敗の応答を返した売上が
+後から登録されること（再送による二重登録）はない。
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from flask import current_app
+
+import config
+from db import get_db, transaction
+import metrics
+
+logger = logging.getLogger(__name__)
+
+batch_size = metrics.Histogram('group_commit_batch_size', '1回のコミットにまとめた操作数', (),
+                               (1, 2, 4, 8, 16, 32, 64, 128, 256, 512))
+commit_errors = metrics.Counter('group_commit_errors_total', 'コミットに失敗したまとまりの数')
+expired_operations = metrics.Counter('group_commit_expired_total', '期限を過ぎたため実行しなかった操作の数')
+
+
+class DeadlineExceeded(Exception):
+    """期限（GROUP_COMMIT_TIMEOUT）までに書き込みスレッドが実行できなかった（何も書き込んでいない）"""
+
+_queues = {}
+_queue_lock = threading.Lock()
+
+
+def _get_queue():
+    """プロセス・アプリごとの操作キューと書き込みスレッド（fork後は作り直す）"""
+    app = current_app._get_current_object()
+    key = (os.getpid(), app)
+    pending = _queues.get(key)
+    if pending is None:
+        with _queue_lock:
+            pending = _queues.get(key)
+            if pending is None:
+                pending = queue.SimpleQueue()
+                threading.Thread(target=_run, args=(app, pending), name='writer', daemon=True).start()
+                _queues[key] = pending
+    return pending
+
+
+def _collect(pending):
+    """最初の1件を待ち、GROUP_COMMIT_WINDOW_MS まで（最大 GROUP_COMMIT_MAX_BATCH 件）集める"""
+    batch = [pending.get()]
+    deadline = time.monotonic() + config.get('GROUP_COMMIT_WINDOW_MS') / 1000
+    max_batch = config.get('GROUP_COMMIT_MAX_BATCH')
+    while len(batch) < max_batch:
+        timeout = deadline - time.monotonic()
+        try:
+            batch.append(pending.get(timeout=timeout) if timeout > 0 else pending.get_nowait())
+        except queue.Empty:
+            break
+    return batch
+
+
+def _apply(conn, batch):
+    """まとまりを1トランザクションで適用し、(Future, 結果か例外) のリストを返す"""
+    outcomes = []
+    with transaction(conn, immediate=True):
+        for future, deadline, function, args in batch:
+            if time.monotonic() > deadline:
+                expired_operations.inc()
+                outcomes.append((future, DeadlineExceeded('混み合っているため登録できませんでした。もう一度お試しください')))
+                continue
+            conn.execute("SAVEPOINT operation")
+            try:
+                outcome = function(conn, *args)
+            except Exception as e:
+                conn.execute("ROLLBACK TO operation")
+                outcome = e
+            conn.execute("RELEASE operation")
+            outcomes.append((future, outcome))
+    return outcomes
+
+
+def _run(app, pending):
+    # 設定（データベースのパス・GROUP_COMMIT_*）は操作を渡したアプリのものを使う
+    with app.app_context():
+        conn = get_db()
+        while True:
+            batch = _collect(pending)
+            try:
+                outcomes = _apply(conn, batch)
+            except Exception as e:
+                commit_errors.inc()
+                logger.exception("グループコミットに失敗しました", extra={'operations': len(batch)})
+                outcomes = [(future, e) for future, _, _, _ in batch]
+            batch_size.observe(len(batch))
+            # 結果はコミットの後で返す
+            for future, outcome in outcomes:
+                if isinstance(outcome, Exception):
+                    future.set_exception(outcome)
+                else:
+                    future.set_result(outcome)
+
+
+def execute(function, *args):
+    """function(conn, *args) を書き込みトランザクションの中で実行して戻り値を返す
+
+    GROUP_COMMIT が有効なら書き込みスレッドでほかの操作とまとめてコミットする。
+    GROUP_COMMIT_TIMEOUT 秒以内に実行を始められなければ DeadlineExceeded を送出する（何も書き込まない）。
+    function はトランザクションを開始・終了してはならない。
+    """
+    if not config.get('GROUP_COMMIT'):
+        with transaction(get_db(), immediate=True) as conn:
+            return function(conn, *args)
+    future = Future()
+    deadline = time.monotonic() + config.get('GROUP_COMMIT_TIMEOUT')
+    _get_queue().put((future, deadline, function, args))
+    # 期限を過ぎた操作は書き込みスレッドが失敗させるので、結果は必ず返る
+    return future.result()
@@ -0,0 +1,10 @@
+"""gunicorn から読み込むアプリケーション
+
+    gunicorn wsgi:app -c gunicorn.conf.py
+
+app.py を import しただけではアプリケーションを作らない（flask --app app のコマンドや
+ベンチマーク・テストは create_app() で必要な設定のアプリを作る）。
+"""
+from app import create_app
+
+app = create_app()